@@ -0,0 +1,158 @@
+# address_index.py
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BASE58_INDEX = {char: i for i, char in enumerate(BASE58_ALPHABET)}
+
+# Wallet store keys that hold addresses (see Database.save_user_wallet)
+WALLET_FIELDS = ('ethereum', 'solana')
+
+def base58_decode(value: str) -> bytes:
+    """Decode a base58 string (Solana public keys)"""
+    number = 0
+    for char in value:
+        number = number * 58 + BASE58_INDEX[char]
+    leading_zeros = len(value) - len(value.lstrip('1'))
+    body = number.to_bytes((number.bit_length() + 7) // 8, 'big') if number else b''
+    return b'\x00' * leading_zeros + body
+
+def base58_encode(raw: bytes) -> str:
+    """Encode bytes as base58"""
+    number = int.from_bytes(raw, 'big')
+    chars = []
+    while number:
+        number, rem = divmod(number, 58)
+        chars.append(BASE58_ALPHABET[rem])
+    leading_zeros = len(raw) - len(raw.lstrip(b'\x00'))
+    return '1' * leading_zeros + ''.join(reversed(chars))
+
+def address_key(address: str) -> Optional[bytes]:
+    """Binary key for an address: 20 bytes for EVM, 32 for Solana"""
+    if not address:
+        return None
+    try:
+        if address[:2] in ('0x', '0X'):
+            key = bytes.fromhex(address[2:])
+            return key if len(key) == 20 else None
+        key = base58_decode(address)
+        return key if len(key) == 32 else None
+    except (ValueError, KeyError):
+        return None
+
+class AddressIndex:
+    """Watched addresses stored as binary keys, each mapping to its owners
+
+    A single owner is stored as a bare int, several as a sorted tuple, so the
+    common case costs one dict slot and no container.
+    """
+
+    def __init__(self):
+        self._owners: Dict[bytes, Union[int, Tuple[int, ...]]] = {}
+        # Bumped on every change so derived structures know to rebuild
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    def __contains__(self, address: str) -> bool:
+        key = address_key(address)
+        return key is not None and key in self._owners
+
+    def add(self, address: str, user_id: int) -> bool:
+        """Watch an address for a user"""
+        key = address_key(address)
+        if key is None:
+            return False
+
+        self.version += 1
+        current = self._owners.get(key)
+        if current is None:
+            self._owners[key] = user_id
+        elif isinstance(current, int):
+            if current != user_id:
+                self._owners[key] = tuple(sorted((current, user_id)))
+        elif user_id not in current:
+            self._owners[key] = tuple(sorted(current + (user_id,)))
+        return True
+
+    def remove(self, address: str, user_id: int):
+        """Stop watching an address for a user"""
+        key = address_key(address)
+        current = self._owners.get(key)
+        if current is None:
+            return
+
+        self.version += 1
+        if isinstance(current, int):
+            if current == user_id:
+                del self._owners[key]
+            return
+
+        remaining = tuple(owner for owner in current if owner != user_id)
+        self._owners[key] = remaining[0] if len(remaining) == 1 else remaining
+
+    def owners(self, address: str) -> Tuple[int, ...]:
+        """All users watching an address"""
+        return self.owners_by_key(address_key(address))
+
+    def owners_by_key(self, key: Optional[bytes]) -> Tuple[int, ...]:
+        """All users watching an already-encoded address"""
+        current = self._owners.get(key)
+        if current is None:
+            return ()
+        return (current,) if isinstance(current, int) else current
+
+    def keys(self) -> Iterable[bytes]:
+        """Every watched address key"""
+        return self._owners.keys()
+
+    def match_activity(self, activity: List[dict]) -> List[Tuple[int, str, dict]]:
+        """Resolve every fromAddress/toAddress of a webhook payload in one pass
+
+        Returns (user_id, 'sent' | 'received', tx) for each watcher.
+        """
+        owners = self._owners
+        matches = []
+        for tx in activity:
+            for field, direction in (('fromAddress', 'sent'), ('toAddress', 'received')):
+                address = tx.get(field) or ''
+                try:
+                    key = bytes.fromhex(address[2:]) if address[:2] in ('0x', '0X') else address_key(address)
+                except ValueError:
+                    continue
+                current = owners.get(key)
+                if current is None:
+                    continue
+                if isinstance(current, int):
+                    matches.append((current, direction, tx))
+                else:
+                    for user_id in current:
+                        matches.append((user_id, direction, tx))
+        return matches
+
+    def load_wallets(self, wallets: Dict[str, Dict]) -> int:
+        """Bulk-load from the Database wallet store ({user_id: {chain: address}})"""
+        owners = self._owners
+        loaded = 0
+        for user_id_str, wallet_data in wallets.items():
+            user_id = int(user_id_str)
+            for field in WALLET_FIELDS:
+                key = address_key(wallet_data.get(field) or '')
+                if key is None:
+                    continue
+                current = owners.get(key)
+                if current is None:
+                    owners[key] = user_id
+                    loaded += 1
+                else:
+                    self.add(wallet_data[field], user_id)
+        self.version += 1
+        logger.info(f"Loaded {loaded} watched addresses")
+        return loaded
+
+    def clear(self):
+        self._owners.clear()
+        self.version += 1
@@ -1,20 +1,217 @@
 # admin.py
+"""
+Admin tools: a paged user browser and a CSV user export
+
+/users [from=YYYY-MM-DD] [to=YYYY-MM-DD] [wallet=ethereum|solana|any]
+shows matching users a page at a time with next/previous buttons. Pages
+are keyset pages over Database indexes: a button carries the
+(joined_date, user id) key of the first or last user shown, so paging
+stays O(log n) and consistent while users keep joining. The filters of
+the current browse live in the admin's user_data.
+
+/export_users takes the same filters and streams the matching users into
+a CSV file a chunk at a time, so neither the rows nor the file are held in
+memory, then sends it as a document.
+"""
+
+import asyncio
+import csv
+import logging
+import os
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import ContextTypes
-import database
+from telegram.ext import CallbackQueryHandler, CommandHandler, ContextTypes
+
+from database import ANY_WALLET, WALLET_META_KEYS
+from profiling import timed_handler
+
+logger = logging.getLogger(__name__)
+
+USERS_PAGE_SIZE = 20
+EXPORT_CHUNK = 1000
+WALLET_TYPES = ('ethereum', 'solana')
+EXPORT_FIELDS = ('user_id', 'username', 'first_name', 'joined_date', 'ethereum', 'solana')
+
+# Set by register_admin_handlers
+db = None
+admin_id = 0
+
+def parse_user_filters(args: List[str]) -> Tuple[Dict, Optional[str]]:
+    """Filters from 'from=... to=... wallet=...' arguments, or what's wrong with them"""
+    filters = {}
+    for arg in args:
+        name, _, value = arg.partition('=')
+        name, value = name.lower(), value.strip().lower()
+        if name in ('from', 'to'):
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return {}, f"{name} must be a date like 2024-01-31"
+            filters['joined_from' if name == 'from' else 'joined_to'] = value
+        elif name == 'wallet':
+            if value not in WALLET_TYPES + (ANY_WALLET,):
+                return {}, f"wallet must be one of {', '.join(WALLET_TYPES + (ANY_WALLET,))}"
+            filters['wallet_type'] = value
+        else:
+            return {}, f"Unknown filter '{arg}'"
+    return filters, None
+
+def describe_filters(filters: Dict) -> str:
+    parts = []
+    if filters.get('joined_from'):
+        parts.append(f"joined from {filters['joined_from']}")
+    if filters.get('joined_to'):
+        parts.append(f"joined until {filters['joined_to']}")
+    if filters.get('wallet_type') == ANY_WALLET:
+        parts.append("with a wallet")
+    elif filters.get('wallet_type'):
+        parts.append(f"with a {filters['wallet_type']} wallet")
+    return ', '.join(parts) or "all users"
+
+def encode_cursor(user: Dict) -> str:
+    """Compact form of a user's (joined_date, user id) key for callback data"""
+    joined = ''.join(ch for ch in user.get('joined_date', '') if ch.isdigit())
+    return f"{joined}.{user['user_id']}"
 
-# Only very small helpers here; main heavy lifting in bot.py via callbacks
-async def admin_panel(query):
-    text = "🛠️ *Admin Panel*\n\nChoose an action:"
+def decode_cursor(text: str) -> Optional[Tuple[str, int]]:
+    joined, _, user_id = text.partition('.')
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    if len(joined) == 14:
+        joined = f"{joined[:4]}-{joined[4:6]}-{joined[6:8]} {joined[8:10]}:{joined[10:12]}:{joined[12:]}"
+    elif joined:
+        return None
+    return joined, user_id
+
+def format_user(user: Dict, wallet: Optional[Dict]) -> str:
+    username = f"@{user['username']}" if user.get('username') else "-"
+    wallets = ', '.join(key for key in (wallet or {}) if key not in WALLET_META_KEYS)
+    joined = user.get('joined_date', '?')[:10]
+    return f"{user['user_id']} {username} {user.get('first_name', '')} | joined {joined}" + (
+        f" | {wallets}" if wallets else "")
+
+def render_users_page(filters: Dict, cursor: Optional[Tuple[str, int]] = None,
+                      backwards: bool = False) -> Tuple[str, InlineKeyboardMarkup]:
+    """Text and paging buttons for one page of the user browser"""
+    users, has_before, has_after = db.page_users(cursor, backwards, USERS_PAGE_SIZE, **filters)
+    total = db.count_users(**filters)
+    lines = [f"👥 Users: {total} ({describe_filters(filters)})", ""]
+    lines += [format_user(user, db.get_user_wallet(user['user_id'])) for user in users] or ["No users match."]
+
+    buttons = []
+    if users and has_before:
+        buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"admin_users:p:{encode_cursor(users[0])}"))
+    if users and has_after:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"admin_users:n:{encode_cursor(users[-1])}"))
+    keyboard = [buttons] if buttons else []
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data='admin_panel')])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+def is_admin(update: Update) -> bool:
+    return bool(admin_id) and update.effective_user.id == admin_id
+
+# Handlers
+@timed_handler
+async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not is_admin(update):
+        await query.answer("❌ Unauthorized!")
+        return
+    await query.answer()
+    text = "🛠️ Admin Panel\n\nChoose an action, or use /users and /export_users with filters."
     buttons = [
-        [InlineKeyboardButton("📋 List Users", callback_data="admin_list_users")],
-        [InlineKeyboardButton("➕ Add Airdrop (manual)", callback_data="admin_add_airdrop_manual")],
-        [InlineKeyboardButton("🧾 List Airdrops", callback_data="admin_list_airdrops")],
-        [InlineKeyboardButton("🔙 Back", callback_data="main_menu")],
+        [InlineKeyboardButton("📋 List Users", callback_data="admin_users")],
+        [InlineKeyboardButton("🔙 Back", callback_data="start")],
     ]
-    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(buttons))
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons))
+
+@timed_handler
+async def users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/users [from=YYYY-MM-DD] [to=YYYY-MM-DD] [wallet=ethereum|solana|any]"""
+    if not is_admin(update):
+        await update.message.reply_text("❌ Unauthorized!")
+        return
+    filters, error = parse_user_filters(context.args or [])
+    if error:
+        await update.message.reply_text(f"{error}\n\nFormat: /users [from=YYYY-MM-DD] [to=YYYY-MM-DD] "
+                                        f"[wallet={'|'.join(WALLET_TYPES + (ANY_WALLET,))}]")
+        return
+    context.user_data['user_browser'] = filters
+    text, markup = render_users_page(filters)
+    await update.message.reply_text(text, reply_markup=markup)
+
+@timed_handler
+async def users_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """admin_users[:<n|p>:<cursor>] buttons"""
+    query = update.callback_query
+    if not is_admin(update):
+        await query.answer("❌ Unauthorized!")
+        return
+    await query.answer()
+    filters = context.user_data.get('user_browser', {})
+    _, _, rest = query.data.partition(':')
+    direction, _, cursor_text = rest.partition(':')
+    cursor = decode_cursor(cursor_text) if cursor_text else None
+    text, markup = render_users_page(filters, cursor, backwards=direction == 'p')
+    await query.edit_message_text(text, reply_markup=markup)
+
+def _export_row(user: Dict, wallet: Optional[Dict]) -> List:
+    wallet = wallet or {}
+    return [user['user_id'], user.get('username') or '', user.get('first_name', ''), user.get('joined_date', ''),
+            wallet.get('ethereum', ''), wallet.get('solana', '')]
+
+async def write_users_csv(path: str, filters: Dict) -> int:
+    """Write the matching users to path, chunk by chunk; returns the row count"""
+    rows = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_FIELDS)
+        for users in db.iter_users(chunk_size=EXPORT_CHUNK, **filters):
+            writer.writerows(_export_row(user, db.get_user_wallet(user['user_id'])) for user in users)
+            rows += len(users)
+            # Let other updates run between chunks
+            await asyncio.sleep(0)
+    return rows
+
+@timed_handler
+async def export_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export_users [filters]: matching users as a CSV document"""
+    if not is_admin(update):
+        await update.message.reply_text("❌ Unauthorized!")
+        return
+    filters, error = parse_user_filters(context.args or [])
+    if error:
+        await update.message.reply_text(f"{error}\n\nFormat: /export_users [from=YYYY-MM-DD] [to=YYYY-MM-DD] "
+                                        f"[wallet={'|'.join(WALLET_TYPES + (ANY_WALLET,))}]")
+        return
+
+    fd, path = tempfile.mkstemp(prefix='users_', suffix='.csv')
+    os.close(fd)
+    try:
+        rows = await write_users_csv(path, filters)
+        with open(path, 'rb') as f:
+            await update.message.reply_document(
+                document=f,
+                filename=f"users-{datetime.now().strftime('%Y%m%d-%H%M%S')}.csv",
+                caption=f"👥 {rows} users ({describe_filters(filters)})"
+            )
+    except Exception as e:
+        logger.error(f"User export failed: {e}")
+        await update.message.reply_text("❌ Export failed, see the logs.")
+    finally:
+        os.remove(path)
 
-async def list_users(query):
-    users = database.list_users()
-    text = "👥 Users:\n\n" + "\n".join(str(u) for u in users[:200])
-    await query.edit_message_text(text)
+def register_admin_handlers(app, database, admin: int):
+    """Add the admin commands and buttons; register before any catch-all callback handler"""
+    global db, admin_id
+    db = database
+    admin_id = admin
+    app.add_handler(CommandHandler('users', users_command))
+    app.add_handler(CommandHandler('export_users', export_users_command))
+    app.add_handler(CallbackQueryHandler(users_page, pattern=r'^admin_users(:|$)'))
+    app.add_handler(CallbackQueryHandler(admin_panel, pattern=r'^admin_panel$'))
@@ -6,13 +6,96 @@ from telegram.ext import (
     filters,
     ContextTypes,
 )
-import os
+from telegram.helpers import escape_markdown
+from urllib.parse import urlparse
 
-ADMIN_ID = int(os.getenv("ADMIN_ID", "1377923423"))
-airdrop_list = []
+from profiling import timed_handler
+from render_cache import RenderCache
 
+# Forwarded and manual airdrops live in the Database airdrop store under
+# this category, so they survive restarts and show up in search
+AIRDROP_CATEGORY = "community"
+AIRDROP_SUBCATEGORY = "posts"
+LIST_PAGE_SIZE = 20
+# Longest name and link shown per line; keeps a full page well under
+# Telegram's 4096 character message limit
+MAX_NAME_LENGTH = 64
+MAX_LINK_LENGTH = 120
 
-def register_airdrop_handlers(app):
+# Set by register_airdrop_handlers
+db = None
+admin_id = 0
+
+# Rendered list pages by (category, subcategory, direction, cursor), dropped
+# when an airdrop of the category changes
+list_pages = RenderCache()
+
+
+def on_airdrops_changed(event: str, airdrop, previous=None):
+    """Drop cached list pages if a change touched the community category"""
+    if event == "reloaded":
+        list_pages.invalidate()
+        return
+    records = airdrop if event == "airdrops_imported" else (airdrop, previous)
+    if any(record and record["category"] == AIRDROP_CATEGORY for record in records):
+        list_pages.invalidate(AIRDROP_CATEGORY, AIRDROP_SUBCATEGORY)
+
+
+def _clip(text: str, length: int) -> str:
+    return text if len(text) <= length else text[: length - 1] + "…"
+
+
+def format_airdrop_line(airdrop: dict) -> str:
+    name = escape_markdown(_clip(airdrop["name"], MAX_NAME_LENGTH))
+    link = escape_markdown(_clip(airdrop["link"], MAX_LINK_LENGTH))
+    return f"• {name} — {link}"
+
+
+def render_list_page(cursor: int = None, backwards: bool = False):
+    """Text and paging buttons for one page of the airdrop list"""
+    airdrops, has_before, has_after = db.page_airdrops(
+        AIRDROP_CATEGORY, AIRDROP_SUBCATEGORY, cursor, backwards, LIST_PAGE_SIZE
+    )
+    if not airdrops:
+        return "📭 No airdrops added yet.", None
+
+    total = db.count_airdrops_by_category(AIRDROP_CATEGORY, AIRDROP_SUBCATEGORY)
+    lines = [f"📋 *Airdrops List* ({total}):", ""]
+    lines.extend(format_airdrop_line(airdrop) for airdrop in airdrops)
+
+    buttons = []
+    if has_before:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"list_airdrops:p:{airdrops[0]['id']}"))
+    if has_after:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"list_airdrops:n:{airdrops[-1]['id']}"))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def is_admin(user) -> bool:
+    return bool(admin_id) and user is not None and user.id == admin_id
+
+
+def valid_link(link: str) -> bool:
+    """An http(s) URL with a host, usable as an inline button url"""
+    try:
+        parsed = urlparse(link)
+    except ValueError:
+        return False
+    return parsed.scheme in ("http", "https") and bool(parsed.netloc) and not any(c.isspace() for c in link)
+
+
+def add_airdrop(name: str, link: str, description: str) -> int:
+    return db.add_airdrop(AIRDROP_CATEGORY, AIRDROP_SUBCATEGORY, name, link, description)
+
+
+def register_airdrop_handlers(app, database, admin: int, group: int = 1):
+    """Register /airdrops; the message handler goes in its own group so bot.py's still sees every message"""
+    global db, admin_id
+    db = database
+    admin_id = admin
+    db.subscribe(on_airdrops_changed)
+
+    @timed_handler
     async def airdrop_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyboard = [
             [InlineKeyboardButton("📩 Forward Airdrop Post", callback_data="forward_airdrop")],
@@ -24,60 +107,90 @@ def register_airdrop_handlers(app):
             "💰 *Airdrop Management Menu:*", parse_mode="Markdown", reply_markup=markup
         )
 
+    # Named apart from bot.py's handlers of the same name
+    @timed_handler(name='airdrop_button_handler')
     async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
 
         if query.data == "forward_airdrop":
+            if not is_admin(query.from_user):
+                await query.edit_message_text("❌ Only admin can add forwarded airdrops.")
+                return
             await query.edit_message_text("📩 Forward the airdrop post you want to add.")
             context.user_data["awaiting_forward"] = True
 
         elif query.data == "add_manual_airdrop":
-            if query.from_user.id != ADMIN_ID:
+            if not is_admin(query.from_user):
                 await query.edit_message_text("❌ Only admin can add manual airdrops.")
                 return
             await query.edit_message_text("✍️ Send the *airdrop name*.", parse_mode="Markdown")
             context.user_data["adding_manual"] = "name"
 
-        elif query.data == "list_airdrops":
-            if not airdrop_list:
-                await query.edit_message_text("📭 No airdrops added yet.")
-            else:
-                msg = "📋 *Airdrops List:*\n\n"
-                for i, a in enumerate(airdrop_list, start=1):
-                    msg += f"{i}. {a['name']} — {a.get('link', 'No link')}\n"
-                await query.edit_message_text(msg, parse_mode="Markdown")
+        elif query.data.startswith("list_airdrops"):
+            # list_airdrops[:<n|p>:<airdrop id>]
+            _, _, rest = query.data.partition(":")
+            direction, _, cursor_text = rest.partition(":")
+            cursor = int(cursor_text) if cursor_text.isdigit() else None
+            backwards = direction == "p"
+            text, markup = list_pages.get_or_render(
+                (AIRDROP_CATEGORY, AIRDROP_SUBCATEGORY, direction, cursor),
+                lambda: render_list_page(cursor, backwards),
+            )
+            await query.edit_message_text(text, parse_mode="Markdown", reply_markup=markup)
 
+    @timed_handler(name='airdrop_message_handler')
     async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         data = context.user_data
+        if not update.message or not (data.get("awaiting_forward") or data.get("adding_manual")):
+            return
+        if not is_admin(update.effective_user):
+            data.pop("awaiting_forward", None)
+            data.pop("adding_manual", None)
+            data.pop("manual_name", None)
+            return
 
         if data.get("awaiting_forward"):
             msg = update.message
-            if msg.forward_from_chat:
-                chat_title = msg.forward_from_chat.title or "Unnamed Channel"
-                link = (
-                    f"https://t.me/{msg.forward_from_chat.username}"
-                    if msg.forward_from_chat.username
-                    else "No link"
-                )
-                airdrop_list.append({"name": chat_title, "link": link})
-                await msg.reply_text(f"✅ Added airdrop from *{chat_title}*", parse_mode="Markdown")
-            else:
+            chat = msg.forward_from_chat
+            if not chat:
                 await msg.reply_text("❌ Please forward a valid channel post.")
-            data.clear()
+            elif not chat.username:
+                # A private channel has no public link to open
+                await msg.reply_text("❌ That channel has no public username, add it manually with a link instead.")
+            else:
+                chat_title = chat.title or "Unnamed Channel"
+                add_airdrop(chat_title, f"https://t.me/{chat.username}",
+                            msg.text or msg.caption or f"Forwarded from {chat_title}")
+                await msg.reply_text(
+                    f"✅ Added airdrop from *{escape_markdown(chat_title)}*", parse_mode="Markdown"
+                )
+            data.pop("awaiting_forward", None)
 
         elif data.get("adding_manual") == "name":
-            data["manual_name"] = update.message.text
+            name = (update.message.text or "").strip()
+            if not name:
+                await update.message.reply_text("❌ Send the airdrop name as text.")
+                return
+            data["manual_name"] = name
             data["adding_manual"] = "link"
             await update.message.reply_text("🔗 Now send the *airdrop link*.", parse_mode="Markdown")
 
         elif data.get("adding_manual") == "link":
-            link = update.message.text
+            link = (update.message.text or "").strip()
+            if not valid_link(link):
+                await update.message.reply_text("❌ The link must be an http:// or https:// URL. Send it again.")
+                return
             name = data.get("manual_name", "Unnamed")
-            airdrop_list.append({"name": name, "link": link})
+            add_airdrop(name, link, "Added manually")
             await update.message.reply_text(f"✅ Airdrop '{name}' added successfully!")
-            data.clear()
+            data.pop("adding_manual", None)
+            data.pop("manual_name", None)
 
+    # Registered before bot.py's catch-all CallbackQueryHandler, which would
+    # otherwise take these callbacks in the same group
     app.add_handler(CommandHandler("airdrops", airdrop_menu))
-    app.add_handler(CallbackQueryHandler(button_handler))
-    app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, message_handler))
+    app.add_handler(CallbackQueryHandler(
+        button_handler, pattern=r"^(forward_airdrop|add_manual_airdrop|list_airdrops(:.*)?)$"
+    ))
+    app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, message_handler), group=group)
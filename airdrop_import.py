@@ -0,0 +1,172 @@
+# airdrop_import.py
+"""
+Bulk airdrop import from CSV or JSON files
+
+The file is read incrementally: CSV row by row, JSON (an array of objects
+or one object per line) object by object with raw_decode over a small
+buffer, so only the valid rows are kept and memory stays bounded by the
+import itself. Rows are validated the way /add_airdrop would see them and
+the caller inserts the valid ones with one Database.add_airdrops call.
+"""
+
+import csv
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+FIELDS = ('category', 'subcategory', 'name', 'link', 'description')
+CATEGORIES = {
+    'testnet': {'l1', 'l2', 'others'},
+    'mainnet': {'trading', 'non_trading'},
+}
+
+# The Bot API only lets bots download files up to 20 MB
+MAX_IMPORT_BYTES = 20 * 1024 * 1024
+MAX_IMPORT_ROWS = int(os.getenv('MAX_IMPORT_ROWS', '100000'))
+MAX_NAME_LENGTH = 128
+MAX_DESCRIPTION_LENGTH = 2000
+# Errors listed in the report; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+READ_SIZE = 64 * 1024
+# A JSON object that still doesn't parse after this much text is malformed
+MAX_JSON_OBJECT_SIZE = 256 * 1024
+
+class ImportResult:
+    """Valid rows plus what was wrong with the others"""
+
+    def __init__(self):
+        self.rows: List[Dict] = []
+        self.read = 0
+        self.error_count = 0
+        self.errors: List[Tuple[int, str]] = []
+        # Set when the file itself couldn't be read to the end
+        self.fatal: Optional[str] = None
+
+    def add_error(self, row_number: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+def validate_row(row: Dict, seen_links: Set[str]) -> Tuple[Optional[Dict], Optional[str]]:
+    """Normalized airdrop fields for a row, or why it can't be imported"""
+    if not isinstance(row, dict):
+        return None, "not an object"
+    values = {}
+    for field in FIELDS:
+        value = row.get(field)
+        values[field] = '' if value is None else str(value).strip()
+    missing = [field for field in FIELDS if not values[field]]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+
+    category = values['category'] = values['category'].lower()
+    subcategory = values['subcategory'] = values['subcategory'].lower()
+    if category not in CATEGORIES:
+        return None, f"unknown category '{category}'"
+    if subcategory not in CATEGORIES[category]:
+        return None, f"unknown {category} subcategory '{subcategory}'"
+    if not values['link'].startswith(('https://', 'http://')):
+        return None, "link must start with http:// or https://"
+    if len(values['name']) > MAX_NAME_LENGTH:
+        return None, f"name longer than {MAX_NAME_LENGTH} characters"
+    if len(values['description']) > MAX_DESCRIPTION_LENGTH:
+        return None, f"description longer than {MAX_DESCRIPTION_LENGTH} characters"
+    if values['link'] in seen_links:
+        return None, "duplicate link"
+    return values, None
+
+def iter_csv_rows(f) -> Iterator[Tuple[int, Dict]]:
+    """(line number, row) for each CSV record; the header names the fields"""
+    reader = csv.DictReader(f)
+    if reader.fieldnames is None:
+        return
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    missing = [field for field in FIELDS if field not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"CSV header is missing {', '.join(missing)}")
+    for row in reader:
+        yield reader.line_num, row
+
+def iter_json_rows(f) -> Iterator[Tuple[int, Dict]]:
+    """(item number, object) from a JSON array or JSON Lines text file"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    number = 0
+    in_array = None
+
+    while True:
+        # Skip whitespace and the separators between items
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position == len(buffer):
+            if eof:
+                if in_array:
+                    raise ValueError("JSON array is not closed")
+                return
+            chunk = f.read(READ_SIZE)
+            eof = not chunk
+            buffer, position = chunk, 0
+            continue
+
+        if in_array is None:
+            in_array = buffer[position] == '['
+            if in_array:
+                position += 1
+                continue
+        if in_array and buffer[position] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+            # A bare number may continue past the end of what was read so far
+            truncated = end == len(buffer) and not eof and not isinstance(item, (dict, list, str))
+        except json.JSONDecodeError as e:
+            # Probably cut off by the read boundary; read on unless the item is absurdly large
+            if eof or len(buffer) - position > MAX_JSON_OBJECT_SIZE:
+                raise ValueError(f"Invalid JSON in item {number + 1}: {e.msg}")
+            truncated = True
+        if truncated:
+            chunk = f.read(READ_SIZE)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+
+        number += 1
+        yield number, item
+        position = end
+        if position > READ_SIZE:
+            buffer, position = buffer[position:], 0
+
+def read_import_file(path: str, kind: str, existing_links: Iterable[str] = ()) -> ImportResult:
+    """Validate every row of a 'csv' or 'json' file"""
+    result = ImportResult()
+    seen_links = set(existing_links)
+    iter_rows = iter_csv_rows if kind == 'csv' else iter_json_rows
+    try:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            for row_number, row in iter_rows(f):
+                if result.read >= MAX_IMPORT_ROWS:
+                    result.fatal = f"Stopped after {MAX_IMPORT_ROWS} rows"
+                    break
+                result.read += 1
+                airdrop, error = validate_row(row, seen_links)
+                if error:
+                    result.add_error(row_number, error)
+                    continue
+                seen_links.add(airdrop['link'])
+                result.rows.append(airdrop)
+    except (ValueError, csv.Error) as e:
+        result.fatal = str(e)
+    return result
+
+def import_kind(file_name: Optional[str], mime_type: Optional[str]) -> Optional[str]:
+    """'csv' or 'json' for an uploaded document, None for anything else"""
+    extension = os.path.splitext(file_name or '')[1].lower()
+    if extension in ('.csv', '.json', '.jsonl'):
+        return 'csv' if extension == '.csv' else 'json'
+    if mime_type in ('text/csv', 'application/json'):
+        return 'csv' if mime_type == 'text/csv' else 'json'
+    return None
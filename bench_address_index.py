@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Watched-address index benchmark
+
+Reports bytes per address and lookup throughput for AddressIndex, next to the
+lowercase-hex dict it replaced.
+
+    python bench_address_index.py --addresses 1000000
+"""
+
+import argparse
+import gc
+import os
+import random
+import time
+import tracemalloc
+
+from address_index import AddressIndex
+from bench_utils import print_report
+
+def measure_bytes(build):
+    """Bytes retained by whatever build() returns, and the object itself"""
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    obj = build()
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return after - before, obj
+
+def rate(count: int, elapsed: float) -> int:
+    return int(count / elapsed) if elapsed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--addresses', type=int, default=200_000)
+    parser.add_argument('--shared', type=float, default=0.05, help='fraction of addresses watched by a second user')
+    parser.add_argument('--lookups', type=int, default=500_000)
+    parser.add_argument('--payload-size', type=int, default=50, help='activities per simulated webhook payload')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    addresses = ['0x' + os.urandom(20).hex() for _ in range(args.addresses)]
+    # Keep the source strings alive outside the measured structures
+    owners = list(range(1, args.addresses + 1))
+
+    def build_index():
+        index = AddressIndex()
+        for address, user_id in zip(addresses, owners):
+            index.add(address, user_id)
+        for address in rng.sample(addresses, int(args.addresses * args.shared)):
+            index.add(address, args.addresses + 1)
+        return index
+
+    def build_str_dict():
+        return {address.lower(): user_id for address, user_id in zip(addresses, owners)}
+
+    index_bytes, index = measure_bytes(build_index)
+    dict_bytes, str_dict = measure_bytes(build_str_dict)
+
+    # Mixed probe set: half watched, half random
+    probes = [rng.choice(addresses) if i % 2 else '0x' + os.urandom(20).hex() for i in range(args.lookups)]
+
+    start = time.perf_counter()
+    for address in probes:
+        index.owners(address)
+    single_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for address in probes:
+        str_dict.get(address.lower())
+    dict_elapsed = time.perf_counter() - start
+
+    payloads = []
+    for i in range(0, len(probes) - 1, args.payload_size * 2):
+        chunk = probes[i:i + args.payload_size * 2]
+        payloads.append([
+            {'fromAddress': chunk[j], 'toAddress': chunk[j + 1]}
+            for j in range(0, len(chunk) - 1, 2)
+        ])
+
+    start = time.perf_counter()
+    matched = 0
+    for activity in payloads:
+        matched += len(index.match_activity(activity))
+    batch_elapsed = time.perf_counter() - start
+
+    print_report('Address Index Benchmark', {
+        'population': {
+            'addresses': len(index),
+            'multi_owner': int(args.addresses * args.shared),
+        },
+        'memory': {
+            'index_bytes_per_address': round(index_bytes / len(index), 1),
+            'str_dict_bytes_per_address': round(dict_bytes / len(str_dict), 1),
+        },
+        'throughput': {
+            'owners_lookups_per_s': rate(len(probes), single_elapsed),
+            'str_dict_lookups_per_s': rate(len(probes), dict_elapsed),
+            'batch_addresses_per_s': rate(len(probes), batch_elapsed),
+            'batch_payloads_per_s': rate(len(payloads), batch_elapsed),
+            'batch_matches': matched,
+        },
+    })
+
+if __name__ == '__main__':
+    main()
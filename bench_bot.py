@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Load test of the whole bot with simulated Telegram users
+
+Builds the real Application from bot.py (every handler of bot.py, wallet.py,
+airdrop.py and the other modules registered) and feeds it synthetic updates
+in-process, as if each simulated user were tapping through the bot: /start,
+airdrop menus and pages, /airdrops and its community list, connecting a
+wallet (half through the wallet menu, half through /connect_wallet),
+/balance, the per-network balance buttons, and a support message. The
+admin-only flows of admin.py and airdrop.py are not exercised. Each user
+waits for the bot to finish an update, then thinks for an exponentially
+distributed --think seconds before the next one.
+
+The Bot API, the EVM and Solana nodes and the price API are the stand-ins
+from stubs.py, served from their own thread so they don't compete with the
+bot's event loop. Reports throughput, latency percentiles per route, event
+loop lag, Database write volume and memory.
+
+    python bench_bot.py --users 2000 --think 1.0
+    python bench_bot.py --save-baseline bench_bot_baseline.json
+    python bench_bot.py --baseline bench_bot_baseline.json --tolerance 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from bench_utils import latency_summary, peak_rss_mb, percentile, print_report
+
+TOKEN = '123456:bench-bot'
+ADMIN_ID = 5
+AIRDROP_CATEGORIES = {
+    'testnet': ('l1', 'l2', 'others'),
+    'mainnet': ('trading', 'non_trading'),
+}
+LOOP_LAG_INTERVAL = 0.05
+
+class Services:
+    """Stand-in servers on a loop of their own thread"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def start(self, server):
+        self.run(server.start())
+        return server
+
+    def stop(self, *servers):
+        for server in servers:
+            self.run(server.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+def seed_data(path: str, args, rng: random.Random):
+    """bot_data.json with --existing-users users and --airdrops airdrops, so saves are realistic size"""
+    joined = datetime.now() - timedelta(days=365)
+    users = {}
+    for user_id in range(1_000_000, 1_000_000 + args.existing_users):
+        joined += timedelta(seconds=rng.randint(1, 3000))
+        users[str(user_id)] = {
+            'user_id': user_id,
+            'username': f'user{user_id}',
+            'first_name': f'User{user_id}',
+            'joined_date': joined.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+    wallets = {
+        user_id: {'ethereum': '0x' + rng.getrandbits(160).to_bytes(20, 'big').hex(), 'notifications': True}
+        for user_id in rng.sample(sorted(users), args.existing_users // 4)
+    }
+    from airdrop import AIRDROP_CATEGORY, AIRDROP_SUBCATEGORY
+
+    airdrops = []
+    sections = [(category, subcategory) for category, subcategories in AIRDROP_CATEGORIES.items()
+                for subcategory in subcategories]
+    # airdrop.py's /airdrops list
+    sections.append((AIRDROP_CATEGORY, AIRDROP_SUBCATEGORY))
+    for airdrop_id in range(1, args.airdrops + 1):
+        category, subcategory = sections[airdrop_id % len(sections)]
+        airdrops.append({
+            'id': airdrop_id,
+            'category': category,
+            'subcategory': subcategory,
+            'name': f'Project {airdrop_id}',
+            'link': f'https://example.com/airdrop/{airdrop_id}',
+            'description': f'Bench airdrop {airdrop_id} for {category} {subcategory}',
+            'added_date': '2024-01-01 00:00:00',
+        })
+    data = {
+        'users': users,
+        'wallets': wallets,
+        'airdrops': airdrops,
+        'support_messages': [],
+        'airdrop_counter': args.airdrops,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+class UpdateFactory:
+    """Update dicts shaped like the ones stubs.FakeBotApi hands out"""
+
+    def __init__(self):
+        self.next_id = 1
+
+    def _next(self) -> int:
+        update_id = self.next_id
+        self.next_id += 1
+        return update_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'bench{user_id}'}
+
+    def message(self, user_id: int, text: str) -> dict:
+        update_id = self._next()
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        update_id = self._next()
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'Bot'},
+                'text': '...',
+            },
+        }}
+
+def user_script(user_id: int, address: str, args, rng: random.Random):
+    """(route, kind, payload) steps of one session"""
+    category = rng.choice(list(AIRDROP_CATEGORIES))
+    subcategory = rng.choice(AIRDROP_CATEGORIES[category])
+    steps = [
+        ('start', 'message', '/start'),
+        ('menu', 'callback', 'airdrops'),
+        ('menu', 'callback', f'airdrop_{category}'),
+        ('category_page', 'callback', f'{category}_{subcategory}'),
+    ]
+    if args.airdrops:
+        steps.append(('view_airdrop', 'callback', f'view_airdrop_{rng.randint(1, args.airdrops)}'))
+    steps += [
+        ('airdrops_command', 'message', '/airdrops'),
+        ('community_list', 'callback', 'list_airdrops'),
+        ('start', 'callback', 'start'),
+    ]
+    # Both ways of connecting a wallet
+    if user_id % 2:
+        steps += [
+            ('menu', 'callback', 'wallet'),
+            ('menu', 'callback', 'connect_wallet'),
+            ('menu', 'callback', 'wallet_ethereum'),
+            ('connect_wallet', 'message', address),
+        ]
+    else:
+        steps += [
+            ('connect_wallet_start', 'message', '/connect_wallet'),
+            ('connect_wallet_chain', 'callback', 'chain_ethereum'),
+            ('connect_wallet', 'message', address),
+        ]
+    steps += [
+        ('balance', 'message', '/balance'),
+        ('menu', 'callback', 'wallet'),
+        ('menu', 'callback', 'check_balance'),
+        ('network_balance', 'callback', rng.choice(('balance_eth', 'balance_arb', 'balance_base'))),
+        ('menu', 'callback', 'help'),
+        ('support_message', 'message', f'Bench support question from {user_id}'),
+    ]
+    return steps
+
+async def sample_loop_lag(samples: list, stop: asyncio.Event):
+    """Same measure as metrics.monitor_event_loop_lag, kept as samples"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        samples.append(max(0.0, loop.time() - expected))
+
+def rss_mb() -> float:
+    """Current resident set size in MB (Linux), else the peak"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / (1024 * 1024)
+    except OSError:
+        return peak_rss_mb()
+
+async def run(args, services: Services, nodes: dict, api) -> dict:
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    import bot
+    import prices
+    import wallet
+    from database import SAVE_BYTES, SAVE_DURATION
+
+    # Balances come from the stand-in nodes
+    wallet.ETH_RPC = nodes['eth'].url
+    wallet.ARBITRUM_RPC = nodes['arbitrum'].url
+    wallet.BASE_RPC = nodes['base'].url
+    wallet.SOLANA_RPC = nodes['solana'].url
+    bot.ALCHEMY_API_KEY = 'bench'
+    for network, chain in (('eth', 'eth'), ('arb', 'arbitrum'), ('base', 'base')):
+        bot.WEB3_NETWORKS[network] = (bot.WEB3_NETWORKS[network][0], nodes[chain].url)
+    prices.prices.api_url = nodes['prices'].url
+
+    rng = random.Random(args.seed)
+    addresses = {}
+    for user_id in range(1, args.users + 1):
+        address = '0x' + rng.getrandbits(160).to_bytes(20, 'big').hex()
+        addresses[user_id] = address
+        for chain in ('eth', 'arbitrum', 'base'):
+            nodes[chain].balances[address] = rng.randint(0, 10 * 10**18)
+
+    await asyncio.to_thread(bot.db.load_data)
+    bot.load_watched_addresses(bot.db.get_all_wallets())
+    prices.start_price_service()
+
+    application = bot.build_application(updater=False)
+    pending = {}
+    errors = []
+
+    async def mark_done(update, context):
+        future = pending.pop(update.update_id, None)
+        if future and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def count_error(update, context):
+        errors.append(repr(context.error))
+
+    # After every other group, so it marks the end of the update's handling
+    application.add_handler(TypeHandler(Update, mark_done), group=1000)
+    application.add_error_handler(count_error)
+
+    await application.initialize()
+    await application.start()
+
+    save_child = SAVE_BYTES.labels()
+    save_time_child = SAVE_DURATION.labels()
+    saves_before, bytes_before, save_s_before = sum(save_child.counts), save_child.sum, save_time_child.sum
+    rss_before = rss_mb()
+
+    factory = UpdateFactory()
+    latencies = defaultdict(list)
+    timeouts = 0
+
+    async def send(route: str, kind: str, user_id: int, payload: str):
+        nonlocal timeouts
+        data = factory.message(user_id, payload) if kind == 'message' else factory.callback(user_id, payload)
+        update = Update.de_json(data, application.bot)
+        future = asyncio.get_running_loop().create_future()
+        pending[update.update_id] = future
+        started = time.perf_counter()
+        await application.update_queue.put(update)
+        try:
+            finished = await asyncio.wait_for(future, args.timeout)
+        except asyncio.TimeoutError:
+            pending.pop(update.update_id, None)
+            timeouts += 1
+            return
+        latencies[route].append(finished - started)
+
+    async def simulate(user_id: int):
+        user_rng = random.Random((args.seed << 20) + user_id)
+        await asyncio.sleep(user_rng.uniform(0, args.ramp))
+        for _ in range(args.sessions):
+            for route, kind, payload in user_script(user_id, addresses[user_id], args, user_rng):
+                await send(route, kind, user_id, payload)
+                if args.think:
+                    await asyncio.sleep(user_rng.expovariate(1 / args.think))
+
+    lag_samples = []
+    stop_lag = asyncio.Event()
+    lag_task = asyncio.create_task(sample_loop_lag(lag_samples, stop_lag))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate(user_id) for user_id in range(1, args.users + 1)))
+    elapsed = time.perf_counter() - started
+
+    stop_lag.set()
+    await lag_task
+    rss_after = rss_mb()
+    saves = sum(save_child.counts) - saves_before
+    written = save_child.sum - bytes_before
+    save_s = save_time_child.sum - save_s_before
+
+    await application.stop()
+    await prices.stop_price_service()
+    await application.shutdown()
+
+    updates = sum(len(samples) for samples in latencies.values())
+    all_latencies = [sample for samples in latencies.values() for sample in samples]
+    return {
+        'load': {
+            'users': args.users,
+            'sessions_per_user': args.sessions,
+            'think_s': args.think,
+            'existing_users': args.existing_users,
+            'airdrops': args.airdrops,
+        },
+        'throughput': {
+            'updates': updates,
+            'elapsed_s': round(elapsed, 2),
+            'updates_per_s': round(updates / elapsed, 1) if elapsed else 0.0,
+            'timeouts': timeouts,
+            'handler_errors': len(errors),
+        },
+        'latency': {'all': latency_summary(all_latencies),
+                    **{route: latency_summary(samples) for route, samples in sorted(latencies.items())}},
+        'loop_lag': {
+            'samples': len(lag_samples),
+            'p50_ms': round(percentile(lag_samples, 50) * 1000, 3),
+            'p99_ms': round(percentile(lag_samples, 99) * 1000, 3),
+            'max_ms': round(max(lag_samples, default=0.0) * 1000, 3),
+        },
+        'database': {
+            'saves': saves,
+            'saves_per_update': round(saves / updates, 3) if updates else 0.0,
+            'bytes_written_mb': round(written / 2**20, 1),
+            'bytes_per_update': int(written / updates) if updates else 0,
+            'save_time_s': round(save_s, 2),
+            'save_time_share': round(save_s / elapsed, 3) if elapsed else 0.0,
+            'file_mb': round(os.path.getsize(bot.db.data_file) / 2**20, 2),
+            'journal_mb': (round(os.path.getsize(bot.db.journal_file) / 2**20, 2)
+                           if os.path.exists(bot.db.journal_file) else 0.0),
+        },
+        'bot_api': dict(sorted(api.calls.items())),
+        'memory': {
+            'rss_before_mb': round(rss_before, 1),
+            'rss_after_mb': round(rss_after, 1),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        },
+        'errors': sorted(set(errors))[:5],
+    }
+
+def baseline_figures(report: dict) -> dict:
+    """The numbers compared between runs"""
+    figures = {
+        'updates_per_s': report['throughput']['updates_per_s'],
+        'loop_lag_p99_ms': report['loop_lag']['p99_ms'],
+        'db_bytes_per_update': report['database']['bytes_per_update'],
+        'peak_rss_mb': report['memory']['peak_rss_mb'],
+    }
+    for route, summary in report['latency'].items():
+        figures[f'{route}_p95_ms'] = summary['p95_ms']
+    return figures
+
+def compare(baseline: dict, report: dict, tolerance: float) -> list:
+    """Figures that got worse than the baseline by more than tolerance"""
+    if baseline.get('load') != report['load']:
+        print(f"⚠️ Baseline was recorded with a different load: {baseline.get('load')}")
+    current = baseline_figures(report)
+    regressions = []
+    print(f"{'figure':<36}{'baseline':>12}{'current':>12}{'change':>10}")
+    for key, before in baseline.get('figures', {}).items():
+        after = current.get(key)
+        if after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        worse = -change if key == 'updates_per_s' else change
+        flag = '  REGRESSION' if worse > tolerance else ''
+        print(f"{key:<36}{before:>12}{after:>12}{change * 100:>9.0f}%{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500, help='simulated users, all active at once')
+    parser.add_argument('--sessions', type=int, default=1, help='times each user runs through the script')
+    parser.add_argument('--think', type=float, default=0.5, help='mean think time between a user\'s updates, seconds')
+    parser.add_argument('--ramp', type=float, default=5.0, help='seconds over which users arrive')
+    parser.add_argument('--existing-users', type=int, default=2000, help='users already in bot_data.json')
+    parser.add_argument('--airdrops', type=int, default=500, help='airdrops already in bot_data.json')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds before an update counts as lost')
+    parser.add_argument('--baseline', help='baseline JSON to compare against; exits 1 on a regression')
+    parser.add_argument('--save-baseline', help='write this run\'s figures to a baseline JSON')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed worsening against the baseline')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    # The run happens in a scratch directory
+    for name in ('baseline', 'save_baseline'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    # Read when log_pipeline is first imported; the report is the output
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')
+    from stubs import FakeBotApi, FakeEvmNode, FakePriceServer, FakeSolanaNode
+
+    services = Services()
+    api = services.start(FakeBotApi(TOKEN))
+    nodes = {chain: services.start(FakeEvmNode()) for chain in ('eth', 'arbitrum', 'base')}
+    nodes['solana'] = services.start(FakeSolanaNode())
+    nodes['prices'] = services.start(FakePriceServer())
+
+    # bot.py reads these at import
+    workdir = tempfile.mkdtemp(prefix='bench_bot_')
+    os.chdir(workdir)
+    os.environ.update(BOT_TOKEN=TOKEN, ADMIN_ID=str(ADMIN_ID), TELEGRAM_API_BASE_URL=f"{api.url}/bot")
+    seed_data(os.path.join(workdir, 'bot_data.json'), args, random.Random(args.seed))
+
+    report = asyncio.run(run(args, services, nodes, api))
+    services.stop(api, *nodes.values())
+    print_report('Bot Load Test', report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'load': report['load'], 'figures': baseline_figures(report)}, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            print(f"Regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Broadcast throughput and resume benchmark
+
+Sends one broadcast to a synthetic user base through broadcast.Broadcaster
+and a real telegram.Bot pointed at stubs.FakeBotApi, with some users
+blocking the bot and the stub's flood control enabled. Halfway through, the
+run is cancelled and picked up by a fresh Broadcaster from the checkpoint
+file, the way a restart would; every user must still get the message,
+and only the chunk in flight at the stop may be sent twice.
+
+    python bench_broadcast.py --users 5000 --rate 1000 --flood-limit 1200
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from bench_utils import print_report
+from broadcast import Broadcaster, RateLimiter
+from checkpoint import CheckpointStore
+from database import Database
+from stubs import FakeBotApi
+
+TOKEN = '123456:bench-broadcast'
+
+def make_database(path: str, users: int, seed: int) -> Database:
+    db = Database(autoload=False)
+    db.data_file = path
+    db.load_data()
+    rng = random.Random(seed)
+    # Sparse, unordered ids like real Telegram users
+    for user_id in rng.sample(range(10_000_000, 10_000_000 + users * 50), users):
+        db.data['users'][str(user_id)] = {'user_id': user_id, 'username': None, 'first_name': f'User{user_id}'}
+    db.save_data()
+    return db
+
+async def wait_for(broadcaster: Broadcaster, broadcast_id: str, until, timeout: float):
+    deadline = time.monotonic() + timeout
+    while not until(broadcaster.status(broadcast_id)):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"broadcast {broadcast_id} stuck at {broadcaster.status(broadcast_id)}")
+        await asyncio.sleep(0.05)
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix='bench_broadcast_')
+    db = make_database(os.path.join(workdir, 'bot_data.json'), args.users, args.seed)
+    user_ids = list(db.iter_user_ids())
+    rng = random.Random(args.seed)
+
+    api = FakeBotApi(TOKEN, flood_limit=args.flood_limit)
+    api.blocked = set(rng.sample(user_ids, int(len(user_ids) * args.blocked)))
+    await api.start()
+
+    bot = Bot(TOKEN, base_url=f"{api.url}/bot",
+              request=HTTPXRequest(connection_pool_size=args.concurrency, pool_timeout=30))
+    checkpoint_file = os.path.join(workdir, 'broadcasts.json')
+
+    def new_broadcaster() -> Broadcaster:
+        limiter = RateLimiter(rate=args.rate)
+        return Broadcaster(bot, db, CheckpointStore(checkpoint_file, min_interval=0.5), limiter,
+                           concurrency=args.concurrency, chunk_size=args.chunk)
+
+    async with bot:
+        started = time.perf_counter()
+        first = new_broadcaster()
+        broadcast_id = first.start('Benchmark announcement')
+        # Kill it roughly halfway, like a crash or deploy
+        await wait_for(first, broadcast_id, lambda s: s['delivered'] + s['blocked'] >= len(user_ids) // 2,
+                       args.timeout)
+        await first.stop()
+        interrupted = first.status(broadcast_id)
+
+        second = new_broadcaster()
+        resumed = second.resume()
+        await wait_for(second, broadcast_id, lambda s: s['status'] == 'done', args.timeout)
+        elapsed = time.perf_counter() - started
+        final = second.status(broadcast_id)
+
+    await api.stop()
+
+    received = Counter(int(params['chat_id']) for _, method, params in api.sent if method == 'sendMessage')
+    missing = [user_id for user_id in user_ids if user_id not in received and user_id not in api.blocked]
+    duplicates = sum(1 for count in received.values() if count > 1)
+    print_report('Broadcast Benchmark', {
+        'users': len(user_ids),
+        'elapsed_s': round(elapsed, 2),
+        'messages_per_s': round(final['delivered'] / elapsed, 1),
+        'delivered': final['delivered'],
+        'blocked': final['blocked'],
+        'failed': final['failed'],
+        'flood_errors': api.flood_errors,
+        'resume': {
+            'resumed': resumed == [broadcast_id],
+            'cursor_at_stop': interrupted['cursor'],
+            'delivered_at_stop': interrupted['delivered'],
+            'missing_recipients': len(missing),
+            # Sends of the chunk in flight at the stop are repeated on resume
+            'duplicate_recipients': duplicates,
+        },
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=3000)
+    parser.add_argument('--rate', type=float, default=1000, help='broadcast messages per second')
+    parser.add_argument('--flood-limit', type=float, default=1200, help='stub flood control, messages per second')
+    parser.add_argument('--blocked', type=float, default=0.05, help='share of users who blocked the bot')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--chunk', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--seed', type=int, default=1)
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Block watcher benchmark against a local stand-in node
+
+Mines synthetic blocks on stubs.FakeEvmNode, runs ChainWatcher over them and
+checks that every transfer touching a watched address was reported.
+
+    python bench_chain_watcher.py --blocks 500 --addresses 50000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from address_index import AddressIndex
+from bench_utils import print_report
+from chain_watcher import ChainWatcher
+from checkpoint import CheckpointStore
+from stubs import FakeEvmNode
+
+def random_address(rng: random.Random) -> str:
+    return '0x' + '%040x' % rng.getrandbits(160)
+
+async def run(args):
+    rng = random.Random(args.seed)
+    node = FakeEvmNode(block_receipts=not args.no_block_receipts)
+    await node.start()
+
+    token = random_address(rng)
+    node.add_token(token, 'USDC', 6)
+
+    index = AddressIndex()
+    watched = [random_address(rng) for _ in range(args.addresses)]
+    for user_id, address in enumerate(watched, start=1):
+        index.add(address, user_id)
+
+    expected = 0
+    node.mine()
+    for _ in range(args.blocks):
+        for _ in range(args.txs_per_block):
+            hit = rng.random() < args.hit_rate
+            sender = rng.choice(watched) if hit else random_address(rng)
+            recipient = random_address(rng)
+            if rng.random() < args.token_share:
+                node.add_token_transfer(token, sender, recipient, rng.randint(1, 10**9))
+            else:
+                node.add_transfer(sender, recipient, rng.randint(1, 10**18))
+            expected += hit
+        node.mine()
+
+    delivered = []
+
+    async def on_activity(user_id: int, activity: dict):
+        delivered.append((user_id, activity))
+
+    checkpoint_file = os.path.join(tempfile.mkdtemp(), 'checkpoints.json')
+    checkpoints = CheckpointStore(checkpoint_file)
+    # Resume from just before the synthetic range, as after a restart
+    checkpoints.set('evm:bench', node.start_block)
+    watcher = ChainWatcher('bench', node.url, 'ETH_MAINNET', 'ETH', index, on_activity, checkpoints,
+                           confirmations=0, batch_size=args.batch_size)
+
+    start = time.perf_counter()
+    while await watcher.poll_once():
+        pass
+    elapsed = time.perf_counter() - start
+
+    await watcher.stop()
+    await node.stop()
+
+    print_report('Block Watcher Benchmark', {
+        'chain': {
+            'blocks': args.blocks,
+            'txs_per_block': args.txs_per_block,
+            'watched_addresses': args.addresses,
+        },
+        'watcher': dict(watcher.stats, blocks_per_s=round(watcher.stats['blocks_scanned'] / elapsed, 1)),
+        'node': {
+            'http_requests': node.requests,
+            'rpc_calls': node.calls,
+        },
+        'correctness': {
+            'expected_matches': expected,
+            'delivered': len(delivered),
+            'checkpoint': CheckpointStore(checkpoint_file).get('evm:bench'),
+            'head': node.head,
+        },
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blocks', type=int, default=200)
+    parser.add_argument('--txs-per-block', type=int, default=150)
+    parser.add_argument('--addresses', type=int, default=10_000)
+    parser.add_argument('--hit-rate', type=float, default=0.002, help='share of txs sent by a watched address')
+    parser.add_argument('--token-share', type=float, default=0.4, help='share of txs that are ERC-20 transfers')
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--no-block-receipts', action='store_true', help='node without eth_getBlockReceipts')
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Cluster throughput benchmark
+
+Runs bot.py as its own process with CLUSTER_WORKERS set to each of --workers
+in turn (1 is the usual single-process bot) against stubs.FakeBotApi, and
+has --users simulated users tap through a write-heavy session at once:
+/start, connecting a wallet through /connect_wallet, then --writes /digest
+changes, each a Database write. A user sends the next update once the bot
+has answered the last one. Every run starts from the same seeded
+bot_data.json, so the runs differ only in the number of workers.
+
+Reports updates per second, latency percentiles and what the Database wrote
+(data file and journal) for each worker count.
+
+    python bench_cluster.py --workers 1,2,4 --users 300 --writes 10
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+from bench_utils import latency_summary, print_report
+
+TOKEN = '123456:bench-cluster'
+ADMIN_ID = 5
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+
+class ReplyWatcher:
+    """Resolves a waiting user's future when the bot sends them anything"""
+
+    def __init__(self, api):
+        self.api = api
+        self.seen = 0
+        self.waiters = {}
+
+    def expect(self, chat_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[chat_id] = future
+        return future
+
+    async def run(self):
+        while True:
+            sent = self.api.sent
+            for sent_at, _, params in sent[self.seen:]:
+                chat_id = params.get('chat_id')
+                future = self.waiters.pop(int(chat_id), None) if chat_id else None
+                if future and not future.done():
+                    future.set_result(sent_at)
+            self.seen = len(sent)
+            await asyncio.sleep(0.002)
+
+def user_script(user_id: int, address: str, args, rng: random.Random):
+    """(route, kind, payload) steps of one session"""
+    steps = [
+        ('start', 'message', '/start'),
+        ('connect_wallet_start', 'message', '/connect_wallet'),
+        ('connect_wallet_chain', 'callback', 'chain_ethereum'),
+        ('connect_wallet', 'message', address),
+    ]
+    steps += [('digest', 'message', f'/digest {rng.randint(0, 300)}') for _ in range(args.writes)]
+    return steps
+
+async def wait_until_serving(api, watcher: ReplyWatcher, timeout: float):
+    """Ping with /start from a user outside the run until a worker answers"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        reply = watcher.expect(ADMIN_ID)
+        api.push_message(ADMIN_ID, '/start')
+        try:
+            await asyncio.wait_for(reply, 2.0)
+            return
+        except asyncio.TimeoutError:
+            continue
+    raise TimeoutError(f"bot not answering after {timeout}s")
+
+async def run_once(workers: int, args, seed_file: str, env: dict) -> dict:
+    from stubs import FakeBotApi
+
+    workdir = tempfile.mkdtemp(prefix=f'bench_cluster_{workers}_')
+    shutil.copy(seed_file, os.path.join(workdir, 'bot_data.json'))
+    api = FakeBotApi(TOKEN, poll_wait=0.1)
+    await api.start()
+    watcher = ReplyWatcher(api)
+    watch_task = asyncio.create_task(watcher.run())
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, BOT_SCRIPT, cwd=workdir,
+        env=dict(env, CLUSTER_WORKERS=str(workers), TELEGRAM_API_BASE_URL=f"{api.url}/bot"),
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        await wait_until_serving(api, watcher, args.startup_timeout)
+
+        rng = random.Random(args.seed)
+        latencies = defaultdict(list)
+        timeouts = 0
+
+        async def simulate(user_id: int):
+            nonlocal timeouts
+            user_rng = random.Random((args.seed << 20) + user_id)
+            address = '0x' + rng.getrandbits(160).to_bytes(20, 'big').hex()
+            for route, kind, payload in user_script(user_id, address, args, user_rng):
+                reply = watcher.expect(user_id)
+                started = time.monotonic()
+                if kind == 'message':
+                    api.push_message(user_id, payload)
+                else:
+                    api.push_callback(user_id, payload)
+                try:
+                    latencies[route].append(await asyncio.wait_for(reply, args.timeout) - started)
+                except asyncio.TimeoutError:
+                    timeouts += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate(user_id) for user_id in range(10, 10 + args.users)))
+        elapsed = time.perf_counter() - started
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(process.wait(), 60)
+        except asyncio.TimeoutError:
+            process.kill()
+        watch_task.cancel()
+        await api.stop()
+
+    updates = sum(len(samples) for samples in latencies.values())
+    all_latencies = [sample for samples in latencies.values() for sample in samples]
+    data_file = os.path.join(workdir, 'bot_data.json')
+    journal_file = data_file + '.journal'
+    report = {
+        'updates': updates,
+        'elapsed_s': round(elapsed, 2),
+        'updates_per_s': round(updates / elapsed, 1) if elapsed else 0.0,
+        'timeouts': timeouts,
+        'latency': {'all': latency_summary(all_latencies),
+                    **{route: latency_summary(samples) for route, samples in sorted(latencies.items())}},
+        'file_mb': round(os.path.getsize(data_file) / 2**20, 2),
+        'journal_mb': round(os.path.getsize(journal_file) / 2**20, 2) if os.path.exists(journal_file) else 0.0,
+    }
+    shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+async def run(args, seed_file: str, env: dict) -> dict:
+    results = {}
+    for workers in args.workers:
+        results[f'workers_{workers}'] = await run_once(workers, args, seed_file, env)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=lambda text: [int(n) for n in text.split(',')], default=[1, 2, 4],
+                        help='comma separated worker counts to compare')
+    parser.add_argument('--users', type=int, default=200, help='simulated users, all active at once')
+    parser.add_argument('--writes', type=int, default=10, help='/digest changes per user after connecting')
+    parser.add_argument('--existing-users', type=int, default=20000, help='users already in bot_data.json')
+    parser.add_argument('--airdrops', type=int, default=5000, help='airdrops already in bot_data.json')
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds before an update counts as lost')
+    parser.add_argument('--startup-timeout', type=float, default=60.0, help='seconds for the bot to come up')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    from bench_bot import seed_data
+
+    seed_dir = tempfile.mkdtemp(prefix='bench_cluster_seed_')
+    seed_file = os.path.join(seed_dir, 'bot_data.json')
+    seed_data(seed_file, SimpleNamespace(existing_users=args.existing_users, airdrops=args.airdrops),
+              random.Random(args.seed))
+    env = dict(os.environ, BOT_TOKEN=TOKEN, ADMIN_ID=str(ADMIN_ID), LOG_LEVEL='ERROR',
+               CLUSTER_METRICS_PORT='0', PRICE_API_URL='http://127.0.0.1:1')
+
+    report = asyncio.run(run(args, seed_file, env))
+    shutil.rmtree(seed_dir, ignore_errors=True)
+    print_report('Cluster Throughput', {
+        'load': {'users': args.users, 'writes_per_user': args.writes,
+                 'existing_users': args.existing_users, 'airdrops': args.airdrops},
+        **report,
+    })
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Portfolio snapshot benchmark against local stand-in RPCs
+
+Connects a population of synthetic wallets (Ethereum, some with Solana
+too), serves their balances from stubs.FakeEvmNode and FakeSolanaNode and
+runs snapshot rounds a simulated --step-hours apart, changing a share of
+balances between rounds. Reports round time, requests, the round time the
+RPC budget implies, storage per sample and /history render time.
+
+    python bench_portfolio.py --wallets 100000 --rounds 48 --step-hours 6
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import random
+import tempfile
+import time
+
+from address_index import base58_encode
+from bench_utils import peak_rss_mb, print_report
+from portfolio import (BalanceHistory, DEFAULT_HISTORY_WINDOWS, EVM_BATCH_SIZE, PortfolioSnapshotter,
+                       SNAPSHOT_CHAINS, format_history, now_minute)
+import portfolio
+from rpc import RpcClient
+from solana_watcher import SOLANA_BATCH_SIZE
+from stubs import FakeEvmNode, FakeSolanaNode
+
+async def run(args):
+    rng = random.Random(args.seed)
+    evm_nodes = {chain: FakeEvmNode() for chain, (wallet_type, _, _) in SNAPSHOT_CHAINS.items()
+                 if wallet_type == 'ethereum'}
+    solana = FakeSolanaNode()
+    for node in list(evm_nodes.values()) + [solana]:
+        await node.start()
+
+    wallets = {}
+    for user_id in range(1, args.wallets + 1):
+        address = '0x' + os.urandom(20).hex()
+        wallet = {'ethereum': address}
+        for node in evm_nodes.values():
+            if rng.random() < args.funded:
+                node.balances[address] = rng.randint(1, 50 * 10**18)
+        if rng.random() < args.solana_share:
+            wallet['solana'] = base58_encode(os.urandom(32))
+            solana.set_balance(wallet['solana'], rng.randint(0, 100 * 10**9))
+        wallets[str(user_id)] = wallet
+
+    solana_wallets = sum('solana' in wallet for wallet in wallets.values())
+    workdir = tempfile.mkdtemp(prefix='bench_portfolio_')
+    history = BalanceHistory(os.path.join(workdir, 'portfolio_history.bin'))
+    portfolio.history = history
+    snapshotter = PortfolioSnapshotter(history, rpc_budget=0, concurrency=args.concurrency)
+    for chain, node in evm_nodes.items():
+        snapshotter.clients[chain] = RpcClient(node.url, chain=chain)
+    snapshotter.clients['solana'] = RpcClient(solana.url, chain='solana')
+
+    step = int(args.step_hours * 60)
+    minute = now_minute() - args.rounds * step
+    round_times = []
+    for _ in range(args.rounds):
+        started = time.perf_counter()
+        await snapshotter.snapshot(wallets, minute)
+        round_times.append(time.perf_counter() - started)
+        for node in evm_nodes.values():
+            for address in rng.sample(list(node.balances), int(len(node.balances) * args.change_rate)):
+                node.balances[address] = max(0, node.balances[address] + rng.randint(-10**18, 10**18))
+        minute += step
+
+    started = time.perf_counter()
+    history.save()
+    save_s = time.perf_counter() - started
+    file_bytes = os.path.getsize(history.path)
+    started = time.perf_counter()
+    loaded = BalanceHistory(history.path).load()
+    load_s = time.perf_counter() - started
+
+    sample_wallets = rng.sample(list(wallets.values()), min(1000, len(wallets)))
+    started = time.perf_counter()
+    for wallet in sample_wallets:
+        format_history(wallet, DEFAULT_HISTORY_WINDOWS, minute)
+    history_ms = (time.perf_counter() - started) / len(sample_wallets) * 1000
+
+    await snapshotter.close()
+    for node in list(evm_nodes.values()) + [solana]:
+        await node.stop()
+
+    stats = snapshotter.stats
+    samples = sum(len(series) for series in history.series.values())
+    requests_per_round = stats['requests'] / args.rounds
+    print_report('Portfolio Snapshot Benchmark', {
+        'population': {
+            'wallets': args.wallets,
+            'series': len(history),
+            'rounds': args.rounds,
+        },
+        'rounds': {
+            'first_round_s': round(round_times[0], 3),
+            'mean_round_s': round(sum(round_times) / len(round_times), 3),
+            'requests_per_round': int(requests_per_round),
+            'readings': stats['readings'],
+            'changes': stats['changes'],
+            'budget_rps': args.budget,
+            # Chains are read side by side, each within its own budget
+            'round_at_budget_s': round(max(math.ceil(args.wallets / EVM_BATCH_SIZE),
+                                           math.ceil(solana_wallets / SOLANA_BATCH_SIZE)) / args.budget, 1),
+        },
+        'storage': {
+            'stored_samples': samples,
+            'sample_bytes': history.nbytes(),
+            'bytes_per_sample': round(history.nbytes() / samples, 2) if samples else 0,
+            'file_bytes': file_bytes,
+            'save_s': round(save_s, 3),
+            'load_s': round(load_s, 3),
+            'loaded_series': loaded,
+        },
+        'history_render_ms': round(history_ms, 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wallets', type=int, default=10_000)
+    parser.add_argument('--rounds', type=int, default=24)
+    parser.add_argument('--step-hours', type=float, default=6)
+    parser.add_argument('--funded', type=float, default=0.5, help='share of addresses with a balance per EVM chain')
+    parser.add_argument('--solana-share', type=float, default=0.2)
+    parser.add_argument('--change-rate', type=float, default=0.05)
+    parser.add_argument('--budget', type=float, default=10, help='RPC requests per second per chain')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
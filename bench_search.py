@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Airdrop search benchmark
+
+Builds search.SearchIndex over synthetic airdrops and reports query latency
+for whole-word, prefix and multi-word queries (uncached and cached), next to
+a linear scan of names and descriptions like a naive search would do, and
+the cost of the incremental add/delete that follows each admin change.
+
+    python bench_search.py --airdrops 100000 --queries 2000
+"""
+
+import argparse
+import random
+import time
+
+from bench_utils import latency_summary, print_report
+from search import SearchIndex, tokenize
+
+SYLLABLES = ['zk', 'sync', 'scroll', 'layer', 'base', 'arb', 'op', 'nova', 'star', 'net', 'link', 'swap',
+             'dex', 'fi', 'chain', 'bridge', 'ape', 'moon', 'sol', 'eth', 'block', 'mint', 'labs', 'verse']
+FILLER = ['testnet', 'mainnet', 'points', 'quest', 'tasks', 'wallet', 'bridge', 'swap', 'stake', 'daily',
+          'campaign', 'rewards', 'early', 'users', 'season', 'galxe', 'zealy', 'discord', 'twitter', 'nft']
+CATEGORIES = [('testnet', 'l1'), ('testnet', 'l2'), ('testnet', 'others'), ('mainnet', 'trading'),
+              ('mainnet', 'non_trading')]
+
+def make_airdrops(count: int, rng: random.Random):
+    for airdrop_id in range(1, count + 1):
+        project = ''.join(rng.sample(SYLLABLES, rng.randint(2, 3)))
+        category, subcategory = rng.choice(CATEGORIES)
+        yield {
+            'id': airdrop_id,
+            'category': category,
+            'subcategory': subcategory,
+            'name': f"{project.capitalize()} {rng.choice(FILLER).capitalize()}",
+            'link': f"https://{project}.xyz",
+            'description': ' '.join(rng.choice(FILLER + [project]) for _ in range(rng.randint(8, 30))),
+        }
+
+def linear_search(airdrops, query: str, limit: int):
+    words = tokenize(query)
+    hits = []
+    for airdrop in airdrops:
+        text = f"{airdrop['name']} {airdrop['description']} {airdrop['category']}".lower()
+        if all(word in text for word in words):
+            hits.append(airdrop['id'])
+    return hits[:limit]
+
+def timed(fn, queries):
+    samples = []
+    for query in queries:
+        started = time.perf_counter()
+        fn(query)
+        samples.append(time.perf_counter() - started)
+    return latency_summary(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--airdrops', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    airdrops = list(make_airdrops(args.airdrops, rng))
+    index = SearchIndex()
+    started = time.perf_counter()
+    index.rebuild(airdrops)
+    build_s = time.perf_counter() - started
+
+    names = [airdrop['name'].lower().split()[0] for airdrop in rng.sample(airdrops, 500)]
+    kinds = {
+        'word': [rng.choice(names) for _ in range(args.queries)],
+        'prefix': [rng.choice(names)[:rng.randint(2, 4)] for _ in range(args.queries)],
+        'two_words': [f"{rng.choice(names)} {rng.choice(FILLER)}" for _ in range(args.queries)],
+        'common_word': [rng.choice(['testnet', 'rewards', 'quest', 'te', 'testnet rewards']) for _ in range(args.queries)],
+    }
+
+    report = {'airdrops': args.airdrops, 'build_s': round(build_s, 2)}
+    for kind, queries in kinds.items():
+        # A zero-size cache keeps nothing, so every query is computed
+        index.result_cache_size = 0
+        index._cache.clear()
+        report[f'{kind}_uncached'] = timed(lambda q: index.search(q, args.limit), queries)
+        index.result_cache_size = 1024
+        for query in set(queries):
+            index.search(query, args.limit)
+        report[f'{kind}_cached'] = timed(lambda q: index.search(q, args.limit), queries)
+
+    report['linear_scan'] = timed(lambda q: linear_search(airdrops, q, args.limit), kinds['word'][:20])
+
+    extra = list(make_airdrops(1000, rng))
+    for offset, airdrop in enumerate(extra, start=1):
+        airdrop['id'] = args.airdrops + offset
+    report['add'] = timed(index.add, extra)
+    report['remove'] = timed(index.remove, [airdrop['id'] for airdrop in extra])
+    print_report('Airdrop Search Benchmark', report)
+
+if __name__ == '__main__':
+    main()
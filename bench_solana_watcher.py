@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Solana watcher benchmark against a local stand-in RPC
+
+Populates stubs.FakeSolanaNode with balances for a watched population, runs
+two SolanaWatcher rounds with a share of balances changed in between and
+reports round time, request count and the interval the RPC budget implies.
+Batch starts are paced to --budget, so a round takes about its request
+count divided by the budget.
+
+    python bench_solana_watcher.py --addresses 100000 --budget 10
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from address_index import AddressIndex, base58_encode
+from bench_utils import print_report
+from solana_watcher import SolanaWatcher
+from stubs import FakeSolanaNode
+
+async def run(args):
+    rng = random.Random(args.seed)
+    node = FakeSolanaNode()
+    await node.start()
+
+    index = AddressIndex()
+    addresses = [base58_encode(os.urandom(32)) for _ in range(args.addresses)]
+    for user_id, address in enumerate(addresses, start=1):
+        index.add(address, user_id)
+        node.set_balance(address, rng.randint(0, 100 * 10**9))
+
+    delivered = []
+
+    async def on_activity(user_id: int, activity: dict):
+        delivered.append((user_id, activity))
+
+    watcher = SolanaWatcher(node.url, index, on_activity, rpc_budget=args.budget,
+                            concurrency=args.concurrency, min_interval=1)
+
+    start = time.perf_counter()
+    await watcher.poll_once()
+    baseline_s = time.perf_counter() - start
+
+    changed = rng.sample(addresses, int(args.addresses * args.change_rate))
+    for address in changed:
+        node.lamports[address] += rng.choice((-1, 1)) * rng.randint(1, 10**9)
+
+    start = time.perf_counter()
+    await watcher.poll_once()
+    round_s = time.perf_counter() - start
+
+    await watcher.stop()
+    await node.stop()
+
+    print_report('Solana Watcher Benchmark', {
+        'population': {
+            'addresses': args.addresses,
+            'changed': len(changed),
+        },
+        'rounds': {
+            'baseline_round_s': round(baseline_s, 3),
+            'change_round_s': round(round_s, 3),
+            'http_requests': node.requests,
+            'addresses_per_s': int(args.addresses / round_s) if round_s else 0,
+            'budget_rps': args.budget,
+            'paced_interval_s': round(watcher.interval, 1),
+        },
+        'correctness': {
+            'notifications': len(delivered),
+            'expected': len(changed),
+        },
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--addresses', type=int, default=10_000)
+    parser.add_argument('--change-rate', type=float, default=0.01)
+    parser.add_argument('--budget', type=float, default=5, help='RPC requests per second')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
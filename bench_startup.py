@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark
+
+Measures how long `import bot` takes in a fresh interpreter (with the
+slowest modules from -X importtime) and the time from spawning bot.py to
+the reply for the first update, served by stubs.FakeBotApi.
+
+    python bench_startup.py --runs 5
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_utils import latency_summary, print_report
+from stubs import FakeBotApi
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOKEN = '123456:bench-startup'
+
+def measure_import() -> float:
+    """Seconds to import bot in a fresh interpreter"""
+    code = "import time; t = time.perf_counter(); import bot; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, '-c', code], cwd=HERE, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def slowest_imports(limit: int) -> dict:
+    """Modules imported directly by bot, by cumulative import time (ms)"""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import bot'],
+                         cwd=HERE, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Two spaces per nesting level; depth 1 is what bot itself pulls in
+        if len(name) - len(name.lstrip()) != 3:
+            continue
+        rows.append((int(cumulative), name.strip()))
+    rows.sort(reverse=True)
+    return {name: round(us / 1000, 1) for us, name in rows[:limit]}
+
+async def measure_first_update(timeout: float) -> float:
+    """Seconds from spawning bot.py until it answers /start"""
+    api = FakeBotApi(TOKEN)
+    await api.start()
+    api.push_message(1001, '/start')
+
+    env = dict(os.environ, BOT_TOKEN=TOKEN, TELEGRAM_API_BASE_URL=f"{api.url}/bot")
+    workdir = tempfile.mkdtemp()
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(HERE, 'bot.py'), cwd=workdir, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    try:
+        while time.monotonic() - started < timeout:
+            for sent_at, method, params in api.sent:
+                if method == 'sendMessage' and int(params.get('chat_id', 0)) == 1001:
+                    return sent_at - started
+            await asyncio.sleep(0.005)
+        raise TimeoutError(f"no reply within {timeout}s")
+    finally:
+        process.terminate()
+        await process.wait()
+        await api.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=8, help='slowest imports to list')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    first_update = [asyncio.run(measure_first_update(args.timeout)) for _ in range(args.runs)]
+
+    print_report('Startup Benchmark', {
+        'import_bot': latency_summary(imports),
+        'time_to_first_update': latency_summary(first_update),
+        'slowest_imports_ms': slowest_imports(args.top),
+    })
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Update processing throughput benchmark
+
+Feeds synthetic updates from many users into a real Application whose
+handler simulates a slow I/O call, once per concurrency level, and checks
+that every user's updates were handled in the order they arrived. The Bot
+API is served by stubs.FakeBotApi.
+
+    python bench_updates.py --users 200 --per-user 10 --workers 1,8,32,128
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from telegram import Update
+from telegram.ext import Application, MessageHandler, filters
+
+from bench_utils import latency_summary, print_report
+from stubs import FakeBotApi
+from update_processor import LaneUpdateProcessor
+
+TOKEN = '123456:bench-updates'
+
+def make_update(update_id: int, user_id: int, seq: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'text': str(seq),
+        },
+    }
+
+async def run_level(api: FakeBotApi, workers: int, args) -> dict:
+    processor = LaneUpdateProcessor(workers)
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(f"{api.url}/bot")
+        .updater(None)
+        .concurrent_updates(processor)
+        .build()
+    )
+
+    rng = random.Random(args.seed)
+    seen = {}
+    out_of_order = 0
+    done = asyncio.Event()
+    total = args.users * args.per_user
+
+    async def handler(update, context):
+        nonlocal out_of_order
+        user_id = update.effective_user.id
+        seq = int(update.message.text)
+        if seq != seen.get(user_id, -1) + 1:
+            out_of_order += 1
+        seen[user_id] = seq
+        # Stand-in for an RPC or Bot API call
+        await asyncio.sleep(rng.uniform(args.min_delay, args.max_delay))
+        if processor.stats['processed'] + 1 >= total:
+            done.set()
+
+    application.add_handler(MessageHandler(filters.TEXT, handler))
+
+    # Interleave users the way a busy bot sees them
+    order = [user for user in range(1, args.users + 1) for _ in range(args.per_user)]
+    rng.shuffle(order)
+    next_seq = {}
+
+    async with application:
+        await application.start()
+        started = time.perf_counter()
+        for update_id, user_id in enumerate(order, start=1):
+            seq = next_seq.get(user_id, 0)
+            next_seq[user_id] = seq + 1
+            await application.update_queue.put(Update.de_json(make_update(update_id, user_id, seq), application.bot))
+        await asyncio.wait_for(done.wait(), args.timeout)
+        elapsed = time.perf_counter() - started
+        await application.stop()
+
+    return {
+        'updates': total,
+        'updates_per_s': round(total / elapsed, 1),
+        'out_of_order': out_of_order,
+        'lane_wait': latency_summary(list(processor.lane_waits)),
+        'processor': processor.snapshot(),
+    }
+
+async def run(args):
+    api = FakeBotApi(TOKEN)
+    await api.start()
+    results = {}
+    for workers in args.workers:
+        results[f'workers={workers}'] = await run_level(api, workers, args)
+    await api.stop()
+
+    baseline = results[f'workers={args.workers[0]}']['updates_per_s']
+    for result in results.values():
+        result['speedup'] = round(result['updates_per_s'] / baseline, 2)
+    print_report('Update Processing Benchmark', results)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--per-user', type=int, default=5)
+    parser.add_argument('--workers', type=lambda v: [int(x) for x in v.split(',')], default=[1, 8, 32, 128])
+    parser.add_argument('--min-delay', type=float, default=0.005, help='fastest simulated handler I/O (s)')
+    parser.add_argument('--max-delay', type=float, default=0.05, help='slowest simulated handler I/O (s)')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--seed', type=int, default=1)
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
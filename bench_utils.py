@@ -0,0 +1,50 @@
+# bench_utils.py
+"""
+Small helpers shared by the bench_*.py harnesses
+"""
+
+import math
+import resource
+import sys
+from typing import Dict, List
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max in milliseconds"""
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3) if samples else 0.0,
+    }
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def print_report(title: str, report: Dict):
+    """Print a nested report as aligned key/value lines"""
+    print("=" * 60)
+    print(f"     {title}")
+    print("=" * 60)
+
+    def _print(section: Dict, indent: int):
+        for key, value in section.items():
+            if isinstance(value, dict):
+                print(f"{' ' * indent}{key}:")
+                _print(value, indent + 2)
+            else:
+                print(f"{' ' * indent}{key:<30}{value}")
+
+    _print(report, 0)
+    print("=" * 60)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Webhook load generator and latency benchmark
+
+Runs webhook_handler.py and wallet.handle_webhook_notification in-process,
+posts signed Alchemy ADDRESS_ACTIVITY payloads at a target rate and records
+how long each activity takes to become a Telegram message. The Bot API is
+stubbed, so the whole run stays on localhost.
+
+    python bench_webhook.py --rate 500 --duration 20 --addresses 10000
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from bench_utils import latency_summary, peak_rss_mb, print_report
+
+WEBHOOK_SECRET = 'bench-secret'
+NETWORKS = {
+    'eth': 'ETH_MAINNET',
+    'arbitrum': 'ARB_MAINNET',
+    'base': 'BASE_MAINNET',
+}
+ASSETS = ['ETH', 'ETH', 'ETH', 'USDC', 'USDT', 'WETH']
+
+# Matches the hash prefix in both single and digest notifications
+HASH_PREFIX = re.compile(r'`(0x[0-9a-f]{8})')
+
+class StubBot:
+    """Stands in for telegram.Bot and timestamps every delivered message"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.delivered = {}
+        self.messages = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        now = time.perf_counter()
+        self.messages += 1
+        for prefix in HASH_PREFIX.findall(text):
+            self.delivered.setdefault(prefix, now)
+
+class StubApp:
+    """Just enough of telegram.ext.Application for the notification path"""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+def random_address(rng: random.Random) -> str:
+    return '0x' + ''.join(rng.choice('0123456789abcdef') for _ in range(40))
+
+def build_payload(seq: int, network: str, addresses, rng: random.Random, per_payload: int):
+    """Build an ADDRESS_ACTIVITY payload; hash prefixes encode seq for matching"""
+    activity = []
+    hashes = []
+    for i in range(per_payload):
+        tx_hash = '0x%08x' % ((seq * per_payload + i) & 0xffffffff) + '%056x' % rng.getrandbits(224)
+        watched = rng.choice(addresses)
+        other = random_address(rng)
+        sending = rng.random() < 0.5
+        activity.append({
+            'fromAddress': watched if sending else other,
+            'toAddress': other if sending else watched,
+            'blockNum': hex(19_000_000 + seq),
+            'hash': tx_hash,
+            'value': round(rng.uniform(0.001, 5), 6),
+            'asset': rng.choice(ASSETS),
+            'category': 'external',
+            'rawContract': {'rawValue': '0x0', 'decimals': 18},
+        })
+        hashes.append(tx_hash[:10])
+
+    payload = {
+        'webhookId': 'wh_bench',
+        'id': f'whevt_{seq}',
+        'createdAt': datetime.now(timezone.utc).isoformat(),
+        'type': 'ADDRESS_ACTIVITY',
+        'event': {'network': network, 'activity': activity},
+    }
+    return json.dumps(payload).encode(), hashes
+
+def sign(body: bytes) -> str:
+    return hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+def populate_wallets(count: int, digest_window: int, rng: random.Random):
+    """Register synthetic users watching random addresses in an in-memory wallet registry"""
+    import wallet
+    from database import Database
+
+    db = Database(autoload=False)
+    db.data = db._get_empty_data()
+    addresses = []
+    for user_id in range(1, count + 1):
+        address = random_address(rng)
+        db.data['wallets'][str(user_id)] = {
+            'ethereum': address,
+            'notifications': True,
+            'digest_window': digest_window,
+        }
+        addresses.append(address)
+    wallet.set_wallet_registry(db)
+    wallet.load_watched_addresses(db.data['wallets'])
+    return addresses
+
+def start_server(app, port: int):
+    """Run the webhook server and the notification side on one loop, like the bot does"""
+    import webhook_handler
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(webhook_handler.start_server(app, '127.0.0.1', port), loop).result()
+    return loop
+
+def stop_server(loop):
+    import webhook_handler
+
+    asyncio.run_coroutine_threadsafe(webhook_handler.stop_server(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+def run_load(args, port: int, addresses):
+    """Post payloads at the target rate from a pool of sender threads"""
+    total = int(args.rate * args.duration)
+    sent_at = {}
+    results = {'accepted': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+    counter = iter(range(total))
+    start = time.perf_counter() + 0.2
+    chains = list(NETWORKS)
+
+    def worker(worker_id: int):
+        rng = random.Random((args.seed << 16) + worker_id + 1)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        while True:
+            with lock:
+                seq = next(counter, None)
+            if seq is None:
+                break
+            chain = chains[seq % len(chains)]
+            body, hashes = build_payload(seq, NETWORKS[chain], addresses, rng, args.per_payload)
+
+            due = start + seq / args.rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            posted = time.perf_counter()
+            try:
+                conn.request('POST', f'/webhook/alchemy/{chain}', body=body, headers={
+                    'Content-Type': 'application/json',
+                    'X-Alchemy-Signature': sign(body),
+                })
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+                ok = None
+
+            with lock:
+                if ok:
+                    results['accepted'] += 1
+                    for prefix in hashes:
+                        sent_at[prefix] = posted
+                elif ok is None:
+                    results['errors'] += 1
+                else:
+                    results['rejected'] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.senders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return total, sent_at, results, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=200, help='payloads per second to offer')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load')
+    parser.add_argument('--addresses', type=int, default=1000, help='watched address population')
+    parser.add_argument('--per-payload', type=int, default=1, help='activities per payload')
+    parser.add_argument('--senders', type=int, default=16, help='concurrent sender connections')
+    parser.add_argument('--digest-window', type=int, default=0, help='per-user digest window (0 = off); digests only list their first hashes, so fewer activities can be matched')
+    parser.add_argument('--send-delay', type=float, default=0.0, help='simulated Bot API latency in seconds')
+    parser.add_argument('--grace', type=float, default=5.0, help='seconds to wait for stragglers')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    for chain in ('ETH', 'ARB', 'BASE'):
+        os.environ[f'ALCHEMY_WEBHOOK_SECRET_{chain}'] = WEBHOOK_SECRET
+
+    tracemalloc.start()
+    rng = random.Random(args.seed)
+    addresses = populate_wallets(args.addresses, args.digest_window, rng)
+
+    bot = StubBot(args.send_delay)
+    loop = start_server(StubApp(bot), args.port)
+
+    mem_before, _ = tracemalloc.get_traced_memory()
+    total, sent_at, results, elapsed = run_load(args, args.port, addresses)
+
+    # Give in-flight notifications (and open digests) time to land
+    deadline = time.perf_counter() + args.grace + args.digest_window
+    while time.perf_counter() < deadline and len(bot.delivered) < len(sent_at):
+        time.sleep(0.05)
+
+    mem_after, mem_peak = tracemalloc.get_traced_memory()
+    stop_server(loop)
+
+    latencies = [bot.delivered[p] - t for p, t in sent_at.items() if p in bot.delivered]
+    activities = len(sent_at)
+    undelivered = activities - len(latencies)
+
+    print_report('Webhook Benchmark', {
+        'offered': {
+            'payloads': total,
+            'target_rps': args.rate,
+            'activities': total * args.per_payload,
+            'addresses': args.addresses,
+        },
+        'ingest': {
+            'accepted': results['accepted'],
+            'rejected': results['rejected'],
+            'connection_errors': results['errors'],
+            'accepted_rps': round(results['accepted'] / elapsed, 1),
+        },
+        'delivery': {
+            'messages_sent': bot.messages,
+            'activities_matched': len(latencies),
+            'undelivered': undelivered,
+            'drop_rate': f"{(undelivered + (results['rejected'] + results['errors']) * args.per_payload) / max(1, total * args.per_payload):.2%}",
+        },
+        'time_to_notification': latency_summary(latencies),
+        'memory': {
+            'traced_growth_mb': round((mem_after - mem_before) / 1024 / 1024, 2),
+            'traced_peak_mb': round(mem_peak / 1024 / 1024, 2),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        },
+    })
+
+if __name__ == '__main__':
+    main()
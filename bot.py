@@ -1,63 +1,162 @@
 import os
+import asyncio
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from web3 import Web3
-from datetime import datetime
-from keep_alive import keep_alive
+import signal
+import tempfile
+import time
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram.error import RetryAfter
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler, MessageHandler, TypeHandler, filters, ContextTypes
+from telegram.helpers import escape_markdown
+from datetime import datetime, timedelta
 from database import Database
+from render_cache import RenderCache
+from search import SearchIndex, tokenize
+from update_processor import LaneUpdateProcessor
+from state_store import StateContext, flush_user_state, get_conversation_states, load_user_state, run_state_evictor
+import cluster
+from wallet import watched_addresses, address_entered, load_watched_addresses, register_wallet_handlers, start_chain_watchers, stop_chain_watchers, ALCHEMY_WEBHOOK_ID_ETH
+from chain_watcher import WATCHER_CHECKPOINT_FILE
+from notifications import flush_all
+from broadcast import Broadcaster, BROADCAST_CHECKPOINT_FILE
+from checkpoint import CheckpointStore
+from admin import register_admin_handlers
+from airdrop import register_airdrop_handlers
+from prices import prices, start_price_service, stop_price_service, usd_suffix
+from gas import gas_stats, register_gas_handlers, start_gas_trackers, stop_gas_trackers, GAS_ALERTS_FILE
+from portfolio import history as portfolio_history, register_portfolio_handlers, snapshotter as portfolio_snapshotter, start_portfolio_snapshots, stop_portfolio_snapshots
+from airdrop_import import MAX_IMPORT_BYTES, import_kind, read_import_file
+import metrics
+from log_pipeline import setup_logging
+from profiling import MAX_PROFILE_SECONDS, format_handler_traces, handler_traces, profile_loop, profiling_active, slow_updates, timed_handler
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Configure logging: records are formatted and written on a background thread
+setup_logging()
+# One INFO line per Bot API request adds up during notification bursts
+logging.getLogger('httpx').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # Environment variables
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_ID = int(os.getenv('ADMIN_ID', '0'))
 ALCHEMY_API_KEY = os.getenv('ALCHEMY_API_KEY', os.getenv('ALCHEMY_API_URL', '').split('/')[-1])
+# Optional Bot API endpoint, e.g. a local Bot API server
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
+# File downloads (document uploads); defaults to the /file/bot path next to the API URL
+TELEGRAM_API_BASE_FILE_URL = os.getenv('TELEGRAM_API_BASE_FILE_URL') or (
+    TELEGRAM_API_BASE_URL[:-len('bot')] + 'file/bot'
+    if TELEGRAM_API_BASE_URL and TELEGRAM_API_BASE_URL.endswith('/bot') else None
+)
+
+# 'polling' or 'webhook'; webhook mode needs the public https base URL
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL', '').rstrip('/')
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv('TELEGRAM_WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Initialize database (loaded in the background once the bot is up)
+db = Database(autoload=False)
+
+# Web3 connections, created on first use so web3 stays off the import path
+WEB3_NETWORKS = {
+    'eth': ("Ethereum Mainnet", f"https://eth-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"),
+    'arb': ("Arbitrum", f"https://arb-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"),
+    'base': ("Base", f"https://base-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"),
+}
+web3_clients = {}
+
+def get_web3(network: str):
+    """Web3 client for a network, built on first use"""
+    if not ALCHEMY_API_KEY or network not in WEB3_NETWORKS:
+        return None
+    
+    client = web3_clients.get(network)
+    if client is None:
+        try:
+            from web3 import Web3
+            client = Web3(Web3.HTTPProvider(WEB3_NETWORKS[network][1]))
+            web3_clients[network] = client
+        except Exception as e:
+            logger.warning(f"Web3 connection error: {e}")
+            return None
+    return client
+
+# Static menus, built once at startup
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("👤 Profile", callback_data='profile')],
+    [InlineKeyboardButton("🎁 Airdrops", callback_data='airdrops')],
+    [InlineKeyboardButton("💰 Wallet", callback_data='wallet')],
+    [InlineKeyboardButton("❓ Help", callback_data='help')]
+])
+
+AIRDROPS_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🧪 Testnet", callback_data='airdrop_testnet')],
+    [InlineKeyboardButton("🚀 Mainnet", callback_data='airdrop_mainnet')],
+    [InlineKeyboardButton("🔙 Back to Menu", callback_data='start')]
+])
 
-# Initialize database
-db = Database()
+TESTNET_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("L1 Chains", callback_data='testnet_l1')],
+    [InlineKeyboardButton("L2 Chains", callback_data='testnet_l2')],
+    [InlineKeyboardButton("Others", callback_data='testnet_others')],
+    [InlineKeyboardButton("🔙 Back", callback_data='airdrops')]
+])
 
-# Web3 connections
-w3_eth = None
-w3_arb = None
-w3_base = None
+MAINNET_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Trading Related", callback_data='mainnet_trading')],
+    [InlineKeyboardButton("🌐 Non-Trading Related", callback_data='mainnet_non_trading')],
+    [InlineKeyboardButton("🔙 Back", callback_data='airdrops')]
+])
 
-try:
-    if ALCHEMY_API_KEY:
-        w3_eth = Web3(Web3.HTTPProvider(f"https://eth-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"))
-        w3_arb = Web3(Web3.HTTPProvider(f"https://arb-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"))
-        w3_base = Web3(Web3.HTTPProvider(f"https://base-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"))
-        logger.info("Web3 connections initialized")
-except Exception as e:
-    logger.warning(f"Web3 connection error: {e}")
+BACK_TO_MENU_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back to Menu", callback_data='start')]])
+
+# Category pages, cached until an airdrop in that category changes
+AIRDROPS_PAGE_SIZE = 10
+category_pages = RenderCache()
+
+def on_airdrops_changed(event: str, airdrop, previous=None):
+    """Drop cached pages for the categories a change touched"""
+    inline_results.invalidate()
+    if event == 'reloaded':
+        category_pages.invalidate()
+        return
+    if event == 'airdrops_imported':
+        for category, subcategory in {(a['category'], a['subcategory']) for a in airdrop}:
+            category_pages.invalidate(category, subcategory)
+        return
+    for record in (airdrop, previous):
+        if record:
+            category_pages.invalidate(record['category'], record['subcategory'])
+
+# Full-text search, kept current by the same change events (subscribed
+# first, so it's up to date by the time cached answers are dropped)
+SEARCH_RESULTS = 10
+INLINE_RESULTS = 20
+INLINE_CACHE_TIME = 30  # seconds Telegram may reuse an inline answer
+airdrop_search = SearchIndex()
+airdrop_search.attach(db)
+# Built inline answers by normalized query, dropped on any airdrop change
+inline_results = RenderCache()
+metrics.register_stats('data_stats', db.flat_stats, 'Users, wallets, airdrops and support messages')
+metrics.register_stats('search_stats', lambda: airdrop_search.stats, 'Airdrop search counters')
+
+db.subscribe(on_airdrops_changed)
 
 # Main menu
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     db.add_user(user.id, user.username, user.first_name)
     
-    keyboard = [
-        [InlineKeyboardButton("👤 Profile", callback_data='profile')],
-        [InlineKeyboardButton("🎁 Airdrops", callback_data='airdrops')],
-        [InlineKeyboardButton("💰 Wallet", callback_data='wallet')],
-        [InlineKeyboardButton("❓ Help", callback_data='help')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     welcome_text = f"Welcome to Sage Airdrops Bot, {user.first_name}!\n\n"
     welcome_text += "Choose an option from the menu below:"
     
     if update.callback_query:
-        await update.callback_query.edit_message_text(welcome_text, reply_markup=reply_markup)
+        await update.callback_query.edit_message_text(welcome_text, reply_markup=MAIN_MENU_MARKUP)
     else:
-        await update.message.reply_text(welcome_text, reply_markup=reply_markup)
+        await update.message.reply_text(welcome_text, reply_markup=MAIN_MENU_MARKUP)
 
 # Profile handler
+@timed_handler
 async def profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -79,81 +178,85 @@ async def profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if wallet_info.get('solana'):
             profile_text += f"Solana: `{wallet_info['solana'][:6]}...{wallet_info['solana'][-4:]}`\n"
     
-    keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data='start')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(profile_text, reply_markup=reply_markup, parse_mode='Markdown')
+    await query.edit_message_text(profile_text, reply_markup=BACK_TO_MENU_MARKUP, parse_mode='Markdown')
 
 # Airdrops menu
+@timed_handler
 async def airdrops_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
-        [InlineKeyboardButton("🧪 Testnet", callback_data='airdrop_testnet')],
-        [InlineKeyboardButton("🚀 Mainnet", callback_data='airdrop_mainnet')],
-        [InlineKeyboardButton("🔙 Back to Menu", callback_data='start')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     text = "🎁 **Airdrops**\n\nSelect a category:"
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    await query.edit_message_text(text, reply_markup=AIRDROPS_MENU_MARKUP, parse_mode='Markdown')
 
 # Testnet airdrops
+@timed_handler
 async def airdrop_testnet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
-        [InlineKeyboardButton("L1 Chains", callback_data='testnet_l1')],
-        [InlineKeyboardButton("L2 Chains", callback_data='testnet_l2')],
-        [InlineKeyboardButton("Others", callback_data='testnet_others')],
-        [InlineKeyboardButton("🔙 Back", callback_data='airdrops')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     text = "🧪 **Testnet Airdrops**\n\nChoose a subcategory:"
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    await query.edit_message_text(text, reply_markup=TESTNET_MENU_MARKUP, parse_mode='Markdown')
 
 # Mainnet airdrops
+@timed_handler
 async def airdrop_mainnet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
+    text = "🚀 **Mainnet Airdrops**\n\nChoose a subcategory:"
+    await query.edit_message_text(text, reply_markup=MAINNET_MENU_MARKUP, parse_mode='Markdown')
+
+def render_category_page(category: str, subcategory: str, page: int):
+    """Build the text and keyboard for one page of a category"""
+    airdrops = db.get_airdrops_by_category(category, subcategory)
+    back_button = [InlineKeyboardButton("🔙 Back", callback_data=f'airdrop_{category}')]
+    
+    if not airdrops:
+        text = "No airdrops found in this category yet.\n\nCheck back later!"
+        return text, InlineKeyboardMarkup([back_button])
+    
+    pages = (len(airdrops) + AIRDROPS_PAGE_SIZE - 1) // AIRDROPS_PAGE_SIZE
+    page = min(max(page, 0), pages - 1)
+    start = page * AIRDROPS_PAGE_SIZE
+    
+    text = f"**{subcategory.replace('_', ' ').upper()} Airdrops:**\n\n"
+    if pages > 1:
+        text += f"Page {page + 1}/{pages}"
+    
     keyboard = [
-        [InlineKeyboardButton("📊 Trading Related", callback_data='mainnet_trading')],
-        [InlineKeyboardButton("🌐 Non-Trading Related", callback_data='mainnet_non_trading')],
-        [InlineKeyboardButton("🔙 Back", callback_data='airdrops')]
+        [InlineKeyboardButton(airdrop['name'], callback_data=f"view_airdrop_{airdrop['id']}")]
+        for airdrop in airdrops[start:start + AIRDROPS_PAGE_SIZE]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
     
-    text = "🚀 **Mainnet Airdrops**\n\nChoose a subcategory:"
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f'{category}_{subcategory}:{page - 1}'))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f'{category}_{subcategory}:{page + 1}'))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append(back_button)
+    
+    return text, InlineKeyboardMarkup(keyboard)
 
 # Show airdrops by category
-async def show_category_airdrops(update: Update, context: ContextTypes.DEFAULT_TYPE, category: str, subcategory: str):
+@timed_handler
+async def show_category_airdrops(update: Update, context: ContextTypes.DEFAULT_TYPE, category: str, subcategory: str, page: int = 0):
     query = update.callback_query
     await query.answer()
     
-    airdrops = db.get_airdrops_by_category(category, subcategory)
-    
-    if not airdrops:
-        text = f"No airdrops found in this category yet.\n\nCheck back later!"
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data=f'airdrop_{category}')]]
-    else:
-        text = f"**{subcategory.upper()} Airdrops:**\n\n"
-        keyboard = []
-        for airdrop in airdrops:
-            keyboard.append([InlineKeyboardButton(
-                airdrop['name'], 
-                callback_data=f"view_airdrop_{airdrop['id']}"
-            )])
-        keyboard.append([InlineKeyboardButton("🔙 Back", callback_data=f'airdrop_{category}')])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Clamped before the cache lookup so made-up page numbers can't fill it
+    pages = (db.count_airdrops_by_category(category, subcategory) + AIRDROPS_PAGE_SIZE - 1) // AIRDROPS_PAGE_SIZE
+    page = min(max(page, 0), max(pages - 1, 0))
+    text, reply_markup = category_pages.get_or_render(
+        (category, subcategory, page),
+        lambda: render_category_page(category, subcategory, page)
+    )
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
 # View specific airdrop
+@timed_handler
 async def view_airdrop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -179,6 +282,7 @@ async def view_airdrop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
 # Wallet menu
+@timed_handler
 async def wallet_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -211,6 +315,7 @@ async def wallet_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
 # Connect wallet
+@timed_handler
 async def connect_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -226,6 +331,7 @@ async def connect_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(text, reply_markup=reply_markup)
 
 # Handle wallet type selection
+@timed_handler
 async def wallet_type_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -242,6 +348,7 @@ async def wallet_type_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.edit_message_text(text, reply_markup=reply_markup)
 
 # Handle wallet address input
+@timed_handler
 async def handle_wallet_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if 'connecting_wallet' not in context.user_data:
         return
@@ -252,6 +359,7 @@ async def handle_wallet_address(update: Update, context: ContextTypes.DEFAULT_TY
     
     # Validate address
     if wallet_type == 'ethereum':
+        from web3 import Web3
         if not Web3.is_address(address):
             await update.message.reply_text("❌ Invalid Ethereum address! Please try again.")
             return
@@ -261,8 +369,12 @@ async def handle_wallet_address(update: Update, context: ContextTypes.DEFAULT_TY
             await update.message.reply_text("❌ Invalid Solana address! Please try again.")
             return
     
-    # Save wallet
+    # Save wallet and keep the webhook index in step
+    previous = (db.get_user_wallet(user_id) or {}).get(wallet_type)
+    if previous:
+        watched_addresses.remove(previous, user_id)
     db.save_user_wallet(user_id, wallet_type, address)
+    watched_addresses.add(address, user_id)
     
     # Clear context
     del context.user_data['connecting_wallet']
@@ -282,6 +394,7 @@ async def handle_wallet_address(update: Update, context: ContextTypes.DEFAULT_TY
     )
 
 # Check balance
+@timed_handler
 async def check_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -305,6 +418,7 @@ async def check_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text("Select network to check balance:", reply_markup=reply_markup)
 
 # Get balance for specific network
+@timed_handler
 async def get_network_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer("Fetching balance...")
@@ -315,29 +429,24 @@ async def get_network_balance(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     try:
         address = wallet_info.get('ethereum')
+        w3 = get_web3(network)
         
-        if network == 'eth' and w3_eth:
-            balance_wei = w3_eth.eth.get_balance(address)
-            balance = w3_eth.from_wei(balance_wei, 'ether')
-            network_name = "Ethereum Mainnet"
-        elif network == 'arb' and w3_arb:
-            balance_wei = w3_arb.eth.get_balance(address)
-            balance = w3_arb.from_wei(balance_wei, 'ether')
-            network_name = "Arbitrum"
-        elif network == 'base' and w3_base:
-            balance_wei = w3_base.eth.get_balance(address)
-            balance = w3_base.from_wei(balance_wei, 'ether')
-            network_name = "Base"
-        else:
+        if not w3:
             text = "❌ Web3 connection not available"
             keyboard = [[InlineKeyboardButton("🔙 Back", callback_data='check_balance')]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await query.edit_message_text(text, reply_markup=reply_markup)
             return
         
+        # web3's HTTP provider blocks, keep it off the event loop
+        # Wallets saved before addresses were checksummed are stored as typed
+        balance_wei = await asyncio.to_thread(w3.eth.get_balance, w3.to_checksum_address(address))
+        balance = w3.from_wei(balance_wei, 'ether')
+        network_name = WEB3_NETWORKS[network][0]
+        
         text = f"💰 **Balance on {network_name}**\n\n"
         text += f"Address: `{address[:6]}...{address[-4:]}`\n"
-        text += f"Balance: **{balance:.6f} ETH**"
+        text += f"Balance: **{balance:.6f} ETH**{usd_suffix('ETH', balance)}"
         
     except Exception as e:
         text = f"❌ Error fetching balance: {str(e)}"
@@ -351,22 +460,77 @@ async def get_network_balance(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
+# Search
+def search_airdrops(text: str, limit: int):
+    """Best matching airdrops for a query"""
+    # The index is filled when the data loads
+    if not db.loaded:
+        db.load_data(only_if_unloaded=True)
+    return [airdrop for airdrop in map(db.get_airdrop, airdrop_search.search(text, limit)) if airdrop]
+
+@timed_handler
+async def search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = ' '.join(context.args)
+    if not text:
+        await update.message.reply_text("🔎 Usage: /search <words>\n\nExample: /search zksync testnet")
+        return
+    
+    airdrops = search_airdrops(text, SEARCH_RESULTS)
+    if not airdrops:
+        await update.message.reply_text(f"🔎 No airdrops found for \"{text}\".", reply_markup=BACK_TO_MENU_MARKUP)
+        return
+    
+    keyboard = [
+        [InlineKeyboardButton(f"{airdrop['name']} ({airdrop['category']} › {airdrop['subcategory']})",
+                              callback_data=f"view_airdrop_{airdrop['id']}")]
+        for airdrop in airdrops
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 Back to Menu", callback_data='start')])
+    await update.message.reply_text(f"🔎 Results for \"{text}\":", reply_markup=InlineKeyboardMarkup(keyboard))
+
+def render_inline_results(text: str):
+    """Inline answer for a query; the newest airdrops when it's empty"""
+    if text:
+        airdrops = search_airdrops(text, INLINE_RESULTS)
+    else:
+        airdrops = db.get_all_airdrops()[-INLINE_RESULTS:][::-1]
+    return [
+        InlineQueryResultArticle(
+            id=str(airdrop['id']),
+            title=airdrop['name'],
+            description=f"{airdrop['category']} › {airdrop['subcategory']} · {airdrop['description'][:80]}",
+            input_message_content=InputTextMessageContent(
+                f"🎁 {airdrop['name']}\n\n{airdrop['description']}\n\n🔗 {airdrop['link']}",
+                disable_web_page_preview=True
+            ),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔗 Visit Link", url=airdrop['link'])]])
+        )
+        for airdrop in airdrops
+    ]
+
+@timed_handler
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Inline queries arrive on every keystroke; the same text gets the same answer
+    text = ' '.join(tokenize(update.inline_query.query))
+    results = inline_results.get_or_render((text,), lambda: render_inline_results(text))
+    await update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
+
 # Help handler
+@timed_handler
 async def help_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
     text = "❓ **Help & Support**\n\n"
     text += "If you need assistance, please send your message here and our admin will respond shortly.\n\n"
+    text += "🔎 Looking for an airdrop? Use /search <name>, or type @ and this bot's username in any chat.\n\n"
     text += "Type your message or question:"
     
-    keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data='start')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     context.user_data['awaiting_support_message'] = True
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    await query.edit_message_text(text, reply_markup=BACK_TO_MENU_MARKUP, parse_mode='Markdown')
 
 # Handle support messages
+@timed_handler
 async def handle_support_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.user_data.get('awaiting_support_message'):
         return
@@ -409,6 +573,7 @@ async def handle_support_message(update: Update, context: ContextTypes.DEFAULT_T
     )
 
 # Admin: Add airdrop
+@timed_handler
 async def admin_add_airdrop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
         await update.message.reply_text("❌ Unauthorized!")
@@ -424,11 +589,13 @@ async def admin_add_airdrop(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         airdrop_id = db.add_airdrop(category, subcategory, name, link, description)
         
+        keyboard = [[InlineKeyboardButton("📣 Announce to all users", callback_data=f"announce_airdrop_{airdrop_id}")]]
         await update.message.reply_text(
             f"✅ Airdrop added successfully!\n\n"
             f"ID: {airdrop_id}\n"
             f"Category: {category} > {subcategory}\n"
-            f"Name: {name}"
+            f"Name: {name}",
+            reply_markup=InlineKeyboardMarkup(keyboard)
         )
     except Exception as e:
         await update.message.reply_text(
@@ -440,7 +607,194 @@ async def admin_add_airdrop(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Error: {str(e)}"
         )
 
+# Admin: Bulk import from an uploaded CSV/JSON document
+@timed_handler
+async def admin_import_airdrops(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        return
+    
+    document = update.message.document
+    kind = import_kind(document.file_name, document.mime_type)
+    if kind is None:
+        await update.message.reply_text(
+            "❌ Send a .csv or .json file to import airdrops.\n\n"
+            "Columns/keys: category, subcategory, name, link, description"
+        )
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+        await update.message.reply_text("❌ File too large! Bots can only download files up to 20 MB.")
+        return
+    
+    # Downloaded to disk and parsed off the event loop, a row at a time
+    fd, path = tempfile.mkstemp(suffix=f'.{kind}')
+    os.close(fd)
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        existing_links = [airdrop['link'] for airdrop in db.get_all_airdrops()]
+        result = await asyncio.to_thread(read_import_file, path, kind, existing_links)
+    finally:
+        os.remove(path)
+    
+    # A file that couldn't be read to the end imports nothing; fix it and send it again
+    imported = [] if result.fatal else await db.import_airdrops(result.rows)
+    
+    text = f"📥 Import {'failed' if result.fatal else 'finished'}\n\n"
+    if result.fatal:
+        text += f"⚠️ {result.fatal}\n\n"
+    text += f"Rows read: {result.read}\n"
+    text += f"Imported: {len(imported)}\n"
+    text += f"Rejected: {result.error_count}\n"
+    if result.errors:
+        text += "\n" + "\n".join(f"Row {row}: {error}" for row, error in result.errors)
+        if result.error_count > len(result.errors):
+            text += f"\n...and {result.error_count - len(result.errors)} more"
+    await update.message.reply_text(text)
+
+# Admin: Broadcasts
+def format_broadcast_status(status) -> str:
+    return (
+        f"📣 Broadcast {status['id']} ({status['status']})\n\n"
+        f"Delivered: {status['delivered']}\n"
+        f"Blocked: {status['blocked']}\n"
+        f"Failed: {status['failed']}\n"
+        f"Started: {status['started_at']}"
+        + (f"\n\nStopped: {status['error']}" if status.get('error') else "")
+    )
+
+@timed_handler
+async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Unauthorized!")
+        return
+    
+    # Format: /broadcast message text
+    parts = update.message.text.split(' ', 1)
+    if len(parts) < 2 or not parts[1].strip():
+        await update.message.reply_text("Format: /broadcast message text")
+        return
+    if broadcaster is None:
+        await update.message.reply_text("⏳ Bot is still starting, try again in a moment.")
+        return
+    
+    broadcast_id = broadcaster.start(parts[1].strip())
+    await update.message.reply_text(
+        f"📣 Broadcast {broadcast_id} started.\n\nUse /broadcast_status to follow it."
+    )
+
+@timed_handler
+async def admin_broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Unauthorized!")
+        return
+    
+    status = broadcaster.status() if broadcaster else None
+    if not status:
+        await update.message.reply_text("No broadcasts yet.")
+        return
+    await update.message.reply_text(format_broadcast_status(status))
+
+def format_stats(stats, days: int = 7) -> str:
+    """Totals plus the last few days' counters"""
+    wallets = ', '.join(f"{count} {wallet_type}" for wallet_type, count in sorted(stats['wallets'].items()))
+    support = ', '.join(f"{count} {status}" for status, count in sorted(stats['support'].items()))
+    lines = [
+        "📊 Stats",
+        "",
+        f"👥 Users: {stats['users']}",
+        f"👛 Wallets: {wallets or 'none'}",
+        f"🎁 Airdrops: {stats['airdrops']}",
+        f"💬 Support messages: {support or 'none'}",
+        "",
+        f"Last {days} days (joins / wallets / airdrops / support):",
+    ]
+    today = datetime.now()
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).strftime('%Y-%m-%d')
+        counts = stats['daily'].get(day, {})
+        lines.append(f"{day}: {counts.get('joins', 0)} / {counts.get('wallets', 0)} / "
+                     f"{counts.get('airdrops', 0)} / {counts.get('support_messages', 0)}")
+    return "\n".join(lines)
+
+@timed_handler
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Unauthorized!")
+        return
+    await update.message.reply_text(format_stats(db.get_stats()))
+
+@timed_handler
+async def admin_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile shows handler timings and slow updates; /profile N samples the bot for N seconds"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Unauthorized!")
+        return
+    
+    if not context.args:
+        lines = ["⏱ Handler timings (traced calls)"]
+        lines += format_handler_traces(handler_traces) or ["None yet, run /profile <seconds> to trace handlers"]
+        lines += ["", "🐢 Slow updates"]
+        lines += [f"{at} {seconds:.2f}s (queued {queued:.2f}s) {description}"
+                  for at, seconds, queued, description in list(slow_updates)[-10:]] or ["None"]
+        await update.message.reply_text("\n".join(lines))
+        return
+    
+    try:
+        seconds = float(context.args[0])
+    except ValueError:
+        await update.message.reply_text(f"Usage: /profile [seconds, up to {MAX_PROFILE_SECONDS}]")
+        return
+    if profiling_active():
+        await update.message.reply_text("A profile is already running.")
+        return
+    
+    seconds = max(1.0, min(seconds, MAX_PROFILE_SECONDS))
+    await update.message.reply_text(f"⏱ Profiling for {seconds:.0f}s...")
+    
+    async def send_profile():
+        profiler, traces = await profile_loop(seconds)
+        summary = [
+            f"{profiler.samples} samples, loop idle {profiler.idle_share() * 100:.0f}% of the time",
+            *format_handler_traces(traces, limit=5),
+        ]
+        # Collapsed stacks: feed to flamegraph.pl or open in speedscope
+        await update.message.reply_document(
+            document=profiler.collapsed().encode(),
+            filename=f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt",
+            caption="\n".join(summary)[:1024]
+        )
+    
+    # In the background, so the admin's lane isn't held for the whole run
+    context.application.create_task(send_profile(), update=update)
+
+@timed_handler
+async def announce_airdrop(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id != ADMIN_ID:
+        await query.answer("❌ Unauthorized!")
+        return
+    
+    airdrop = db.get_airdrop(int(query.data.split('_')[-1]))
+    if not airdrop or broadcaster is None:
+        await query.answer("Airdrop not found!" if not airdrop else "Bot is still starting")
+        return
+    await query.answer()
+    
+    # Names and descriptions are free text; unescaped they can break the
+    # Markdown and Telegram would reject the message for everyone
+    text = (
+        f"🆕 New airdrop: *{escape_markdown(airdrop['name'])}*\n\n"
+        f"{escape_markdown(airdrop['description'])}\n\n"
+        f"🔗 Link: {escape_markdown(airdrop['link'])}"
+    )
+    broadcast_id = broadcaster.start(text, parse_mode='Markdown')
+    await query.edit_message_text(
+        f"📣 Announcing {airdrop['name']} (broadcast {broadcast_id}).\n\n"
+        f"Use /broadcast_status to follow it."
+    )
+
 # Callback query router
+@timed_handler
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
@@ -455,12 +809,16 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await airdrop_testnet(update, context)
     elif data == 'airdrop_mainnet':
         await airdrop_mainnet(update, context)
-    elif data.startswith('testnet_'):
-        subcategory = data.split('_')[1]
-        await show_category_airdrops(update, context, 'testnet', subcategory)
-    elif data.startswith('mainnet_'):
-        subcategory = data.split('_')[1]
-        await show_category_airdrops(update, context, 'mainnet', subcategory)
+    elif data.startswith('testnet_') or data.startswith('mainnet_'):
+        # <category>_<subcategory>[:<page>]; subcategories may contain '_'
+        category, rest = data.split('_', 1)
+        subcategory, _, page_text = rest.partition(':')
+        # Callback data comes from the client; anything odd shows the first page
+        try:
+            page = int(page_text or 0)
+        except ValueError:
+            page = 0
+        await show_category_airdrops(update, context, category, subcategory, page)
     elif data.startswith('view_airdrop_'):
         await view_airdrop(update, context)
     elif data == 'wallet':
@@ -475,39 +833,226 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await get_network_balance(update, context)
     elif data == 'help':
         await help_handler(update, context)
+    elif data.startswith('announce_airdrop_'):
+        await announce_airdrop(update, context)
 
 # Message handler
+@timed_handler
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if 'connecting_wallet' in context.user_data:
         await handle_wallet_address(update, context)
+    elif 'selected_chain' in context.user_data:
+        # A /connect_wallet flow whose ConversationHandler state was lost in
+        # a restart; the chain it was waiting on is still in user_data
+        await address_entered(update, context)
     elif context.user_data.get('awaiting_support_message'):
         await handle_support_message(update, context)
 
 # Error handler
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if isinstance(context.error, RetryAfter):
+        metrics.TELEGRAM_RETRY_AFTER.labels('handlers').inc()
     logger.error(f"Exception while handling an update: {context.error}")
 
-# Main function
-def main():
-    """Main function to start the bot"""
-    # Start Flask server for keep-alive
+# Background jobs
+background_tasks = set()
+# Created in warm_up once the bot and data are available
+broadcaster = None
+
+def start_keep_alive():
+    """Import Flask and start the keep-alive server (runs off the event loop)"""
+    from keep_alive import keep_alive
     keep_alive()
+
+def owned_wallets() -> dict:
+    """Connected wallets this process looks after; a cluster worker only has the users it owns"""
+    wallets = db.get_all_wallets()
+    if cluster.current_worker:
+        wallets = cluster.owned_wallets(wallets, *cluster.current_worker)
+    return wallets
+
+async def warm_up(application: Application):
+    """Load data and start background services while updates are already being served"""
+    started = time.perf_counter()
+    await asyncio.to_thread(db.load_data, True)
+    # Other workers' journaled writes are applied by a background task, not on reads
+    if db.shared:
+        task = asyncio.create_task(db.run_shared_refresh())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    
+    # Index connected wallets for webhook matching; a cluster worker only
+    # watches the users it owns, so only it notifies them
+    load_watched_addresses(owned_wallets())
+    # USD prices for balances and notifications, refreshed in the background
+    start_price_service()
+    # Each worker watches its own wallets from its own block checkpoints;
+    # sharing the file, workers would overwrite each other's progress
+    watcher_checkpoint_file = (f"{WATCHER_CHECKPOINT_FILE}.{cluster.current_worker[0]}"
+                               if cluster.current_worker else WATCHER_CHECKPOINT_FILE)
+    start_chain_watchers(application, watcher_checkpoint_file)
+    
+    # Balance snapshots for /history, per worker in a cluster
+    if cluster.current_worker:
+        portfolio_history.path = f"{portfolio_history.path}.{cluster.current_worker[0]}"
+    await asyncio.to_thread(portfolio_history.load)
+    start_portfolio_snapshots(application, owned_wallets)
+    
+    # Gas trackers with saved alerts; alerts belong to the worker that took them
+    gas_alerts_file = f"{GAS_ALERTS_FILE}.{cluster.current_worker[0]}" if cluster.current_worker else GAS_ALERTS_FILE
+    # In a cluster only the ingress polls the chains
+    start_gas_trackers(application, gas_alerts_file, poll=not cluster.current_worker)
     
-    # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Broadcasts interrupted by a restart carry on; in a cluster only the
+    # admin's worker runs them, the others would send everything again
+    global broadcaster
+    broadcaster = Broadcaster(application.bot, db, CheckpointStore(BROADCAST_CHECKPOINT_FILE, min_interval=1.0))
+    if not cluster.current_worker or cluster.worker_for(ADMIN_ID, cluster.current_worker[1]) == cluster.current_worker[0]:
+        broadcaster.resume()
+    
+    # In webhook mode the webhook server is already up and answers health checks;
+    # in a cluster the ingress process serves HTTP
+    if BOT_MODE != 'webhook' and not cluster.current_worker:
+        if ALCHEMY_WEBHOOK_ID_ETH:
+            import webhook_handler
+            await webhook_handler.start_server(application)
+        await asyncio.to_thread(start_keep_alive)
+    logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+async def post_init(application: Application):
+    """Kick off warm-up without delaying the first getUpdates"""
+    for coro in (warm_up(application), run_state_evictor(), metrics.monitor_event_loop_lag()):
+        task = asyncio.create_task(coro)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+async def post_stop(application: Application):
+    """Stop background jobs and deliver anything still pending while the bot can still send"""
+    import webhook_handler
+    for task in list(background_tasks):
+        task.cancel()
+    await webhook_handler.stop_server()
+    if broadcaster:
+        await broadcaster.stop()
+    await stop_chain_watchers()
+    await stop_portfolio_snapshots()
+    await stop_gas_trackers()
+    await stop_price_service()
+    await flush_all(application)
+    get_conversation_states().flush()
+    await get_conversation_states().drain()
+    # Data writes still queued for the journal
+    await asyncio.to_thread(db.flush)
+
+async def run_webhook(application: Application):
+    """Serve updates pushed by Telegram on the webhook server until SIGINT/SIGTERM"""
+    import webhook_handler
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    async with application:
+        await webhook_handler.start_server(application)
+        await application.start()
+        await post_init(application)
+        
+        # Pending updates are kept; Telegram delivers the backlog once the webhook is set
+        await application.bot.set_webhook(
+            url=TELEGRAM_WEBHOOK_URL + webhook_handler.TELEGRAM_WEBHOOK_PATH,
+            secret_token=webhook_handler.TELEGRAM_WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=False
+        )
+        logger.info(f"Webhook set to {TELEGRAM_WEBHOOK_URL}{webhook_handler.TELEGRAM_WEBHOOK_PATH}")
+        
+        await stop.wait()
+        
+        # Stop taking requests before the application stops processing the queue
+        await webhook_handler.stop_server()
+        await application.stop()
+        await post_stop(application)
+
+def build_application(updater: bool = True) -> Application:
+    """Application with every handler registered; updater=False when updates are fed in"""
+    # Data loading and the keep-alive server start in post_init
+    # Users run in parallel, each user's updates stay in order for the user_data flows
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(LaneUpdateProcessor())
+        # user_data lives in the conversation state store instead of process memory
+        .context_types(ContextTypes(context=StateContext))
+        .post_init(post_init)
+        .post_stop(post_stop)
+    )
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    if TELEGRAM_API_BASE_FILE_URL:
+        builder = builder.base_file_url(TELEGRAM_API_BASE_FILE_URL)
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
+    
+    # Read when /metrics is scraped
+    metrics.gauge('telegram_update_queue_size', 'Updates received but not yet handed to handlers').set_function(
+        application.update_queue.qsize)
+    metrics.register_stats('update_processor_stats', application.update_processor.snapshot, 'Update lanes and slots')
+    metrics.register_stats('conversation_state_stats', lambda: get_conversation_states().stats,
+                           'Conversation state store counters')
+    metrics.register_stats('portfolio_stats', lambda: portfolio_snapshotter.stats, 'Portfolio snapshot rounds')
+    metrics.register_stats('price_stats', prices.snapshot, 'USD price refreshes and lookups')
+    metrics.register_stats('gas_stats', gas_stats, 'Gas tracker polls, new heads and alerts')
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("search", search_handler))
     application.add_handler(CommandHandler("add_airdrop", admin_add_airdrop))
+    application.add_handler(CommandHandler("broadcast", admin_broadcast))
+    application.add_handler(CommandHandler("broadcast_status", admin_broadcast_status))
+    application.add_handler(CommandHandler("profile", admin_profile))
+    application.add_handler(CommandHandler("stats", admin_stats))
+    # Admin browser and wallet buttons are matched before the catch-all router
+    register_admin_handlers(application, db, ADMIN_ID)
+    register_wallet_handlers(application, db)
+    register_portfolio_handlers(application, db)
+    register_gas_handlers(application)
+    # Its forwarded-post handler sees every message, so it runs in group 1
+    # next to message_handler rather than in front of it
+    register_airdrop_handlers(application, db, ADMIN_ID, group=1)
     application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(InlineQueryHandler(inline_search))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
+    application.add_handler(MessageHandler(filters.Document.ALL, admin_import_airdrops))
+    # Read user_data before the handlers above and write back what they changed
+    application.add_handler(TypeHandler(Update, load_user_state), group=-100)
+    application.add_handler(TypeHandler(Update, flush_user_state), group=100)
     
     # Add error handler
     application.add_error_handler(error_handler)
+    return application
+
+# Main function
+def main():
+    """Main function to start the bot"""
+    if cluster.CLUSTER_WORKERS > 1:
+        # Ingress plus worker processes, see cluster.py
+        cluster.main()
+        return
+    
+    # Webhook mode: updates arrive through webhook_handler, no getUpdates loop needed
+    application = build_application(updater=BOT_MODE != 'webhook')
     
-    # Run bot with simple polling
     logger.info("🤖 Bot starting...")
-    application.run_polling(drop_pending_updates=True)
+    if BOT_MODE == 'webhook':
+        if not TELEGRAM_WEBHOOK_URL:
+            raise SystemExit("TELEGRAM_WEBHOOK_URL is required when BOT_MODE=webhook")
+        asyncio.run(run_webhook(application))
+    else:
+        # Run bot with simple polling
+        application.run_polling(drop_pending_updates=True)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
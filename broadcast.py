@@ -0,0 +1,245 @@
+# broadcast.py
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from checkpoint import CheckpointStore
+from log_pipeline import HotPathLogger
+from metrics import TELEGRAM_RETRY_AFTER, counter
+
+logger = logging.getLogger(__name__)
+# Per-recipient failures, one per user in the worst case
+hot_log = HotPathLogger(logger)
+
+# Telegram allows ~30 messages/s per bot; stay under it so interactive replies still go out
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '16'))
+BROADCAST_CHECKPOINT_FILE = os.getenv('BROADCAST_CHECKPOINT_FILE', 'broadcasts.json')
+# Recipients per checkpoint; a crash repeats at most the chunks since the last file write
+BROADCAST_CHUNK = 200
+# Telegram asks for about one message per second per chat
+PER_CHAT_INTERVAL = 1.0
+MAX_ATTEMPTS = 3
+# BadRequests about the message itself; every recipient would get the same
+# answer, so the broadcast stops at the first one
+MESSAGE_ERRORS = ("can't parse entities", "message is too long", "message text is empty")
+
+BROADCAST_SENDS = counter('broadcast_messages_total', 'Broadcast sends by outcome', ['result'])
+_flood_limited = TELEGRAM_RETRY_AFTER.labels('broadcast')
+
+class RateLimiter:
+    """Token bucket shared by all senders, with per-chat spacing and a global pause for 429s"""
+
+    def __init__(self, rate: float = BROADCAST_RATE, burst: Optional[float] = None,
+                 per_chat_interval: float = PER_CHAT_INTERVAL):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate / 5)
+        self.per_chat_interval = per_chat_interval
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # chat_id -> last send, oldest first
+        self._last_sent: 'OrderedDict[int, float]' = OrderedDict()
+
+    def pause(self, seconds: float) -> bool:
+        """Hold every sender, e.g. after a RetryAfter; False if already paused"""
+        now = time.monotonic()
+        was_paused = self._paused_until > now
+        self._paused_until = max(self._paused_until, now + seconds)
+        return not was_paused
+
+    def _chat_delay(self, chat_id: int, now: float) -> float:
+        # Entries older than the interval can't delay anyone, drop them
+        while self._last_sent:
+            sent_at = next(iter(self._last_sent.values()))
+            if now - sent_at < self.per_chat_interval:
+                break
+            self._last_sent.popitem(last=False)
+        sent_at = self._last_sent.get(chat_id)
+        return 0.0 if sent_at is None else sent_at + self.per_chat_interval - now
+
+    async def acquire(self, chat_id: int):
+        """Wait until a message to chat_id may be sent"""
+        while True:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self._chat_delay(chat_id, now))
+            if wait <= 0:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self._last_sent.pop(chat_id, None)
+                    self._last_sent[chat_id] = now
+                    return
+                wait = (1 - self._tokens) / self.rate
+            await asyncio.sleep(wait)
+
+class Broadcaster:
+    """Sends a message to every user, checkpointing progress so restarts resume
+
+    Recipients come from Database.iter_user_ids in ascending id order. After
+    each chunk the last id sent and the delivered/blocked/failed counts go to
+    the checkpoint file; a run left 'running' is picked up by resume().
+    """
+
+    def __init__(self, bot, db, checkpoints: CheckpointStore,
+                 limiter: Optional[RateLimiter] = None,
+                 concurrency: int = BROADCAST_CONCURRENCY,
+                 chunk_size: int = BROADCAST_CHUNK):
+        self.bot = bot
+        self.db = db
+        self.checkpoints = checkpoints
+        self.limiter = limiter or RateLimiter()
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _key(broadcast_id: str) -> str:
+        return f"broadcast:{broadcast_id}"
+
+    def start(self, text: str, parse_mode: Optional[str] = None) -> str:
+        """Begin a broadcast; returns its id"""
+        broadcast_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        self.checkpoints.set(self._key(broadcast_id), {
+            'text': text,
+            'parse_mode': parse_mode,
+            'cursor': None,
+            'delivered': 0,
+            'blocked': 0,
+            'failed': 0,
+            'status': 'running',
+            'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        self.checkpoints.flush()
+        self._spawn(broadcast_id)
+        return broadcast_id
+
+    def resume(self) -> List[str]:
+        """Restart every broadcast a previous run left unfinished"""
+        resumed = []
+        for key, state in self.checkpoints.data.items():
+            if key.startswith('broadcast:') and state.get('status') == 'running':
+                broadcast_id = key.split(':', 1)[1]
+                if broadcast_id not in self._tasks:
+                    self._spawn(broadcast_id)
+                    resumed.append(broadcast_id)
+        if resumed:
+            logger.info(f"Resuming broadcasts: {', '.join(resumed)}")
+        return resumed
+
+    def status(self, broadcast_id: Optional[str] = None) -> Optional[Dict]:
+        """Progress of one broadcast, or the latest one"""
+        if broadcast_id is None:
+            keys = sorted(key for key in self.checkpoints.data if key.startswith('broadcast:'))
+            if not keys:
+                return None
+            broadcast_id = keys[-1].split(':', 1)[1]
+        state = self.checkpoints.get(self._key(broadcast_id))
+        return dict(state, id=broadcast_id) if state else None
+
+    def _spawn(self, broadcast_id: str):
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def stop(self):
+        """Cancel running broadcasts; their checkpoints stay 'running' for resume()"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.checkpoints.flush()
+
+    def _chunks(self, after: Optional[int]) -> Iterable[List[int]]:
+        chunk = []
+        for user_id in self.db.iter_user_ids(after=after):
+            chunk.append(user_id)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def _run(self, broadcast_id: str):
+        key = self._key(broadcast_id)
+        state = dict(self.checkpoints.get(key))
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+
+        rejected: List[str] = []
+
+        async def send(chat_id: int) -> str:
+            async with semaphore:
+                # Sends already queued in the chunk are dropped after a rejection
+                if rejected:
+                    return 'rejected'
+                try:
+                    return await self._send(chat_id, state['text'], state['parse_mode'])
+                except BadRequest as e:
+                    rejected.append(str(e))
+                    return 'rejected'
+
+        for chunk in self._chunks(state['cursor']):
+            for outcome in await asyncio.gather(*(send(chat_id) for chat_id in chunk)):
+                if outcome != 'rejected':
+                    state[outcome] += 1
+                    BROADCAST_SENDS.labels(outcome).inc()
+            if rejected:
+                BROADCAST_SENDS.labels('rejected').inc()
+                state['status'] = 'rejected'
+                state['error'] = rejected[0]
+                state['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                self.checkpoints.set(key, state)
+                self.checkpoints.flush()
+                logger.error(f"Broadcast {broadcast_id} stopped, Telegram rejected the message: {rejected[0]}")
+                return
+            state['cursor'] = chunk[-1]
+            self.checkpoints.set(key, dict(state))
+
+        state['status'] = 'done'
+        state['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.checkpoints.set(key, state)
+        self.checkpoints.flush()
+        logger.info(
+            f"Broadcast {broadcast_id} finished in {time.monotonic() - started:.1f}s: "
+            f"{state['delivered']} delivered, {state['blocked']} blocked, {state['failed']} failed"
+        )
+
+    async def _send(self, chat_id: int, text: str, parse_mode: Optional[str]) -> str:
+        """Deliver one message; returns 'delivered', 'blocked' or 'failed'
+
+        Raises BadRequest when the message itself is invalid.
+        """
+        attempts = 0
+        while attempts < MAX_ATTEMPTS:
+            await self.limiter.acquire(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode,
+                                            disable_web_page_preview=True)
+                return 'delivered'
+            except RetryAfter as e:
+                # Flood control applies to the whole bot, so everyone waits
+                _flood_limited.inc()
+                if self.limiter.pause(float(e.retry_after)):
+                    logger.warning(f"Broadcast flood limited, pausing {e.retry_after}s")
+            except Forbidden:
+                return 'blocked'
+            except BadRequest as e:
+                if any(error in str(e).lower() for error in MESSAGE_ERRORS):
+                    raise
+                hot_log.debug("Broadcast to %s rejected: %s", chat_id, e)
+                return 'failed'
+            except NetworkError as e:
+                attempts += 1
+                await asyncio.sleep(2 ** attempts)
+            except TelegramError as e:
+                hot_log.warning("Broadcast to %s failed: %s", chat_id, e)
+                return 'failed'
+        return 'failed'
@@ -0,0 +1,351 @@
+# chain_watcher.py
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from address_index import AddressIndex
+from checkpoint import CheckpointStore
+from log_pipeline import HotPathLogger
+from rpc import RpcClient, RpcError
+
+logger = logging.getLogger(__name__)
+# Per-activity errors come in bursts when Telegram or a node has trouble
+hot_log = HotPathLogger(logger)
+
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+# ERC-20 selectors for token metadata
+SYMBOL_SELECTOR = '0x95d89b41'
+DECIMALS_SELECTOR = '0x313ce567'
+# decimals() is a uint8 by convention but a contract can return anything;
+# 10**decimals past a uint256's 77 digits is a bogus token and would stall
+# the loop, so such tokens are shown with the default 18
+MAX_TOKEN_DECIMALS = 77
+DEFAULT_TOKEN_DECIMALS = 18
+
+# Watcher settings
+WATCHER_CHAINS = [c.strip() for c in os.getenv('BLOCK_WATCHER_CHAINS', '').split(',') if c.strip()]
+WATCHER_POLL_INTERVAL = float(os.getenv('BLOCK_WATCHER_POLL_INTERVAL', '2'))
+WATCHER_CONFIRMATIONS = int(os.getenv('BLOCK_WATCHER_CONFIRMATIONS', '1'))
+WATCHER_BATCH_SIZE = int(os.getenv('BLOCK_WATCHER_BATCH_SIZE', '5'))
+WATCHER_CHECKPOINT_FILE = os.getenv('BLOCK_WATCHER_CHECKPOINT_FILE', 'watcher_checkpoints.json')
+
+OnActivity = Callable[[int, dict], Awaitable[None]]
+
+def watcher_enabled(chain: str) -> bool:
+    """Whether the polling watcher is switched on for a chain"""
+    return chain in WATCHER_CHAINS
+
+def keccak(data: bytes) -> bytes:
+    # eth_utils ships with web3; imported here so this module stays light
+    from eth_utils import keccak as _keccak
+    return _keccak(data)
+
+def bloom_bits(value: bytes) -> Tuple[int, int, int]:
+    """The three logsBloom bit positions an address or topic sets"""
+    digest = keccak(value)
+    return tuple(((digest[i] << 8) | digest[i + 1]) & 2047 for i in (0, 2, 4))
+
+def bloom_contains(bloom: int, bits: Tuple[int, ...]) -> bool:
+    return all((bloom >> bit) & 1 for bit in bits)
+
+def topic_for_address(key: bytes) -> bytes:
+    """An address as it appears in an indexed event topic"""
+    return b'\x00' * 12 + key
+
+def decode_symbol(result: Optional[str]) -> Optional[str]:
+    """Decode symbol() as either an ABI string or a bytes32"""
+    if not result or result == '0x':
+        return None
+    raw = bytes.fromhex(result[2:])
+    try:
+        if len(raw) >= 64:
+            length = int.from_bytes(raw[32:64], 'big')
+            return raw[64:64 + length].decode('utf-8', 'ignore') or None
+        return raw.rstrip(b'\x00').decode('utf-8', 'ignore') or None
+    except (ValueError, OverflowError):
+        return None
+
+class ChainWatcher:
+    """Follows one EVM chain over JSON-RPC and reports transfers touching watched addresses
+
+    Native transfers are read from full block bodies. Receipts are only
+    fetched for blocks whose logsBloom could contain an ERC-20 Transfer to or
+    from a watched address, which skips most blocks for small address sets.
+    """
+
+    def __init__(self, chain: str, rpc_url: str, network: str, native_asset: str,
+                 index: AddressIndex, on_activity: OnActivity, checkpoints: CheckpointStore,
+                 poll_interval: float = WATCHER_POLL_INTERVAL,
+                 confirmations: int = WATCHER_CONFIRMATIONS,
+                 batch_size: int = WATCHER_BATCH_SIZE):
+        self.chain = chain
+        self.network = network
+        self.native_asset = native_asset
+        self.index = index
+        self.on_activity = on_activity
+        self.checkpoints = checkpoints
+        self.poll_interval = poll_interval
+        self.confirmations = confirmations
+        self.batch_size = batch_size
+        self.rpc = RpcClient(rpc_url, chain=chain)
+
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+        self._bloom_version = -1
+        self._bloom_cache: Dict[bytes, Tuple[int, int, int]] = {}
+        self._bloom_buckets: Dict[int, List[Tuple[int, int]]] = {}
+        self._tokens: Dict[str, Tuple[str, int]] = {}
+        self._block_receipts_supported = True
+        self._transfer_bits = bloom_bits(bytes.fromhex(TRANSFER_TOPIC[2:]))
+
+        self.stats = {
+            'blocks_scanned': 0,
+            'receipt_fetches': 0,
+            'receipt_skips': 0,
+            'matches': 0,
+        }
+
+    @property
+    def checkpoint_key(self) -> str:
+        return f"evm:{self.chain}"
+
+    # Bloom prefilter
+    def _refresh_bloom_buckets(self):
+        """Re-bucket watched addresses by their first bloom bit after index changes"""
+        if self._bloom_version == self.index.version:
+            return
+
+        cache = {}
+        buckets: Dict[int, List[Tuple[int, int]]] = {}
+        for key in self.index.keys():
+            if len(key) != 20:
+                continue
+            bits = self._bloom_cache.get(key) or bloom_bits(topic_for_address(key))
+            cache[key] = bits
+            buckets.setdefault(bits[0], []).append((bits[1], bits[2]))
+
+        self._bloom_cache = cache
+        self._bloom_buckets = buckets
+        self._bloom_version = self.index.version
+
+    def _needs_receipts(self, block: dict) -> bool:
+        """Could this block hold a Transfer log naming a watched address?"""
+        bloom = int(block.get('logsBloom') or '0x0', 16)
+        if not bloom or not bloom_contains(bloom, self._transfer_bits):
+            return False
+
+        for first_bit, rest in self._bloom_buckets.items():
+            if not (bloom >> first_bit) & 1:
+                continue
+            for second_bit, third_bit in rest:
+                if (bloom >> second_bit) & 1 and (bloom >> third_bit) & 1:
+                    return True
+        return False
+
+    # Main loop
+    async def run(self):
+        """Poll for new blocks until stopped"""
+        self._running = True
+        logger.info(f"Block watcher started for {self.chain}")
+        while self._running:
+            try:
+                processed = await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Block watcher error on {self.chain}: {e}")
+                processed = 0
+            if not processed:
+                await asyncio.sleep(self.poll_interval)
+        self.checkpoints.flush()
+
+    def start(self) -> asyncio.Task:
+        """Run the watcher as a background task"""
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.checkpoints.flush()
+        await self.rpc.close()
+
+    async def poll_once(self) -> int:
+        """Scan the next batch of confirmed blocks; returns how many were processed"""
+        head = int(await self.rpc.call('eth_blockNumber'), 16) - self.confirmations
+        last = self.checkpoints.get(self.checkpoint_key)
+        if last is None:
+            # First run starts at the head instead of replaying history
+            self.checkpoints.set(self.checkpoint_key, head)
+            return 0
+        if head <= last:
+            return 0
+
+        numbers = list(range(last + 1, min(head, last + self.batch_size) + 1))
+        processed = await self._scan_blocks(numbers)
+        if processed:
+            self.checkpoints.set(self.checkpoint_key, numbers[processed - 1])
+        return processed
+
+    async def _scan_blocks(self, numbers: List[int]) -> int:
+        blocks = await self.rpc.batch([('eth_getBlockByNumber', [hex(n), True]) for n in numbers])
+
+        # Stop at the first block the node can't serve yet
+        ready = []
+        for block in blocks:
+            if not block or isinstance(block, RpcError):
+                break
+            ready.append(block)
+        if not ready:
+            return 0
+
+        self._refresh_bloom_buckets()
+        matches: List[Tuple[int, dict]] = []
+        receipt_blocks = []
+
+        for block in ready:
+            self.stats['blocks_scanned'] += 1
+            matches.extend(self._match_native(block))
+            if self._bloom_buckets and self._needs_receipts(block):
+                receipt_blocks.append(block)
+            else:
+                self.stats['receipt_skips'] += 1
+
+        if receipt_blocks:
+            receipts = await self._fetch_receipts(receipt_blocks)
+            matches.extend(await self._match_token_transfers(receipts))
+
+        self.stats['matches'] += len(matches)
+        for user_id, activity in matches:
+            try:
+                await self.on_activity(user_id, activity)
+            except Exception as e:
+                hot_log.error("Error delivering %s activity to %s: %s", self.chain, user_id, e)
+
+        return len(ready)
+
+    # Matching
+    def _activity(self, direction: str, value: float, asset: str, tx_hash: str, counterparty: str,
+                  contract: Optional[str] = None) -> dict:
+        return {
+            'direction': direction,
+            'value': value,
+            'asset': asset,
+            'hash': tx_hash,
+            'counterparty': counterparty,
+            'network': self.network,
+            # Set for token transfers; prices go by contract, not the reported symbol
+            'contract': contract,
+        }
+
+    def _match_native(self, block: dict) -> List[Tuple[int, dict]]:
+        owners_by_key = self.index.owners_by_key
+        matches = []
+        for tx in block.get('transactions', []):
+            value = int(tx.get('value') or '0x0', 16)
+            if not value:
+                continue
+            sender = tx.get('from') or ''
+            recipient = tx.get('to') or ''
+            amount = value / 10**18
+            for user_id in owners_by_key(bytes.fromhex(sender[2:])):
+                matches.append((user_id, self._activity('sent', amount, self.native_asset, tx['hash'], recipient)))
+            if recipient:
+                for user_id in owners_by_key(bytes.fromhex(recipient[2:])):
+                    matches.append((user_id, self._activity('received', amount, self.native_asset, tx['hash'], sender)))
+        return matches
+
+    async def _fetch_receipts(self, blocks: List[dict]) -> List[dict]:
+        """All receipts of the given blocks, via eth_getBlockReceipts where the node has it"""
+        self.stats['receipt_fetches'] += len(blocks)
+        receipts: List[dict] = []
+
+        if self._block_receipts_supported:
+            results = await self.rpc.batch([('eth_getBlockReceipts', [block['number']]) for block in blocks])
+            if not any(isinstance(r, RpcError) for r in results):
+                for result in results:
+                    receipts.extend(result or [])
+                return receipts
+            logger.info(f"{self.chain} node lacks eth_getBlockReceipts, using per-transaction receipts")
+            self._block_receipts_supported = False
+
+        calls = [
+            ('eth_getTransactionReceipt', [tx['hash']])
+            for block in blocks for tx in block.get('transactions', [])
+        ]
+        for start in range(0, len(calls), 100):
+            for result in await self.rpc.batch(calls[start:start + 100]):
+                if result and not isinstance(result, RpcError):
+                    receipts.append(result)
+        return receipts
+
+    async def _match_token_transfers(self, receipts: List[dict]) -> List[Tuple[int, dict]]:
+        owners_by_key = self.index.owners_by_key
+        hits = []
+        for receipt in receipts:
+            if receipt.get('status') == '0x0':
+                continue
+            for log in receipt.get('logs', []):
+                topics = log.get('topics', [])
+                # ERC-20 only: ERC-721 indexes the token id as a fourth topic
+                if len(topics) != 3 or topics[0] != TRANSFER_TOPIC:
+                    continue
+                sender = '0x' + topics[1][-40:]
+                recipient = '0x' + topics[2][-40:]
+                senders = owners_by_key(bytes.fromhex(sender[2:]))
+                recipients = owners_by_key(bytes.fromhex(recipient[2:]))
+                if senders or recipients:
+                    hits.append((log, sender, recipient, senders, recipients))
+
+        if not hits:
+            return []
+
+        await self._load_token_info({log['address'].lower() for log, *_ in hits})
+
+        matches = []
+        for log, sender, recipient, senders, recipients in hits:
+            contract = log['address'].lower()
+            symbol, decimals = self._tokens[contract]
+            # The value is the first uint256 word; anything past it is ignored
+            data = (log.get('data') or '0x')[:66]
+            try:
+                amount = (int(data, 16) if data != '0x' else 0) / 10**decimals
+            except ValueError:
+                continue
+            for user_id in senders:
+                matches.append((user_id, self._activity('sent', amount, symbol, log['transactionHash'], recipient, contract)))
+            for user_id in recipients:
+                matches.append((user_id, self._activity('received', amount, symbol, log['transactionHash'], sender, contract)))
+        return matches
+
+    async def _load_token_info(self, contracts):
+        """Fetch symbol/decimals for tokens we haven't seen, in one batch"""
+        missing = [c for c in contracts if c not in self._tokens]
+        if not missing:
+            return
+
+        calls = []
+        for contract in missing:
+            calls.append(('eth_call', [{'to': contract, 'data': SYMBOL_SELECTOR}, 'latest']))
+            calls.append(('eth_call', [{'to': contract, 'data': DECIMALS_SELECTOR}, 'latest']))
+        results = await self.rpc.batch(calls)
+
+        for i, contract in enumerate(missing):
+            symbol_result, decimals_result = results[2 * i], results[2 * i + 1]
+            symbol = None if isinstance(symbol_result, RpcError) else decode_symbol(symbol_result)
+            try:
+                decimals = int(decimals_result, 16) if isinstance(decimals_result, str) and decimals_result != '0x' else DEFAULT_TOKEN_DECIMALS
+            except ValueError:
+                decimals = DEFAULT_TOKEN_DECIMALS
+            if not 0 <= decimals <= MAX_TOKEN_DECIMALS:
+                decimals = DEFAULT_TOKEN_DECIMALS
+            self._tokens[contract] = (symbol or f"{contract[:6]}...{contract[-4:]}", decimals)
@@ -0,0 +1,58 @@
+# checkpoint.py
+import json
+import logging
+import os
+import time
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+class CheckpointStore:
+    """Small JSON file of resume positions, written atomically and at most every few seconds
+
+    Background jobs checkpoint far more often than bot_data.json should be
+    rewritten, so they keep their progress here instead of in Database.
+    """
+
+    def __init__(self, path: str, min_interval: float = 5.0):
+        self.path = path
+        self.min_interval = min_interval
+        self._last_write = 0.0
+        self._dirty = False
+        self.data: Dict[str, Any] = self._load()
+
+    def _load(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint file {self.path}: {e}")
+            return {}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    def set(self, key: str, value: Any):
+        """Record a position; the file is rewritten once min_interval has passed"""
+        self.data[key] = value
+        self._dirty = True
+        if time.monotonic() - self._last_write >= self.min_interval:
+            self.flush()
+
+    def delete(self, key: str):
+        if self.data.pop(key, None) is not None:
+            self._dirty = True
+            self.flush()
+
+    def flush(self):
+        """Write pending positions to disk"""
+        if not self._dirty:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._last_write = time.monotonic()
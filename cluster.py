@@ -0,0 +1,293 @@
+# cluster.py
+"""
+Multi-process deployment: one ingress process, N bot workers sharded by user
+
+The ingress takes Telegram updates (long polling or the webhook server)
+and Alchemy webhooks. Each update goes to worker user_id % N over a
+multiprocessing queue, so a user's updates always reach the same worker
+in order. Alchemy payloads go to every worker; a worker only indexes the
+wallets of users it owns, so the owner alone sends the notification. The
+ingress also runs the gas trackers and sends their fee windows to every
+worker (see gas.py).
+
+Workers share bot_data.json, each appending its writes to the data file's
+journal and applying the others' (Database shared mode), and the SQLite
+conversation state store.
+
+    CLUSTER_WORKERS=4 python bot.py
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Worker processes; 0 or 1 runs the usual single-process bot
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', '0'))
+CLUSTER_QUEUE_SIZE = int(os.getenv('CLUSTER_QUEUE_SIZE', '10000'))
+# Worker i serves its own /metrics on this port + i (METRICS_HOST, local by
+# default); 0 turns it off. The ingress' numbers stay on its usual server.
+CLUSTER_METRICS_PORT = int(os.getenv('CLUSTER_METRICS_PORT', '9100'))
+# How often the ingress checks for dead workers
+CLUSTER_WATCH_INTERVAL = 5.0
+
+# (index, count) inside a worker process, None everywhere else
+current_worker: Optional[Tuple[int, int]] = None
+
+# Raw update fields, in the order PTB checks them for effective_user
+UPDATE_FIELDS = (
+    'message', 'edited_message', 'channel_post', 'edited_channel_post',
+    'callback_query', 'inline_query', 'chosen_inline_result', 'shipping_query',
+    'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+    'chat_join_request',
+)
+
+def worker_for(user_id: int, count: int) -> int:
+    """Worker that owns a user"""
+    return user_id % count
+
+def owned_wallets(wallets: Dict, index: int, count: int) -> Dict:
+    """The subset of the persisted wallets {user_id: wallet} a worker owns"""
+    return {user_id: wallet for user_id, wallet in wallets.items() if worker_for(int(user_id), count) == index}
+
+def update_user_id(data: dict) -> int:
+    """User (else chat) a raw update belongs to; 0 if it has neither"""
+    for field in UPDATE_FIELDS:
+        item = data.get(field)
+        if not item:
+            continue
+        user = item.get('from') or item.get('user')
+        if user:
+            return user['id']
+        chat = item.get('chat')
+        if chat:
+            return chat['id']
+    return 0
+
+class Ingress:
+    """Spawns the workers and forwards work to them"""
+
+    def __init__(self, count: int):
+        # Spawned rather than forked so workers start without the ingress' loop and threads
+        self._context = multiprocessing.get_context('spawn')
+        self.count = count
+        self.inboxes = [None] * count
+        self.processes = [None] * count
+        for index in range(count):
+            self._create_worker(index)
+        self.stats = {
+            'updates': 0,
+            'broadcasts': 0,
+            'dropped_updates': 0,
+            'dropped_broadcasts': 0,
+            'respawns': 0,
+            'per_worker': [0] * count,
+        }
+
+    def _create_worker(self, index: int):
+        inbox = self._context.Queue(CLUSTER_QUEUE_SIZE)
+        self.inboxes[index] = inbox
+        self.processes[index] = self._context.Process(
+            target=_worker_main, args=(index, self.count, inbox), name=f'bot-worker-{index}'
+        )
+        return self.processes[index]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        logger.info(f"Started {self.count} bot workers")
+
+    # These run on the ingress loop: a full inbox (a stuck or dead worker)
+    # must not block it, so nothing here waits for room
+    def route_update(self, data: dict) -> bool:
+        """Hand a raw Telegram update to the worker owning its user; False if its inbox is full"""
+        index = worker_for(update_user_id(data), self.count)
+        try:
+            self.inboxes[index].put_nowait(('update', data))
+        except queue.Full:
+            self.stats['dropped_updates'] += 1
+            return False
+        self.stats['updates'] += 1
+        self.stats['per_worker'][index] += 1
+        return True
+
+    def broadcast(self, kind: str, payload) -> int:
+        """Send something every worker should see; returns how many inboxes were full"""
+        dropped = 0
+        for inbox in self.inboxes:
+            try:
+                inbox.put_nowait((kind, payload))
+            except queue.Full:
+                dropped += 1
+        self.stats['broadcasts'] += 1
+        self.stats['dropped_broadcasts'] += dropped
+        return dropped
+
+    def check_workers(self) -> int:
+        """Start a fresh worker in place of every one that exited; returns how many"""
+        restarted = 0
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            logger.error(f"{process.name} exited with code {process.exitcode}, starting a new one")
+            # What was still queued for it is lost; a dead reader may also
+            # have left the old queue's lock taken
+            self.inboxes[index].close()
+            self._create_worker(index).start()
+            restarted += 1
+        self.stats['respawns'] += restarted
+        return restarted
+
+    def stop(self, timeout: float = 30.0):
+        """Let workers finish what they were sent, then wait for them"""
+        for inbox in self.inboxes:
+            try:
+                inbox.put(('stop', None), timeout=1.0)
+            except queue.Full:
+                pass
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop in time, terminating")
+                process.terminate()
+
+def _worker_main(index: int, count: int, inbox):
+    """Worker process entry point"""
+    global current_worker
+    current_worker = (index, count)
+    # Ctrl+C reaches the whole process group; the ingress decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import bot
+    asyncio.run(_run_worker(bot.build_application(updater=False), inbox))
+
+async def _run_worker(application, inbox):
+    from telegram import Update
+    import gas
+    import webhook_handler
+
+    async with application:
+        await application.start()
+        await application.post_init(application)
+        webhook_handler.set_bot_app(application)
+        if CLUSTER_METRICS_PORT:
+            await webhook_handler.start_metrics_server(CLUSTER_METRICS_PORT + current_worker[0])
+        logger.info(f"Worker {current_worker[0]}/{current_worker[1]} ready")
+
+        while True:
+            kind, payload = await asyncio.to_thread(inbox.get)
+            if kind == 'update':
+                await application.update_queue.put(Update.de_json(payload, application.bot))
+            elif kind == 'alchemy':
+                webhook_handler.dispatch_notification(payload)
+            elif kind == 'gas':
+                gas.apply_shared_state(*payload)
+            elif kind == 'stop':
+                break
+
+        await webhook_handler.stop_metrics_server()
+        await application.stop()
+        await application.post_stop(application)
+
+async def _bot_api(session, method: str, **params):
+    """Raw Bot API call; the ingress never decodes updates into PTB objects"""
+    base_url = os.getenv('TELEGRAM_API_BASE_URL') or 'https://api.telegram.org/bot'
+    params = {key: value for key, value in params.items() if value is not None}
+    async with session.post(f"{base_url}{os.getenv('BOT_TOKEN')}/{method}", json=params) as response:
+        data = await response.json(content_type=None)
+    if not data.get('ok'):
+        raise RuntimeError(f"{method} failed: {data.get('description')}")
+    return data['result']
+
+async def _poll_updates(ingress: Ingress, session):
+    """getUpdates loop feeding the workers"""
+    # Polling and a webhook can't both be active
+    await _bot_api(session, 'deleteWebhook', drop_pending_updates=False)
+    offset = None
+    while True:
+        try:
+            updates = await _bot_api(session, 'getUpdates', offset=offset, timeout=30, allowed_updates=[])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"getUpdates failed: {e}")
+            await asyncio.sleep(1)
+            continue
+        for data in updates:
+            if not ingress.route_update(data):
+                # Its worker is behind; leave this update and the rest to the
+                # next getUpdates rather than drop them
+                logger.warning("Worker inbox full, holding updates back")
+                await asyncio.sleep(1)
+                break
+            offset = data['update_id'] + 1
+
+async def _watch_workers(ingress: Ingress):
+    while True:
+        await asyncio.sleep(CLUSTER_WATCH_INTERVAL)
+        try:
+            ingress.check_workers()
+        except Exception as e:
+            logger.error(f"Worker check failed: {e}")
+
+async def run_ingress(ingress: Ingress):
+    """Serve Telegram and Alchemy traffic until SIGINT/SIGTERM"""
+    import aiohttp
+    import gas
+    import webhook_handler
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    webhook_mode = os.getenv('BOT_MODE', 'polling').lower() == 'webhook'
+    webhook_handler.set_ingress(ingress)
+    watcher = asyncio.create_task(_watch_workers(ingress))
+    # One gas poller per chain for the cluster; workers get its fee window
+    gas.run_shared_trackers(lambda chain, state: ingress.broadcast('gas', (chain, state)))
+    if webhook_mode or os.getenv('ALCHEMY_WEBHOOK_ID_ETH'):
+        await webhook_handler.start_server(None)
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
+        if webhook_mode:
+            url = os.getenv('TELEGRAM_WEBHOOK_URL', '').rstrip('/') + webhook_handler.TELEGRAM_WEBHOOK_PATH
+            await _bot_api(
+                session, 'setWebhook',
+                url=url,
+                secret_token=webhook_handler.TELEGRAM_WEBHOOK_SECRET,
+                max_connections=int(os.getenv('TELEGRAM_WEBHOOK_MAX_CONNECTIONS', '40')),
+                drop_pending_updates=False,
+            )
+            logger.info(f"Webhook set to {url}")
+            await stop.wait()
+        else:
+            from keep_alive import keep_alive
+            keep_alive()
+            poller = asyncio.create_task(_poll_updates(ingress, session))
+            await stop.wait()
+            poller.cancel()
+
+    watcher.cancel()
+    await gas.stop_gas_trackers()
+    await webhook_handler.stop_server()
+    logger.info(f"Ingress stopped: {ingress.stats}")
+
+def main():
+    """Run the ingress with CLUSTER_WORKERS workers"""
+    if os.getenv('BOT_MODE', 'polling').lower() == 'webhook' and not os.getenv('TELEGRAM_WEBHOOK_URL'):
+        raise SystemExit("TELEGRAM_WEBHOOK_URL is required when BOT_MODE=webhook")
+
+    # Inherited by the spawned workers: they all write the same data file
+    os.environ['DATABASE_SHARED'] = '1'
+    ingress = Ingress(CLUSTER_WORKERS)
+    ingress.start()
+    try:
+        asyncio.run(run_ingress(ingress))
+    finally:
+        ingress.stop()
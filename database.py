@@ -1,28 +1,611 @@
+import asyncio
+import atexit
+import bisect
+import fcntl
 import json
+import logging
 import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import Callable, Optional, Dict, Iterable, Iterator, List, Tuple
+
+from metrics import SIZE_BUCKETS, histogram
+
+logger = logging.getLogger(__name__)
+
+# Several bot processes on one data file (see cluster.py)
+DATABASE_SHARED = os.getenv('DATABASE_SHARED', '').lower() in ('1', 'true', 'yes')
+# How stale a shared reader may get before it checks the journal again
+SHARED_REFRESH_INTERVAL = float(os.getenv('DATABASE_REFRESH_INTERVAL', '1.0'))
+# Journal size past which it is folded into a new snapshot of the data file
+DATABASE_JOURNAL_MAX_BYTES = int(os.getenv('DATABASE_JOURNAL_MAX_BYTES', str(8 * 2**20)))
+
+# Wallet filter matching users with a wallet of any type
+ANY_WALLET = 'any'
+# Keys of a wallet record that aren't wallet types: when it last changed and
+# the owner's notification preferences (see wallet.py)
+WALLET_META_KEYS = ('updated_at', 'notifications', 'digest_window')
+
+# Airdrops per write when importing a file; the loop runs other updates between chunks
+IMPORT_CHUNK_SIZE = 1000
+
+# Days of daily counters kept in the stats
+STATS_DAYS = 90
+
+SAVE_DURATION = histogram('database_save_duration_seconds', 'Time to append to the journal or write a snapshot')
+SAVE_BYTES = histogram('database_save_bytes', 'Bytes appended to the journal or snapshot written',
+                       buckets=SIZE_BUCKETS)
 
 class Database:
-    def __init__(self):
+    """The bot's users, wallets, airdrops and support messages
+
+    The data file is a JSON snapshot; every write after it goes to an
+    append-only journal next to it (bot_data.json.journal) as the rows it
+    touched, one JSON line per write. Writes change memory at once and
+    hand the line to a writer thread, so a write never waits on the disk.
+    Once the journal passes DATABASE_JOURNAL_MAX_BYTES the writer thread
+    folds it into a new snapshot and starts an empty journal; the
+    generation number in both tells a reader which journal goes with
+    which snapshot.
+
+    In shared mode every process appends to the same journal under a file
+    lock and applies the others' lines as it reads them. That is only
+    consistent because each row has one writer: a user's record, wallet and
+    support messages come from the worker that owns the user, airdrops and
+    support statuses from the admin's worker, and stats are deltas.
+    """
+    
+    def __init__(self, autoload: bool = True, shared: bool = DATABASE_SHARED):
         self.data_file = 'bot_data.json'
-        self.load_data()
+        self.shared = shared
+        self._listeners: List[Callable] = []
+        self._data: Optional[Dict] = None
+        self._load_lock = threading.Lock()
+        self._checked_at = 0.0
+        # Set while run_shared_refresh keeps the data current; reads then
+        # never reload inline
+        self._background_refresh = False
+        # Journal generation, how far it has been read and its inode
+        self._generation = 0
+        self._journal_offset = 0
+        self._journal_ino: Optional[int] = None
+        # Ops of the write in progress, see _write()
+        self._ops: Optional[List[list]] = None
+        # Tags this process' journal lines, so it skips them when reading
+        self._writer_id = uuid.uuid4().hex
+        # Journal lines waiting for the writer thread, numbered by _write_seq
+        self._journal_lines: List[Tuple[int, str]] = []
+        self._journal_ready = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+        self._write_seq = 0
+        self._written_seq = 0
+        if autoload:
+            self.load_data()
+    
+    @property
+    def journal_file(self) -> str:
+        return self.data_file + '.journal'
+    
+    @property
+    def data(self) -> Dict:
+        """The dataset, loaded on first access if nobody has loaded it yet"""
+        if self._data is None:
+            self.load_data(only_if_unloaded=True)
+        elif (self.shared and self._ops is None and not self._background_refresh
+              and time.monotonic() - self._checked_at > SHARED_REFRESH_INTERVAL):
+            self._reload_if_changed()
+        return self._data
+    
+    @data.setter
+    def data(self, value: Dict):
+        self._data = value
+    
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
     
-    def load_data(self):
-        """Load data from JSON file"""
+    def _require_loaded(self):
+        """Make sure data and indexes exist before an index lookup"""
+        self.data
+    
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock over the snapshot and journal, across processes"""
+        with open(self.data_file + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    # Reading
+    def _journal_changed(self) -> bool:
+        try:
+            st = os.stat(self.journal_file)
+        except FileNotFoundError:
+            return False
+        return (st.st_ino, st.st_size) != (self._journal_ino, self._journal_offset)
+    
+    def _read_journal(self, offset: int = 0):
+        """(generation, entries, offset, inode) of the journal's complete lines after offset
+
+        generation is None if there is no journal yet. A line still being
+        appended is left for the next read.
+        """
+        try:
+            f = open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            return None, [], 0, None
+        with f:
+            ino = os.fstat(f.fileno()).st_ino
+            header = f.readline()
+            if not header.endswith(b'\n'):
+                return None, [], 0, ino
+            generation = json.loads(header)['generation']
+            offset = max(offset, len(header))
+            f.seek(offset)
+            chunk = f.read()
+        end = chunk.rfind(b'\n') + 1
+        entries = [json.loads(line) for line in chunk[:end].splitlines() if line]
+        return generation, entries, offset + end, ino
+    
+    def _read_snapshot(self) -> Dict:
         if os.path.exists(self.data_file):
             try:
                 with open(self.data_file, 'r') as f:
-                    self.data = json.load(f)
+                    data = json.load(f)
             except:
-                self.data = self._get_empty_data()
+                data = self._get_empty_data()
+        else:
+            data = self._get_empty_data()
+        if 'stats' not in data:
+            data['stats'] = self._count_stats(data)
+        return data
+    
+    def _read_current(self):
+        """The snapshot with its journal replayed, and the journal state read
+
+        Call under _locked(). A journal left from before the snapshot (a
+        crash between the two renames in _write_snapshot) was already
+        folded into it and is replaced with an empty one.
+        """
+        data = self._read_snapshot()
+        snapshot_generation = data.pop('journal_generation', 0)
+        generation, entries, offset, ino = self._read_journal()
+        if generation == snapshot_generation:
+            self._replay(data, entries)
         else:
-            self.data = self._get_empty_data()
+            if generation is not None:
+                self._new_journal(snapshot_generation)
+            generation, _, offset, ino = self._read_journal()
+            if generation is None:
+                generation = snapshot_generation
+        return data, (generation, offset, ino)
+    
+    def _reload_if_changed(self):
+        """Pick up writes made by other processes"""
+        self._checked_at = time.monotonic()
+        if not self._journal_changed():
+            return
+        tail = self._read_journal(self._journal_offset)
+        if tail[0] == self._generation:
+            self._apply_tail(tail)
+        elif self._written_seq == self._write_seq:
+            # Compacted: only a full reload catches up, and it would drop any
+            # of our writes not in the journal yet
+            self._apply_reload(self._prepare_reload(dict(self._airdrops_by_id)))
+    
+    def _prepare_reload(self, previous: Dict[int, Dict], lock: bool = True):
+        """Read and index the data and list the airdrop changes against previous
+
+        Touches no live state, so it can run in a thread. Pass lock=False
+        when already holding _locked().
+        """
+        with self._locked() if lock else nullcontext():
+            data, journal = self._read_current()
+        indexes = self._make_indexes(data)
+        airdrops = indexes['_airdrops_by_id']
+        events = [('airdrop_deleted', airdrop, None) for airdrop_id, airdrop in previous.items()
+                  if airdrop_id not in airdrops]
+        for airdrop_id, airdrop in airdrops.items():
+            old = previous.get(airdrop_id)
+            if old is None:
+                events.append(('airdrop_added', airdrop, None))
+            elif old != airdrop:
+                events.append(('airdrop_updated', airdrop, old))
+        return data, journal, indexes, events
+    
+    def _apply_reload(self, prepared):
+        """Swap in a prepared reload and announce only the airdrops that changed"""
+        data, journal, indexes, events = prepared
+        with self._load_lock:
+            self._set_indexes(indexes)
+            self._data = data
+            self._generation, self._journal_offset, self._journal_ino = journal
+            self._checked_at = time.monotonic()
+        for event, record, previous in events:
+            self._emit(event, record, previous)
+    
+    def _apply_tail(self, tail):
+        """Apply the other processes' entries of a journal read to the live data"""
+        _, entries, self._journal_offset, self._journal_ino = tail
+        for entry in entries:
+            if entry['w'] == self._writer_id:
+                continue
+            for op in entry['ops']:
+                kind = op[0]
+                if kind == 'user':
+                    self._put_user(op[1], op[2])
+                elif kind == 'wallet':
+                    self._put_wallet(op[1], op[2])
+                elif kind == 'airdrop':
+                    self._put_airdrop(op[1], op[2])
+                else:
+                    self._apply_op(self._data, op)
+    
+    async def refresh_shared(self) -> bool:
+        """Pick up other processes' writes, reading the journal in a thread"""
+        self._checked_at = time.monotonic()
+        if self._data is None or not self._journal_changed():
+            return False
+        journal = (self._generation, self._journal_offset)
+        tail = await asyncio.to_thread(self._read_journal, self._journal_offset)
+        # A read on the loop got there first
+        if (self._generation, self._journal_offset) != journal:
+            return False
+        if tail[0] == self._generation:
+            self._apply_tail(tail)
+            return True
+        
+        # Compacted since the last read: reload in full, but only with all of
+        # our own writes on disk and none made meanwhile, as the reload
+        # replaces the memory they live in
+        seq = self._write_seq
+        if self._written_seq != seq:
+            return False
+        prepared = await asyncio.to_thread(self._prepare_reload, dict(self._airdrops_by_id))
+        if self._write_seq != seq or (self._generation, self._journal_offset) != journal:
+            return False
+        self._apply_reload(prepared)
+        return True
+    
+    async def run_shared_refresh(self):
+        """Keep a shared dataset current in the background instead of on reads"""
+        self._background_refresh = True
+        try:
+            while True:
+                await asyncio.sleep(SHARED_REFRESH_INTERVAL)
+                await self.refresh_shared()
+        finally:
+            self._background_refresh = False
+    
+    def load_data(self, only_if_unloaded: bool = False):
+        """Load the snapshot and replay its journal"""
+        with self._load_lock:
+            # A background warm-up may have finished while we waited
+            if only_if_unloaded and self._data is not None:
+                return
+            with self._locked():
+                data, journal = self._read_current()
+            self._build_indexes(data)
+            self._data = data
+            self._generation, self._journal_offset, self._journal_ino = journal
+            self._checked_at = time.monotonic()
+        self._emit('reloaded', None)
+    
+    @classmethod
+    def _replay(cls, data: Dict, entries: List[Dict]):
+        """Apply journal entries to a dataset without indexes"""
+        if not entries:
+            return
+        airdrops = {airdrop['id']: airdrop for airdrop in data['airdrops']}
+        for entry in entries:
+            for op in entry['ops']:
+                kind = op[0]
+                if kind == 'user':
+                    data['users'][op[1]] = op[2]
+                elif kind == 'wallet':
+                    if op[2] is None:
+                        data['wallets'].pop(op[1], None)
+                    else:
+                        data['wallets'][op[1]] = op[2]
+                elif kind == 'airdrop':
+                    if op[2] is None:
+                        airdrops.pop(op[1], None)
+                    else:
+                        airdrops[op[1]] = op[2]
+                else:
+                    cls._apply_op(data, op)
+        data['airdrops'] = sorted(airdrops.values(), key=lambda a: a['id'])
+    
+    @staticmethod
+    def _apply_op(data: Dict, op: list):
+        """Apply an op that touches no index"""
+        kind = op[0]
+        if kind == 'support_add':
+            data['support_messages'].append(op[1])
+        elif kind == 'support_status':
+            _, user_id, timestamp, status = op
+            for msg in data['support_messages']:
+                if msg['user_id'] == user_id and msg['timestamp'] == timestamp:
+                    msg['status'] = status
+                    break
+        elif kind == 'counter':
+            data['airdrop_counter'] = max(data['airdrop_counter'], op[1])
+        elif kind == 'bump':
+            _, counter, amount, group, daily, day = op
+            stats = data['stats']
+            if group:
+                count = stats[group].get(counter, 0) + amount
+                if count:
+                    stats[group][counter] = count
+                else:
+                    stats[group].pop(counter, None)
+            else:
+                stats[counter] += amount
+            if daily:
+                days = stats['daily']
+                if day not in days:
+                    days[day] = {}
+                    # Oldest first, so the first keys are the ones to drop
+                    while len(days) > STATS_DAYS:
+                        del days[next(iter(days))]
+                days[day][daily] = days[day].get(daily, 0) + amount
+    
+    # Writing
+    @contextmanager
+    def _write(self):
+        """Mutate in memory, recording the rows touched with _log(); journaled on exit"""
+        self._ops = []
+        try:
+            yield
+            ops = self._ops
+        finally:
+            self._ops = None
+        if ops:
+            self._journal(ops)
+    
+    def _log(self, *op):
+        self._ops.append(list(op))
+    
+    def _journal(self, ops: List[list]):
+        """Queue a write's ops for the writer thread"""
+        line = json.dumps({'w': self._writer_id, 'ops': ops}, separators=(',', ':'))
+        with self._journal_ready:
+            self._write_seq += 1
+            self._journal_lines.append((self._write_seq, line))
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name='database-journal', daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+            self._journal_ready.notify()
+    
+    def _run_writer(self):
+        while True:
+            with self._journal_ready:
+                self._journal_ready.wait_for(lambda: self._journal_lines)
+                batch, self._journal_lines = self._journal_lines, []
+            try:
+                self._append([line for _, line in batch])
+            except Exception:
+                logger.exception(f"Journal append of {len(batch)} writes failed, retrying")
+                with self._journal_ready:
+                    self._journal_lines[:0] = batch
+                time.sleep(1.0)
+                continue
+            with self._journal_ready:
+                self._written_seq = batch[-1][0]
+                self._journal_ready.notify_all()
+            try:
+                if os.path.getsize(self.journal_file) > DATABASE_JOURNAL_MAX_BYTES:
+                    self._compact()
+            except Exception:
+                logger.exception("Journal compaction failed")
+    
+    def _append(self, lines: List[str]):
+        started = time.perf_counter()
+        payload = ''.join(line + '\n' for line in lines).encode()
+        with self._locked():
+            with open(self.journal_file, 'ab') as f:
+                if f.tell() == 0:
+                    f.write(self._journal_header(self._generation))
+                f.write(payload)
+        SAVE_DURATION.observe(time.perf_counter() - started)
+        SAVE_BYTES.observe(len(payload))
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every write so far is in the journal; False on timeout"""
+        with self._journal_ready:
+            target = self._write_seq
+            return self._journal_ready.wait_for(lambda: self._written_seq >= target, timeout)
+    
+    @staticmethod
+    def _journal_header(generation: int) -> bytes:
+        return json.dumps({'generation': generation}).encode() + b'\n'
+    
+    def _new_journal(self, generation: int):
+        tmp_file = f"{self.journal_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(self._journal_header(generation))
+        os.replace(tmp_file, self.journal_file)
+    
+    def _write_snapshot(self, data: Dict):
+        """Write data as the next generation's snapshot with an empty journal; call under _locked()"""
+        # Written aside and swapped in, so other processes never read a partial file
+        started = time.perf_counter()
+        generation = (self._read_journal()[0] or 0) + 1
+        tmp_file = f"{self.data_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({**data, 'journal_generation': generation}, f, indent=2)
+            written = f.tell()
+        os.replace(tmp_file, self.data_file)
+        self._new_journal(generation)
+        SAVE_DURATION.observe(time.perf_counter() - started)
+        SAVE_BYTES.observe(written)
+        return generation
+    
+    def _compact(self):
+        """Fold the journal into a new snapshot, from the files alone"""
+        with self._locked():
+            # Another process may have compacted while we waited
+            if os.path.getsize(self.journal_file) <= DATABASE_JOURNAL_MAX_BYTES:
+                return
+            data, _ = self._read_current()
+            generation = self._write_snapshot(data)
+        logger.info(f"Compacted {self.journal_file} into generation {generation}")
     
     def save_data(self):
-        """Save data to JSON file"""
-        with open(self.data_file, 'w') as f:
-            json.dump(self.data, f, indent=2)
+        """Write the whole dataset as a new snapshot
+
+        For scripts that edit self.data directly; the bot's own writes go
+        through the journal.
+        """
+        self.flush()
+        with self._locked():
+            # Other processes' writes not seen yet would be lost otherwise
+            if self.shared and self._journal_changed():
+                tail = self._read_journal(self._journal_offset)
+                if tail[0] == self._generation:
+                    self._apply_tail(tail)
+                else:
+                    self._apply_reload(self._prepare_reload(dict(self._airdrops_by_id), lock=False))
+            self._write_snapshot(self._data)
+            self._generation, _, self._journal_offset, self._journal_ino = self._read_journal()
+    
+    def _build_indexes(self, data: Dict):
+        """Rebuild in-memory lookups over freshly loaded data"""
+        self._set_indexes(self._make_indexes(data))
+    
+    def _set_indexes(self, indexes: Dict):
+        self._airdrops_by_id = indexes['_airdrops_by_id']
+        self._airdrops_by_category = indexes['_airdrops_by_category']
+        self._users_by_joined = indexes['_users_by_joined']
+        self._wallet_users = indexes['_wallet_users']
+    
+    def _make_indexes(self, data: Dict) -> Dict:
+        """The lookups over a dataset, built aside from the live ones"""
+        airdrops_by_id: Dict[int, Dict] = {}
+        airdrops_by_category: Dict[Tuple[str, str], List[Dict]] = {}
+        for airdrop in data['airdrops']:
+            airdrops_by_id[airdrop['id']] = airdrop
+            airdrops_by_category.setdefault((airdrop['category'], airdrop['subcategory']), []).append(airdrop)
+        # Buckets stay in id order; the file only breaks it after a recategorization
+        for bucket in airdrops_by_category.values():
+            bucket.sort(key=lambda a: a['id'])
+        
+        # (joined_date, user id) keys in ascending order: all users, and the
+        # users with each wallet type; joined_date strings sort by time
+        users = data['users']
+        users_by_joined: List[Tuple[str, int]] = sorted(
+            (user.get('joined_date', ''), int(user_id)) for user_id, user in users.items()
+        )
+        wallet_users: Dict[str, List[Tuple[str, int]]] = {}
+        for user_id, wallet in data['wallets'].items():
+            key = (users.get(user_id, {}).get('joined_date', ''), int(user_id))
+            for wallet_type in self._wallet_types(wallet):
+                wallet_users.setdefault(wallet_type, []).append(key)
+        for keys in wallet_users.values():
+            keys.sort()
+        return {
+            '_airdrops_by_id': airdrops_by_id,
+            '_airdrops_by_category': airdrops_by_category,
+            '_users_by_joined': users_by_joined,
+            '_wallet_users': wallet_users,
+        }
+    
+    @staticmethod
+    def _wallet_types(wallet: Dict) -> List[str]:
+        types = [key for key in wallet if key not in WALLET_META_KEYS]
+        return types + [ANY_WALLET] if types else []
+    
+    def _user_key(self, user_id_str: str) -> Tuple[str, int]:
+        return (self._data['users'].get(user_id_str, {}).get('joined_date', ''), int(user_id_str))
+    
+    def _index_airdrop(self, airdrop: Dict):
+        self._airdrops_by_id[airdrop['id']] = airdrop
+        key = (airdrop['category'], airdrop['subcategory'])
+        bucket = self._airdrops_by_category.setdefault(key, [])
+        bucket.append(airdrop)
+        # Buckets stay in id order; only a recategorized airdrop lands out of place
+        if len(bucket) > 1 and bucket[-2]['id'] > airdrop['id']:
+            bucket.sort(key=lambda a: a['id'])
+    
+    def _unindex_airdrop(self, airdrop: Dict):
+        self._airdrops_by_id.pop(airdrop['id'], None)
+        key = (airdrop['category'], airdrop['subcategory'])
+        bucket = self._airdrops_by_category.get(key, [])
+        self._airdrops_by_category[key] = [a for a in bucket if a['id'] != airdrop['id']]
+    
+    def _put_user(self, user_id_str: str, user: Dict):
+        """Store a user record, keeping the join-order indexes in step"""
+        users = self._data['users']
+        if user_id_str in users:
+            users[user_id_str].update(user)
+            return
+        wallet_key = self._user_key(user_id_str)
+        users[user_id_str] = user
+        key = self._user_key(user_id_str)
+        bisect.insort(self._users_by_joined, key)
+        # A wallet saved before the user record was indexed without a join date
+        for wallet_type in self._wallet_types(self._data['wallets'].get(user_id_str, {})):
+            keys = self._wallet_users[wallet_type]
+            del keys[bisect.bisect_left(keys, wallet_key)]
+            bisect.insort(keys, key)
+    
+    def _put_wallet(self, user_id_str: str, wallet: Optional[Dict]):
+        """Store or (None) drop a wallet record written elsewhere, moving the user between wallet indexes"""
+        wallets = self._data['wallets']
+        known = set(self._wallet_types(wallets.get(user_id_str, {})))
+        types = set(self._wallet_types(wallet or {}))
+        key = self._user_key(user_id_str)
+        for old_type in known - types:
+            keys = self._wallet_users[old_type]
+            del keys[bisect.bisect_left(keys, key)]
+        for new_type in types - known:
+            bisect.insort(self._wallet_users.setdefault(new_type, []), key)
+        if wallet is None:
+            wallets.pop(user_id_str, None)
+        else:
+            wallets[user_id_str] = wallet
+    
+    def _put_airdrop(self, airdrop_id: int, airdrop: Optional[Dict]):
+        """Store, update or (None) delete an airdrop written elsewhere, announcing the change"""
+        existing = self._airdrops_by_id.get(airdrop_id)
+        if airdrop is None:
+            if existing:
+                self._data['airdrops'] = [a for a in self._data['airdrops'] if a['id'] != airdrop_id]
+                self._unindex_airdrop(existing)
+                self._emit('airdrop_deleted', existing)
+        elif existing:
+            previous = dict(existing)
+            existing.update(airdrop)
+            if (existing['category'], existing['subcategory']) != (previous['category'], previous['subcategory']):
+                self._unindex_airdrop(previous)
+                self._index_airdrop(existing)
+            self._emit('airdrop_updated', existing, previous)
+        else:
+            self._data['airdrops'].append(airdrop)
+            self._index_airdrop(airdrop)
+            self._emit('airdrop_added', airdrop)
+    
+    # Change notifications
+    def subscribe(self, callback: Callable):
+        """Register callback(event, record, previous=None) for data changes
+
+        Events: 'airdrop_added', 'airdrop_updated', 'airdrop_deleted',
+        'airdrops_imported' (record is the list of new airdrops) and
+        'reloaded' (the whole dataset was replaced). Picking up another
+        process's write in shared mode emits the per-airdrop events for
+        what it changed, not 'reloaded'.
+        """
+        self._listeners.append(callback)
+    
+    def _emit(self, event: str, record: Optional[Dict], previous: Optional[Dict] = None):
+        for callback in self._listeners:
+            callback(event, record, previous)
     
     def _get_empty_data(self):
         """Return empty data structure"""
@@ -31,36 +614,232 @@ class Database:
             'wallets': {},
             'airdrops': [],
             'support_messages': [],
-            'airdrop_counter': 0
+            'airdrop_counter': 0,
+            'stats': self._empty_stats()
+        }
+    
+    # Statistics, kept current by every write and saved with the data
+    @staticmethod
+    def _empty_stats() -> Dict:
+        return {
+            'users': 0,
+            'airdrops': 0,
+            # Users holding each wallet type
+            'wallets': {},
+            # Support messages by status
+            'support': {},
+            # 'YYYY-MM-DD' -> {'joins', 'wallets', 'airdrops', 'support_messages'}, oldest first
+            'daily': {},
+        }
+    
+    @classmethod
+    def _count_stats(cls, data: Dict) -> Dict:
+        """Stats for a data file written before they were kept (one full scan)"""
+        stats = cls._empty_stats()
+        stats['users'] = len(data['users'])
+        stats['airdrops'] = len(data['airdrops'])
+        for wallet in data['wallets'].values():
+            for wallet_type in wallet:
+                if wallet_type not in WALLET_META_KEYS:
+                    stats['wallets'][wallet_type] = stats['wallets'].get(wallet_type, 0) + 1
+        for message in data['support_messages']:
+            status = message.get('status', 'pending')
+            stats['support'][status] = stats['support'].get(status, 0) + 1
+        
+        events = [(user.get('joined_date'), 'joins') for user in data['users'].values()]
+        events += [(wallet.get('updated_at'), 'wallets') for wallet in data['wallets'].values()]
+        events += [(airdrop.get('added_date'), 'airdrops') for airdrop in data['airdrops']]
+        events += [(message.get('timestamp'), 'support_messages') for message in data['support_messages']]
+        days: Dict[str, Dict[str, int]] = {}
+        for when, counter in events:
+            if when:
+                day = days.setdefault(when[:10], {})
+                day[counter] = day.get(counter, 0) + 1
+        stats['daily'] = {day: days[day] for day in sorted(days)[-STATS_DAYS:]}
+        return stats
+    
+    def _bump(self, counter: str, amount: int = 1, group: Optional[str] = None, daily: Optional[str] = None):
+        """Add to a total (or a group's entry) and to today's bucket; call inside _write()"""
+        op = ['bump', counter, amount, group, daily, datetime.now().strftime('%Y-%m-%d') if daily else None]
+        self._apply_op(self._data, op)
+        self._log(*op)
+    
+    def get_stats(self) -> Dict:
+        """Totals and daily counters; O(1) in the number of users and airdrops"""
+        stats = self.data['stats']
+        return {
+            'users': stats['users'],
+            'airdrops': stats['airdrops'],
+            'wallets': dict(stats['wallets']),
+            'support': dict(stats['support']),
+            'daily': {day: dict(counts) for day, counts in stats['daily'].items()},
         }
     
+    def flat_stats(self) -> Dict[str, int]:
+        """Current totals as one flat dict, e.g. for metrics; empty until the data is loaded"""
+        if not self.loaded:
+            return {}
+        stats = self._data['stats']
+        flat = {'users': stats['users'], 'airdrops': stats['airdrops']}
+        for wallet_type, count in stats['wallets'].items():
+            flat[f'wallets_{wallet_type}'] = count
+        for status, count in stats['support'].items():
+            flat[f'support_{status}'] = count
+        for counter, count in stats['daily'].get(datetime.now().strftime('%Y-%m-%d'), {}).items():
+            flat[f'today_{counter}'] = count
+        return flat
+    
     # User management
     def add_user(self, user_id: int, username: str, first_name: str):
         """Add or update user"""
         user_id_str = str(user_id)
-        if user_id_str not in self.data['users']:
-            self.data['users'][user_id_str] = {
-                'user_id': user_id,
-                'username': username,
-                'first_name': first_name,
-                'joined_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            self.save_data()
+        if user_id_str in self.data['users']:
+            return
+        user = {
+            'user_id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'joined_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        with self._write():
+            self._put_user(user_id_str, user)
+            self._log('user', user_id_str, user)
+            self._bump('users', daily='joins')
     
     def get_user(self, user_id: int) -> Dict:
         """Get user data"""
         return self.data['users'].get(str(user_id), {})
     
+    def iter_user_ids(self, after: Optional[int] = None) -> Iterator[int]:
+        """User ids in ascending order, optionally starting after a given id"""
+        user_ids = sorted(int(user_id) for user_id in self.data['users'])
+        start = bisect.bisect_right(user_ids, after) if after is not None else 0
+        for index in range(start, len(user_ids)):
+            yield user_ids[index]
+    
+    def _user_keys(self, wallet_type: Optional[str]) -> List[Tuple[str, int]]:
+        self._require_loaded()
+        if wallet_type:
+            return self._wallet_users.get(wallet_type, [])
+        return self._users_by_joined
+    
+    @staticmethod
+    def _joined_range(keys: List[Tuple[str, int]], joined_from: Optional[str],
+                      joined_to: Optional[str]) -> Tuple[int, int]:
+        """Index range of keys joined within [joined_from, joined_to], both 'YYYY-MM-DD'"""
+        low = bisect.bisect_left(keys, (joined_from,)) if joined_from else 0
+        # Every time on the last day sorts before the day plus a '~'
+        high = bisect.bisect_left(keys, (joined_to + '~',)) if joined_to else len(keys)
+        return low, max(low, high)
+    
+    def count_users(self, joined_from: Optional[str] = None, joined_to: Optional[str] = None,
+                    wallet_type: Optional[str] = None) -> int:
+        """Users matching the filters, counted from the indexes"""
+        low, high = self._joined_range(self._user_keys(wallet_type), joined_from, joined_to)
+        return high - low
+    
+    def page_users(self, cursor: Optional[Tuple[str, int]] = None, backwards: bool = False,
+                   limit: int = 20, joined_from: Optional[str] = None, joined_to: Optional[str] = None,
+                   wallet_type: Optional[str] = None) -> Tuple[List[Dict], bool, bool]:
+        """One page of users in join order, plus whether pages exist before and after it
+        
+        cursor is the (joined_date, user id) key of a user on the neighbouring
+        page: the page starts after it, or ends before it when backwards.
+        Filters select the index and a bisected range of it, so a page costs
+        O(log n + limit) whatever the number of users. wallet_type is a
+        wallet type or ANY_WALLET.
+        """
+        keys = self._user_keys(wallet_type)
+        low, high = self._joined_range(keys, joined_from, joined_to)
+        if backwards:
+            end = min(high, bisect.bisect_left(keys, cursor, low, high)) if cursor else high
+            start = max(low, end - limit)
+        else:
+            start = bisect.bisect_right(keys, cursor, low, high) if cursor else low
+            end = min(high, start + limit)
+        users = [self.get_user(user_id) or {'user_id': user_id} for _, user_id in keys[start:end]]
+        return users, start > low, end < high
+    
+    def iter_users(self, joined_from: Optional[str] = None, joined_to: Optional[str] = None,
+                   wallet_type: Optional[str] = None, chunk_size: int = 1000) -> Iterator[List[Dict]]:
+        """Matching users in join order, a chunk at a time
+        
+        Each chunk is its own page lookup, so users added between chunks
+        don't disturb the walk.
+        """
+        cursor = None
+        while True:
+            users, _, more = self.page_users(cursor, limit=chunk_size, joined_from=joined_from,
+                                             joined_to=joined_to, wallet_type=wallet_type)
+            if users:
+                yield users
+            if not more:
+                return
+            last = users[-1]
+            cursor = (last.get('joined_date', ''), int(last['user_id']))
+    
     # Wallet management
-    def save_user_wallet(self, user_id: int, wallet_type: str, address: str):
-        """Save user wallet"""
+    def save_user_wallet(self, user_id: int, wallet_type: str, address: str, preferences: Optional[Dict] = None):
+        """Save user wallet, with any notification preferences in the same write"""
+        user_id_str = str(user_id)
+        with self._write():
+            if user_id_str not in self.data['wallets']:
+                self.data['wallets'][user_id_str] = {}
+            
+            known = set(self._wallet_types(self.data['wallets'][user_id_str]))
+            self.data['wallets'][user_id_str][wallet_type] = address
+            key = self._user_key(user_id_str)
+            for new_type in set(self._wallet_types(self.data['wallets'][user_id_str])) - known:
+                bisect.insort(self._wallet_users.setdefault(new_type, []), key)
+                if new_type != ANY_WALLET:
+                    self._bump(new_type, group='wallets', daily='wallets')
+            if preferences:
+                self.data['wallets'][user_id_str].update(preferences)
+            self.data['wallets'][user_id_str]['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self._log('wallet', user_id_str, self.data['wallets'][user_id_str])
+    
+    def set_wallet_preferences(self, user_id: int, **preferences) -> bool:
+        """Update meta keys (notifications, digest_window) of a user's wallet; False if they have none"""
         user_id_str = str(user_id)
         if user_id_str not in self.data['wallets']:
-            self.data['wallets'][user_id_str] = {}
-        
-        self.data['wallets'][user_id_str][wallet_type] = address
-        self.data['wallets'][user_id_str]['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.save_data()
+            return False
+        with self._write():
+            wallet = self.data['wallets'].get(user_id_str)
+            if wallet is None:
+                return False
+            wallet.update(preferences)
+            wallet['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self._log('wallet', user_id_str, wallet)
+        return True
+    
+    def remove_user_wallet(self, user_id: int, wallet_type: Optional[str] = None) -> Dict[str, str]:
+        """Disconnect one wallet type, or all of them; returns the removed {wallet_type: address}"""
+        user_id_str = str(user_id)
+        if user_id_str not in self.data['wallets']:
+            return {}
+        with self._write():
+            wallet = self.data['wallets'].get(user_id_str)
+            if wallet is None:
+                return {}
+            known = set(self._wallet_types(wallet))
+            removed = {
+                key: wallet.pop(key) for key in list(wallet)
+                if key not in WALLET_META_KEYS and (wallet_type is None or key == wallet_type)
+            }
+            key = self._user_key(user_id_str)
+            for old_type in known - set(self._wallet_types(wallet)):
+                keys = self._wallet_users[old_type]
+                del keys[bisect.bisect_left(keys, key)]
+                if old_type != ANY_WALLET:
+                    self._bump(old_type, -1, group='wallets')
+            if self._wallet_types(wallet):
+                wallet['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                self._log('wallet', user_id_str, wallet)
+            else:
+                # Preferences go with the last wallet
+                del self.data['wallets'][user_id_str]
+                self._log('wallet', user_id_str, None)
+        return removed
     
     def get_user_wallet(self, user_id: int) -> Optional[Dict]:
         """Get user wallet"""
@@ -79,36 +858,120 @@ class Database:
     # Airdrop management
     def add_airdrop(self, category: str, subcategory: str, name: str, link: str, description: str) -> int:
         """Add new airdrop"""
-        self.data['airdrop_counter'] += 1
-        airdrop_id = self.data['airdrop_counter']
-        
-        airdrop = {
-            'id': airdrop_id,
-            'category': category.lower(),
-            'subcategory': subcategory.lower(),
-            'name': name,
-            'link': link,
-            'description': description,
-            'added_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
-        
-        self.data['airdrops'].append(airdrop)
-        self.save_data()
+        with self._write():
+            self.data['airdrop_counter'] += 1
+            airdrop_id = self.data['airdrop_counter']
+            
+            airdrop = {
+                'id': airdrop_id,
+                'category': category.lower(),
+                'subcategory': subcategory.lower(),
+                'name': name,
+                'link': link,
+                'description': description,
+                'added_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
+            
+            self.data['airdrops'].append(airdrop)
+            self._index_airdrop(airdrop)
+            self._log('airdrop', airdrop_id, airdrop)
+            self._log('counter', airdrop_id)
+            self._bump('airdrops', daily='airdrops')
+        self._emit('airdrop_added', airdrop)
         return airdrop_id
     
+    def add_airdrops(self, rows: Iterable[Dict]) -> List[int]:
+        """Add many airdrops with a single write and a single change event
+        
+        Each row has category, subcategory, name, link and description.
+        """
+        added = self._add_airdrop_rows(rows, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        if added:
+            self._emit('airdrops_imported', added)
+        return [airdrop['id'] for airdrop in added]
+    
+    async def import_airdrops(self, rows: List[Dict], chunk_size: int = IMPORT_CHUNK_SIZE) -> List[int]:
+        """add_airdrops for a large file: one write per chunk, yielding to the loop in between
+
+        Still a single 'airdrops_imported' event, after the last chunk.
+        """
+        added = []
+        added_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for start in range(0, len(rows), chunk_size):
+            if start:
+                await asyncio.sleep(0)
+            added += self._add_airdrop_rows(rows[start:start + chunk_size], added_date)
+        if added:
+            self._emit('airdrops_imported', added)
+        return [airdrop['id'] for airdrop in added]
+    
+    def _add_airdrop_rows(self, rows: Iterable[Dict], added_date: str) -> List[Dict]:
+        added = []
+        with self._write():
+            for row in rows:
+                self.data['airdrop_counter'] += 1
+                airdrop = {
+                    'id': self.data['airdrop_counter'],
+                    'category': row['category'].lower(),
+                    'subcategory': row['subcategory'].lower(),
+                    'name': row['name'],
+                    'link': row['link'],
+                    'description': row['description'],
+                    'added_date': added_date
+                }
+                self.data['airdrops'].append(airdrop)
+                self._index_airdrop(airdrop)
+                self._log('airdrop', airdrop['id'], airdrop)
+                added.append(airdrop)
+            if added:
+                self._log('counter', self.data['airdrop_counter'])
+                self._bump('airdrops', len(added), daily='airdrops')
+        return added
+    
     def get_airdrop(self, airdrop_id: int) -> Optional[Dict]:
         """Get specific airdrop"""
-        for airdrop in self.data['airdrops']:
-            if airdrop['id'] == airdrop_id:
-                return airdrop
-        return None
+        self._require_loaded()
+        return self._airdrops_by_id.get(airdrop_id)
     
     def get_airdrops_by_category(self, category: str, subcategory: str) -> List[Dict]:
         """Get airdrops by category and subcategory"""
-        return [
-            airdrop for airdrop in self.data['airdrops']
-            if airdrop['category'] == category.lower() and airdrop['subcategory'] == subcategory.lower()
-        ]
+        self._require_loaded()
+        return list(self._airdrops_by_category.get((category.lower(), subcategory.lower()), []))
+    
+    def count_airdrops_by_category(self, category: str, subcategory: str) -> int:
+        """Number of airdrops in a category and subcategory"""
+        self._require_loaded()
+        return len(self._airdrops_by_category.get((category.lower(), subcategory.lower()), []))
+    
+    @staticmethod
+    def _id_position(bucket: List[Dict], airdrop_id: int) -> int:
+        """Index of the first airdrop in an id-ordered bucket with an id above airdrop_id"""
+        low, high = 0, len(bucket)
+        while low < high:
+            middle = (low + high) // 2
+            if bucket[middle]['id'] <= airdrop_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def page_airdrops(self, category: str, subcategory: str, cursor: Optional[int] = None,
+                      backwards: bool = False, limit: int = 10) -> Tuple[List[Dict], bool, bool]:
+        """One page of a category in id order, plus whether pages exist before and after it
+        
+        cursor is the id of an airdrop on the neighbouring page, as in
+        page_users, so a page costs O(log n + limit) and stays put while
+        airdrops are added.
+        """
+        self._require_loaded()
+        bucket = self._airdrops_by_category.get((category.lower(), subcategory.lower()), [])
+        if backwards:
+            end = self._id_position(bucket, cursor - 1) if cursor is not None else len(bucket)
+            start = max(0, end - limit)
+        else:
+            start = self._id_position(bucket, cursor) if cursor is not None else 0
+            end = min(len(bucket), start + limit)
+        return bucket[start:end], start > 0, end < len(bucket)
     
     def get_all_airdrops(self) -> List[Dict]:
         """Get all airdrops"""
@@ -116,20 +979,39 @@ class Database:
     
     def update_airdrop(self, airdrop_id: int, **kwargs):
         """Update airdrop fields"""
-        for airdrop in self.data['airdrops']:
-            if airdrop['id'] == airdrop_id:
+        self._require_loaded()
+        if airdrop_id not in self._airdrops_by_id:
+            return False
+        
+        with self._write():
+            airdrop = self._airdrops_by_id.get(airdrop_id)
+            if airdrop:
+                previous = dict(airdrop)
                 airdrop.update(kwargs)
-                self.save_data()
-                return True
-        return False
+                if (airdrop['category'], airdrop['subcategory']) != (previous['category'], previous['subcategory']):
+                    self._unindex_airdrop(previous)
+                    self._index_airdrop(airdrop)
+                self._log('airdrop', airdrop_id, airdrop)
+        if not airdrop:
+            return False
+        self._emit('airdrop_updated', airdrop, previous)
+        return True
     
     def delete_airdrop(self, airdrop_id: int):
         """Delete airdrop"""
-        self.data['airdrops'] = [
-            airdrop for airdrop in self.data['airdrops']
-            if airdrop['id'] != airdrop_id
-        ]
-        self.save_data()
+        self._require_loaded()
+        with self._write():
+            airdrop = self._airdrops_by_id.get(airdrop_id)
+            self.data['airdrops'] = [
+                airdrop for airdrop in self.data['airdrops']
+                if airdrop['id'] != airdrop_id
+            ]
+            if airdrop:
+                self._unindex_airdrop(airdrop)
+                self._log('airdrop', airdrop_id, None)
+                self._bump('airdrops', -1)
+        if airdrop:
+            self._emit('airdrop_deleted', airdrop)
     
     # Support messages
     def save_support_message(self, user_id: int, message: str):
@@ -140,8 +1022,10 @@ class Database:
             'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             'status': 'pending'
         }
-        self.data['support_messages'].append(support_msg)
-        self.save_data()
+        with self._write():
+            self.data['support_messages'].append(support_msg)
+            self._log('support_add', support_msg)
+            self._bump('pending', group='support', daily='support_messages')
     
     def get_support_messages(self, status: str = None) -> List[Dict]:
         """Get support messages, optionally filtered by status"""
@@ -154,8 +1038,12 @@ class Database:
     
     def update_support_status(self, user_id: int, timestamp: str, status: str):
         """Update support message status"""
-        for msg in self.data['support_messages']:
-            if msg['user_id'] == user_id and msg['timestamp'] == timestamp:
-                msg['status'] = status
-                self.save_data()
-                break
\ No newline at end of file
+        with self._write():
+            for msg in self.data['support_messages']:
+                if msg['user_id'] == user_id and msg['timestamp'] == timestamp:
+                    if msg.get('status') != status:
+                        self._bump(msg.get('status', 'pending'), -1, group='support')
+                        self._bump(status, group='support')
+                    msg['status'] = status
+                    self._log('support_status', user_id, timestamp, status)
+                    break
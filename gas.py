@@ -0,0 +1,453 @@
+# gas.py
+"""
+Gas prices for /gas and base fee alerts, from one shared tracker per chain
+
+A GasTracker polls its chain's head with eth_blockNumber and, once per new
+block, fetches just the new blocks' eth_feeHistory entries into a rolling
+window of the last GAS_HISTORY_BLOCKS. /gas answers from that window, so
+any number of users cost no RPC at all. A tracker starts the first time
+its chain is asked about (or at startup if alerts wait on it) and then
+keeps running.
+
+In a cluster the ingress runs the only polling tracker per chain and
+broadcasts its window after every poll to the workers, whose trackers
+just take it in; N workers still cost one chain's worth of RPC calls.
+
+Alerts ("tell me when the base fee drops below 10 gwei") are one-shot and
+kept in two lists sorted by threshold, below and above. A new base fee
+fires a suffix of the first and a prefix of the second, found by bisect,
+so a block only touches the alerts it crossed.
+"""
+
+import asyncio
+import bisect
+import logging
+import os
+import statistics
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import CommandHandler, ContextTypes
+
+from checkpoint import CheckpointStore
+from log_pipeline import HotPathLogger
+from notifications import send_notification
+from profiling import timed_handler
+from rpc import RpcClient
+from wallet import EVM_CHAINS
+
+logger = logging.getLogger(__name__)
+# A node outage fails every poll
+hot_log = HotPathLogger(logger)
+
+GAS_CHAINS = {
+    'eth': 'Ethereum Mainnet',
+    'arbitrum': 'Arbitrum',
+    'base': 'Base',
+}
+# Seconds between head checks, about a block time; override with GAS_POLL_INTERVAL_<CHAIN>
+GAS_POLL_INTERVALS = {'eth': 4.0, 'arbitrum': 1.0, 'base': 2.0}
+GAS_HISTORY_BLOCKS = int(os.getenv('GAS_HISTORY_BLOCKS', '20'))
+GAS_REWARD_PERCENTILES = [10, 50, 90]
+GAS_ALERTS_FILE = os.getenv('GAS_ALERTS_FILE', 'gas_alerts.json')
+# Prices older than this are shown as stale
+GAS_STALE_AFTER = 120
+# How long /gas waits for a tracker's first block
+GAS_FIRST_BLOCK_TIMEOUT = 10
+MAX_ALERTS_PER_USER = 5
+
+GWEI = 10**9
+BELOW, ABOVE = 'below', 'above'
+
+def format_gwei(wei: float) -> str:
+    gwei = wei / GWEI
+    if gwei >= 10:
+        return f"{gwei:.1f}"
+    if gwei >= 0.1:
+        return f"{gwei:.2f}"
+    return f"{gwei:.4f}".rstrip('0').rstrip('.') or "0"
+
+class ThresholdAlerts:
+    """One-shot base fee alerts of one chain, as (threshold wei, user id) lists sorted by threshold"""
+
+    def __init__(self):
+        self.below: List[Tuple[int, int]] = []
+        self.above: List[Tuple[int, int]] = []
+        self._per_user: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.below) + len(self.above)
+
+    def add(self, direction: str, threshold: int, user_id: int) -> bool:
+        """False if the user is at MAX_ALERTS_PER_USER"""
+        if self._per_user.get(user_id, 0) >= MAX_ALERTS_PER_USER:
+            return False
+        entry = (threshold, user_id)
+        alerts = self.below if direction == BELOW else self.above
+        position = bisect.bisect_left(alerts, entry)
+        if position < len(alerts) and alerts[position] == entry:
+            return True
+        alerts.insert(position, entry)
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        return True
+
+    def user_alerts(self, user_id: int) -> List[Tuple[str, int]]:
+        """(direction, threshold) of a user's alerts; scans, so only for commands"""
+        if user_id not in self._per_user:
+            return []
+        return ([(BELOW, threshold) for threshold, owner in self.below if owner == user_id] +
+                [(ABOVE, threshold) for threshold, owner in self.above if owner == user_id])
+
+    def remove_user(self, user_id: int) -> int:
+        count = self._per_user.pop(user_id, 0)
+        if count:
+            self.below = [entry for entry in self.below if entry[1] != user_id]
+            self.above = [entry for entry in self.above if entry[1] != user_id]
+        return count
+
+    def crossed(self, base_fee: int) -> List[Tuple[str, int, int]]:
+        """Remove and return (direction, threshold, user id) of every alert base_fee fires"""
+        # Below-alerts with a threshold over the fee sit at the end
+        start = bisect.bisect_right(self.below, (base_fee, float('inf')))
+        fired = [(BELOW, threshold, user_id) for threshold, user_id in self.below[start:]]
+        del self.below[start:]
+        # Above-alerts with a threshold under the fee sit at the start
+        end = bisect.bisect_left(self.above, (base_fee, -1))
+        fired += [(ABOVE, threshold, user_id) for threshold, user_id in self.above[:end]]
+        del self.above[:end]
+        for _, _, user_id in fired:
+            count = self._per_user[user_id] - 1
+            if count:
+                self._per_user[user_id] = count
+            else:
+                del self._per_user[user_id]
+        return fired
+
+    def to_json(self) -> Dict[str, List[List[int]]]:
+        return {BELOW: [list(entry) for entry in self.below], ABOVE: [list(entry) for entry in self.above]}
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'ThresholdAlerts':
+        alerts = cls()
+        for direction in (BELOW, ABOVE):
+            for threshold, user_id in data.get(direction, []):
+                alerts.add(direction, threshold, user_id)
+        return alerts
+
+class GasTracker:
+    """Follows one chain's fees block by block and fires its alerts"""
+
+    def __init__(self, chain: str, rpc_url: str, poll_interval: float, alerts: Optional[ThresholdAlerts] = None):
+        self.chain = chain
+        self.poll_interval = poll_interval
+        self.rpc = RpcClient(rpc_url, chain=chain)
+        self.alerts = alerts or ThresholdAlerts()
+        self.block = -1
+        # (block, base fee, priority fees at GAS_REWARD_PERCENTILES), oldest first
+        self.blocks: Deque[Tuple[int, int, Tuple[int, ...]]] = deque(maxlen=GAS_HISTORY_BLOCKS)
+        # Base fee of the block being built, the one a transaction sent now pays
+        self.next_base_fee: Optional[int] = None
+        self.updated_at = 0.0
+        self.ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            'polls': 0,
+            'new_heads': 0,
+            'errors': 0,
+            'alerts_fired': 0,
+        }
+
+    async def refresh(self) -> List[Tuple[str, int, int]]:
+        """Check the head; on new blocks fetch their fee history and return the alerts fired"""
+        self.stats['polls'] += 1
+        head = int(await self.rpc.call('eth_blockNumber'), 16)
+        if head <= self.block:
+            return []
+        count = min(head - self.block, GAS_HISTORY_BLOCKS) if self.block >= 0 else GAS_HISTORY_BLOCKS
+        history = await self.rpc.call('eth_feeHistory', [hex(count), hex(head), GAS_REWARD_PERCENTILES])
+        oldest = int(history['oldestBlock'], 16)
+        base_fees = [int(fee, 16) for fee in history['baseFeePerGas']]
+        rewards = history.get('reward') or [[] for _ in base_fees[:-1]]
+        for offset, (base_fee, reward) in enumerate(zip(base_fees[:-1], rewards)):
+            number = oldest + offset
+            if number > self.block:
+                self.blocks.append((number, base_fee, tuple(int(fee, 16) for fee in reward)))
+        self.block = head
+        self.next_base_fee = base_fees[-1]
+        return self._new_head()
+
+    def _new_head(self) -> List[Tuple[str, int, int]]:
+        self.stats['new_heads'] += 1
+        self.updated_at = time.monotonic()
+        self.ready.set()
+        fired = self.alerts.crossed(self.next_base_fee)
+        self.stats['alerts_fired'] += len(fired)
+        return fired
+
+    def state(self) -> Dict:
+        """The fee window, for apply_state in another process"""
+        return {'block': self.block, 'blocks': list(self.blocks), 'next_base_fee': self.next_base_fee}
+
+    def apply_state(self, state: Dict) -> List[Tuple[str, int, int]]:
+        """Take a fee window polled elsewhere instead of polling; returns the alerts fired"""
+        if state['block'] <= self.block:
+            return []
+        self.blocks = deque(state['blocks'], maxlen=GAS_HISTORY_BLOCKS)
+        self.block = state['block']
+        self.next_base_fee = state['next_base_fee']
+        return self._new_head()
+
+    def snapshot(self) -> Optional[Dict]:
+        """What /gas shows, from memory; None before the first block"""
+        if not self.blocks:
+            return None
+        base_fees = [base_fee for _, base_fee, _ in self.blocks]
+        rewards = [reward for _, _, reward in self.blocks if reward]
+        return {
+            'block': self.block,
+            'age': time.monotonic() - self.updated_at,
+            'base_fee': base_fees[-1],
+            'next_base_fee': self.next_base_fee,
+            'low': min(base_fees),
+            'high': max(base_fees),
+            # Per percentile, the median tip over the window
+            'priority_fees': [statistics.median(column) for column in zip(*rewards)] if rewards else [],
+        }
+
+    async def run(self, on_poll):
+        while True:
+            started = time.monotonic()
+            try:
+                on_poll(self.chain, await self.refresh())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['errors'] += 1
+                hot_log.error("Gas tracker %s error: %s", self.chain, e)
+            await asyncio.sleep(max(0.0, self.poll_interval - (time.monotonic() - started)))
+
+    def start(self, on_poll):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(on_poll))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.rpc.close()
+
+# Running trackers by chain, and where alerts are kept
+trackers: Dict[str, GasTracker] = {}
+alert_store: Optional[CheckpointStore] = None
+_app = None
+_deliveries = set()
+# False in a cluster worker: its trackers take the ingress' broadcasts
+_polling = True
+# Set in the cluster ingress: publish(chain, state) after every poll
+_publish = None
+
+def _alerts_for(chain: str) -> ThresholdAlerts:
+    return ThresholdAlerts.from_json(alert_store.get(chain, {})) if alert_store else ThresholdAlerts()
+
+def _save_alerts(chain: str):
+    if alert_store is not None:
+        alert_store.set(chain, trackers[chain].alerts.to_json())
+
+def _on_poll(chain: str, fired: List[Tuple[str, int, int]]):
+    # Sent even without a new head, so a worker that just started catches up
+    if _publish is not None:
+        _publish(chain, trackers[chain].state())
+    if fired:
+        _on_fired(chain, fired)
+
+def _on_fired(chain: str, fired: List[Tuple[str, int, int]]):
+    """Persist the shorter alert lists and send the messages off the polling loop"""
+    _save_alerts(chain)
+    if _app is None:
+        return
+    tracker = trackers[chain]
+    task = asyncio.create_task(_deliver(chain, tracker.next_base_fee, fired))
+    _deliveries.add(task)
+    task.add_done_callback(_deliveries.discard)
+
+async def _deliver(chain: str, base_fee: int, fired: List[Tuple[str, int, int]]):
+    for direction, threshold, user_id in fired:
+        word = "dropped below" if direction == BELOW else "rose above"
+        await send_notification(
+            _app, user_id,
+            f"⛽ {GAS_CHAINS[chain]} base fee {word} {format_gwei(threshold)} gwei: "
+            f"now {format_gwei(base_fee)} gwei"
+        )
+
+def get_tracker(chain: str) -> GasTracker:
+    """The chain's tracker, started on first use"""
+    tracker = trackers.get(chain)
+    if tracker is None:
+        url = os.getenv(f"GAS_RPC_{chain.upper()}", EVM_CHAINS[chain]['rpc'])
+        interval = float(os.getenv(f"GAS_POLL_INTERVAL_{chain.upper()}", GAS_POLL_INTERVALS[chain]))
+        tracker = trackers[chain] = GasTracker(chain, url, interval, _alerts_for(chain))
+        if _polling:
+            tracker.start(_on_poll)
+            logger.info(f"Gas tracker started for {chain}")
+    return tracker
+
+def apply_shared_state(chain: str, state: Dict):
+    """A fee window broadcast by the cluster ingress' tracker"""
+    # Saved alerts load at warm-up; a tracker created before would miss them
+    if alert_store is None:
+        return
+    fired = get_tracker(chain).apply_state(state)
+    if fired:
+        _on_fired(chain, fired)
+
+def run_shared_trackers(publish):
+    """Poll every chain once for a whole cluster, handing each poll's window to publish(chain, state)
+
+    Runs in the ingress, which keeps no alerts; the workers' trackers apply
+    the states with apply_shared_state. Every chain is polled from the
+    start, as the ingress can't tell which ones workers are asked about.
+    """
+    global _publish
+    _publish = publish
+    for chain in GAS_CHAINS:
+        get_tracker(chain)
+
+def gas_stats() -> Dict[str, float]:
+    """Counters of every tracker, for metrics"""
+    stats: Dict[str, float] = {}
+    for chain, tracker in trackers.items():
+        for key, value in tracker.stats.items():
+            stats[f"{chain}_{key}"] = value
+        stats[f"{chain}_alerts_waiting"] = len(tracker.alerts)
+    return stats
+
+def start_gas_trackers(app, alerts_file: str = GAS_ALERTS_FILE, poll: bool = True):
+    """Load saved alerts and start the trackers they wait on
+
+    poll=False in a cluster worker, where trackers follow the ingress'
+    broadcasts (see run_shared_trackers) instead of polling.
+    """
+    global _app, alert_store, _polling
+    _app = app
+    _polling = poll
+    alert_store = CheckpointStore(alerts_file, min_interval=0)
+    for chain in GAS_CHAINS:
+        if alert_store.get(chain, {}).get(BELOW) or alert_store.get(chain, {}).get(ABOVE):
+            get_tracker(chain)
+
+async def stop_gas_trackers():
+    for tracker in trackers.values():
+        await tracker.stop()
+    trackers.clear()
+    if alert_store is not None:
+        alert_store.flush()
+
+def parse_chain(text: str) -> Optional[str]:
+    text = text.lower()
+    aliases = {'ethereum': 'eth', 'mainnet': 'eth', 'arb': 'arbitrum'}
+    text = aliases.get(text, text)
+    return text if text in GAS_CHAINS else None
+
+def format_gas(chain: str, snapshot: Optional[Dict]) -> List[str]:
+    label = GAS_CHAINS[chain]
+    if snapshot is None:
+        return [f"{label}: no data yet"]
+    stale = " ⚠️ stale" if snapshot['age'] > GAS_STALE_AFTER else ""
+    lines = [
+        f"{label} (block {snapshot['block']:,}, {snapshot['age']:.0f}s ago){stale}",
+        f"  Base fee: {format_gwei(snapshot['base_fee'])} gwei, next {format_gwei(snapshot['next_base_fee'])}",
+    ]
+    if snapshot['priority_fees']:
+        slow, normal, fast = snapshot['priority_fees']
+        lines.append(f"  Tip: {format_gwei(slow)} / {format_gwei(normal)} / {format_gwei(fast)} gwei (slow/normal/fast)")
+    lines.append(f"  Last {GAS_HISTORY_BLOCKS} blocks: {format_gwei(snapshot['low'])}–{format_gwei(snapshot['high'])} gwei")
+    return lines
+
+@timed_handler
+async def gas_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/gas [eth|arbitrum|base]"""
+    if context.args:
+        chain = parse_chain(context.args[0])
+        if chain is None:
+            await update.message.reply_text(f"Unknown chain. Usage: /gas [{'|'.join(GAS_CHAINS)}]")
+            return
+        chains = [chain]
+    else:
+        chains = list(GAS_CHAINS)
+
+    started = [get_tracker(chain) for chain in chains]
+    # A tracker that just started has nothing yet; everyone asking waits on its first block
+    waiting = [tracker.ready.wait() for tracker in started if not tracker.ready.is_set()]
+    if waiting:
+        try:
+            await asyncio.wait_for(asyncio.gather(*waiting), GAS_FIRST_BLOCK_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+    lines = ["⛽ Gas prices", ""]
+    for tracker in started:
+        lines += format_gas(tracker.chain, tracker.snapshot())
+    await update.message.reply_text("\n".join(lines))
+
+GAS_ALERT_USAGE = (
+    f"Usage: /gas_alert <{'|'.join(GAS_CHAINS)}> <below|above> <gwei>\n"
+    "e.g. /gas_alert eth below 10\n"
+    "/gas_alert lists your alerts, /gas_alert clear removes them."
+)
+
+@timed_handler
+async def gas_alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/gas_alert <chain> <below|above|<|>> <gwei>, /gas_alert, /gas_alert clear"""
+    user_id = update.effective_user.id
+    args = context.args or []
+
+    if not args:
+        lines = [
+            f"{GAS_CHAINS[chain]}: base fee {direction} {format_gwei(threshold)} gwei"
+            for chain in GAS_CHAINS for direction, threshold in _alerts_for_user(chain, user_id)
+        ]
+        await update.message.reply_text("\n".join(["⛽ Your gas alerts", ""] + lines) if lines else
+                                        f"No gas alerts.\n\n{GAS_ALERT_USAGE}")
+        return
+
+    if args[0].lower() == 'clear':
+        removed = 0
+        for chain, tracker in trackers.items():
+            count = tracker.alerts.remove_user(user_id)
+            if count:
+                removed += count
+                _save_alerts(chain)
+        await update.message.reply_text(f"✅ Removed {removed} gas alerts.")
+        return
+
+    chain = parse_chain(args[0])
+    direction = {'below': BELOW, '<': BELOW, 'above': ABOVE, '>': ABOVE}.get(args[1].lower()) if len(args) == 3 else None
+    try:
+        gwei = float(args[2]) if direction else -1
+    except ValueError:
+        gwei = -1
+    if chain is None or direction is None or not 0 < gwei < 100_000:
+        await update.message.reply_text(GAS_ALERT_USAGE)
+        return
+
+    tracker = get_tracker(chain)
+    if not tracker.alerts.add(direction, int(gwei * GWEI), user_id):
+        await update.message.reply_text(f"❌ You can have at most {MAX_ALERTS_PER_USER} alerts per chain.")
+        return
+    _save_alerts(chain)
+    await update.message.reply_text(
+        f"✅ I'll tell you once the {GAS_CHAINS[chain]} base fee is {direction} {format_gwei(int(gwei * GWEI))} gwei."
+    )
+
+def _alerts_for_user(chain: str, user_id: int) -> List[Tuple[str, int]]:
+    tracker = trackers.get(chain)
+    return tracker.alerts.user_alerts(user_id) if tracker else []
+
+def register_gas_handlers(app):
+    app.add_handler(CommandHandler('gas', gas_command))
+    app.add_handler(CommandHandler('gas_alert', gas_alert_command))
@@ -1,11 +1,17 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from threading import Thread
 import logging
 
+import metrics
+from log_pipeline import HotPathLogger
+
 app = Flask(__name__)
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
+logger = logging.getLogger(__name__)
+request_log = HotPathLogger(logger, per_second=5)
+
 @app.route('/')
 def home():
     return jsonify({
@@ -21,16 +27,23 @@ def health():
         'uptime': 'running'
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics.scrape_allowed(request.remote_addr, request.headers.get('Authorization')):
+        return Response(status=403)
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/webhook/alchemy', methods=['POST'])
 def alchemy_webhook():
     """Handle Alchemy webhook for transaction notifications"""
     try:
         data = request.json
         # This will be handled by the notification system
-        print(f"Received webhook: {data}")
+        request_log.info("Received webhook: type=%s", data.get('type') if isinstance(data, dict) else None)
+        logger.debug("Webhook payload: %s", data)
         return jsonify({'status': 'received'}), 200
     except Exception as e:
-        print(f"Webhook error: {e}")
+        request_log.error("Webhook error: %s", e)
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
 def run():
@@ -40,4 +53,4 @@ def keep_alive():
     t = Thread(target=run)
     t.daemon = True
     t.start()
-    print("Flask server started on port 8080")
\ No newline at end of file
+    logger.info("Flask server started on port 8080")
\ No newline at end of file
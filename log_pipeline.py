@@ -0,0 +1,149 @@
+# log_pipeline.py
+"""
+Logging that stays off the event loop
+
+setup_logging() routes every record through a bounded queue to a
+QueueListener thread, which does the formatting and the stderr writes.
+The calling thread only builds the record: messages use lazy %-style
+arguments, so the payload is turned into text on the listener thread, and
+only if the record is kept. When the queue is full the record is dropped
+and counted instead of blocking a handler.
+
+HotPathLogger goes in front of a logger on paths that can fire thousands
+of times a second (webhook payloads, per-address registrations). Per
+message template it keeps one call in `every` and at most `per_second`
+records, and the next record that gets through says how many were
+skipped. Every drop is counted in log_records_dropped_total.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+from metrics import counter
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Records waiting for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+LOG_DROPPED = counter('log_records_dropped_total', 'Log records not written', ['reason'])
+_dropped_queue_full = LOG_DROPPED.labels('queue_full')
+_dropped_sampled = LOG_DROPPED.labels('sampled')
+_dropped_rate_limited = LOG_DROPPED.labels('rate_limited')
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that hands the raw record over and drops it if the queue is full"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock version formats here, on the caller's thread; the listener's
+        # handlers format instead. Same process, so the record needn't pickle.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped_queue_full.inc()
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> logging.handlers.QueueListener:
+    """Send the root logger's records through the queue to a stderr writer thread"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(fmt))
+    records: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(records))
+    root.setLevel(level)
+
+    _listener.start()
+    # Write out what's still queued when the process exits
+    atexit.register(_listener.stop)
+    return _listener
+
+class _Budget:
+    __slots__ = ('calls', 'tokens', 'updated', 'skipped')
+
+    def __init__(self, burst: float):
+        self.calls = 0
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.skipped = 0
+
+class HotPathLogger:
+    """Samples and rate-limits a logger's records per message template
+
+    Only call it with lazy arguments (logger.info("x=%s", x)), never
+    f-strings: the template is the key, and the arguments must not be
+    formatted for records that are going to be dropped.
+    """
+
+    def __init__(self, logger: logging.Logger, every: int = 1, per_second: float = 10.0,
+                 burst: Optional[float] = None):
+        self.logger = logger
+        self.every = max(1, every)
+        self.per_second = per_second
+        self.burst = burst or max(1.0, per_second)
+        self._budgets: Dict[str, _Budget] = {}
+        self._lock = threading.Lock()
+
+    def _admit(self, msg: str) -> int:
+        """-1 to drop the record, else how many were skipped since the last one kept"""
+        with self._lock:
+            budget = self._budgets.get(msg)
+            if budget is None:
+                budget = self._budgets[msg] = _Budget(self.burst)
+            budget.calls += 1
+            if budget.calls % self.every:
+                budget.skipped += 1
+                _dropped_sampled.inc()
+                return -1
+            now = time.monotonic()
+            budget.tokens = min(self.burst, budget.tokens + (now - budget.updated) * self.per_second)
+            budget.updated = now
+            if budget.tokens < 1:
+                budget.skipped += 1
+                _dropped_rate_limited.inc()
+                return -1
+            budget.tokens -= 1
+            skipped, budget.skipped = budget.skipped, 0
+            return skipped
+
+    def log(self, level: int, msg: str, *args, **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        skipped = self._admit(msg)
+        if skipped < 0:
+            return
+        if skipped:
+            msg = msg + " (%d similar skipped)"
+            args = args + (skipped,)
+        # stacklevel points %(funcName)s and friends at our caller
+        kwargs.setdefault('stacklevel', 3)
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, msg: str, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg: str, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+    def warning(self, msg: str, *args, **kwargs):
+        self.log(logging.WARNING, msg, *args, **kwargs)
+
+    def error(self, msg: str, *args, **kwargs):
+        self.log(logging.ERROR, msg, *args, **kwargs)
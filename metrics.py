@@ -0,0 +1,315 @@
+# metrics.py
+"""
+Process metrics in the Prometheus text format
+
+Counters, gauges and histograms are plain in-process objects: a labelled
+child is looked up once per label combination and then updating it costs a
+lock and an addition (a bisect for histograms), cheap enough for every
+update and RPC call. Gauges that mirror something else (queue depth, the
+stats dicts other modules keep) are read through a callback when /metrics
+is scraped, so they cost nothing in between. Each process exposes its own
+numbers; cluster workers serve theirs on CLUSTER_METRICS_PORT + index.
+
+/metrics answers only clients presenting METRICS_TOKEN as a bearer token,
+or without a token configured, only local ones.
+"""
+
+import asyncio
+import bisect
+import hmac
+import ipaddress
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; handler and RPC latencies mostly fall between 1 ms and a few seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 16 * 1024, 128 * 1024, 1024 * 1024, 8 * 1024 * 1024, 64 * 1024 * 1024)
+# How often the event loop lag monitor wakes up
+LOOP_LAG_INTERVAL = 0.5
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+def scrape_allowed(remote: Optional[str], authorization: Optional[str]) -> bool:
+    """Whether a /metrics request may see the numbers"""
+    if METRICS_TOKEN:
+        return hmac.compare_digest(authorization or '', f"Bearer {METRICS_TOKEN}")
+    try:
+        return ipaddress.ip_address(remote or '').is_loopback
+    except ValueError:
+        return False
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> object:
+        """The child for one label combination; keep it around on hot paths"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+class Counter(_Metric):
+    """Monotonic count, e.g. messages sent"""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_label_text(self.label_names, values)} {_format_value(child.value)}"
+
+class _GaugeChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from function at scrape time instead"""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function else self.value
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. queue depth"""
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            try:
+                value = float(child.get())
+            except Exception as e:
+                logger.debug(f"Gauge {self.name}{values} unavailable: {e}")
+                continue
+            yield f"{self.name}{_label_text(self.label_names, values)} {_format_value(value)}"
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One count per bucket plus +Inf; cumulated only when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> '_Timer':
+        """Context manager observing the seconds its block took"""
+        return _Timer(self)
+
+class _Timer:
+    __slots__ = ('child', 'started')
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+class Histogram(_Metric):
+    """Distribution of observations in fixed buckets, e.g. latencies"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                yield f"{self.name}_bucket{_label_text(self.label_names, values, le)} {cumulative}"
+            labels = _label_text(self.label_names, values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+class Registry:
+    """Every metric of the process, in registration order"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Modules reloaded in the same process get the same metric back
+                if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                    raise ValueError(f"Metric {metric.name} already registered differently")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+render = REGISTRY.render
+
+# Shared by several modules
+HANDLER_LATENCY = histogram('bot_handler_duration_seconds', 'Time spent in a bot handler', ['handler'])
+HANDLER_ERRORS = counter('bot_handler_errors_total', 'Bot handlers that raised', ['handler'])
+RPC_LATENCY = histogram('rpc_request_duration_seconds', 'JSON-RPC round trip time', ['chain', 'method'])
+RPC_ERRORS = counter('rpc_errors_total', 'Failed JSON-RPC calls', ['chain', 'method'])
+TELEGRAM_RETRY_AFTER = counter('telegram_retry_after_total', 'Telegram 429 flood control answers', ['source'])
+LOOP_LAG = histogram('event_loop_lag_seconds', 'How late the event loop ran a timer',
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+LOOP_LAG_LAST = gauge('event_loop_lag_last_seconds', 'Event loop lag at the last check')
+gauge('process_start_time_seconds', 'Unix time the process started').set(time.time())
+
+def register_stats(name: str, source: Callable[[], Dict], help_text: str):
+    """Export the numeric entries of a stats dict as one gauge labelled by key
+
+    source is called at scrape time, so keys added later show up too.
+    """
+    def collect() -> List[Tuple[str, float]]:
+        return [(key, value) for key, value in source().items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+    REGISTRY._register(_StatsGauge(name, help_text, collect))
+
+class _StatsGauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, collect: Callable[[], List[Tuple[str, float]]]):
+        super().__init__(name, help_text, ['stat'])
+        self.collect = collect
+
+    def _samples(self):
+        try:
+            entries = self.collect()
+        except Exception as e:
+            logger.debug(f"Stats {self.name} unavailable: {e}")
+            return
+        for key, value in entries:
+            yield f'{self.name}{{stat="{_escape(key)}"}} {_format_value(float(value))}'
+
+async def monitor_event_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    """Measure how much later than asked the loop wakes a sleeping task
+
+    Anything blocking the loop (a slow sync call in a handler, a big JSON
+    dump) shows up here as lag for every user at once.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        LOOP_LAG.observe(lag)
+        LOOP_LAG_LAST.set(lag)
@@ -0,0 +1,166 @@
+# notifications.py
+import asyncio
+import logging
+import os
+from typing import Dict, List
+
+from telegram.error import RetryAfter
+
+from log_pipeline import HotPathLogger
+from metrics import TELEGRAM_RETRY_AFTER, counter
+from prices import usd_suffix
+
+logger = logging.getLogger(__name__)
+# Send failures come in bursts when Telegram has trouble
+hot_log = HotPathLogger(logger)
+
+# Coalescing window (seconds) for users who haven't picked their own
+DEFAULT_DIGEST_WINDOW = int(os.getenv('NOTIFICATION_DIGEST_WINDOW', '10'))
+MAX_DIGEST_WINDOW = 300
+
+# How many hashes a digest lists before collapsing the rest
+DIGEST_MAX_HASHES = 5
+
+# Block explorers by Alchemy network name
+EXPLORERS = {
+    'ETH_MAINNET': 'https://etherscan.io',
+    'ARB_MAINNET': 'https://arbiscan.io',
+    'BASE_MAINNET': 'https://basescan.org',
+    'SOLANA_MAINNET': 'https://solscan.io',
+}
+
+NOTIFICATIONS_SENT = counter('notifications_sent_total', 'Wallet notification messages by outcome', ['result'])
+_delivered = NOTIFICATIONS_SENT.labels('delivered')
+_failed = NOTIFICATIONS_SENT.labels('failed')
+_flood_limited = TELEGRAM_RETRY_AFTER.labels('notifications')
+
+# Activities waiting for their chat's window to close; a chat is in here
+# (maybe with an empty list) while its window is open
+_pending: Dict[int, List[dict]] = {}
+_flush_tasks: Dict[int, asyncio.Task] = {}
+
+def explorer_tx_url(network: str, tx_hash: str) -> str:
+    """Build a block explorer link for a transaction"""
+    return f"{EXPLORERS.get(network, EXPLORERS['ETH_MAINNET'])}/tx/{tx_hash}"
+
+def explorer_account_url(network: str, address: str) -> str:
+    """Build a block explorer link for an account"""
+    return f"{EXPLORERS.get(network, EXPLORERS['ETH_MAINNET'])}/account/{address}"
+
+def format_activity(activity: dict) -> str:
+    """Render a single activity as a notification message"""
+    counterparty = activity.get('counterparty', '')
+    tx_hash = activity.get('hash', '')
+    contract, network = activity.get('contract'), activity.get('network')
+
+    if activity['direction'] == 'sent':
+        emoji = "📤"
+        action = "Sent"
+        address_label = f"To: `{counterparty[:8]}...{counterparty[-6:]}`\n"
+    else:
+        emoji = "📥"
+        action = "Received"
+        address_label = f"From: `{counterparty[:8]}...{counterparty[-6:]}`\n"
+
+    text = (
+        f"{emoji} *Transaction {action}*\n\n"
+        f"Amount: {activity['value']:.6f} {activity['asset']}{usd_suffix(activity['asset'], activity['value'], contract, network)}\n"
+    )
+    # Balance watchers see the change but not the other side of it
+    if counterparty:
+        text += address_label
+    if 'balance' in activity:
+        text += f"Balance: {activity['balance']:.6f} {activity['asset']}{usd_suffix(activity['asset'], activity['balance'], contract, network)}\n"
+    if tx_hash:
+        text += (
+            f"Hash: `{tx_hash[:10]}...{tx_hash[-8:]}`\n\n"
+            f"[View on Explorer]({explorer_tx_url(activity.get('network', ''), tx_hash)})"
+        )
+    elif activity.get('account'):
+        text += f"\n[View on Explorer]({explorer_account_url(activity.get('network', ''), activity['account'])})"
+    return text
+
+def format_digest(activities: List[dict], window: int) -> str:
+    """Render a burst of activities as one digest message"""
+    totals = {}
+    for activity in activities:
+        # Tokens sharing a symbol are kept apart by contract
+        key = (activity['direction'], activity['asset'], activity.get('contract'), activity.get('network'))
+        amount, count = totals.get(key, (0.0, 0))
+        totals[key] = (amount + activity['value'], count + 1)
+
+    lines = [f"📦 *{len(activities)} transactions in the last {window}s*", ""]
+    for (direction, asset, contract, network), (amount, count) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        emoji, action = ("📤", "Sent") if direction == 'sent' else ("📥", "Received")
+        lines.append(f"{emoji} {action}: {amount:.6f} {asset}{usd_suffix(asset, amount, contract, network)} ({count} tx)")
+
+    hashes = [a['hash'] for a in activities if a.get('hash')]
+    if hashes:
+        lines.append("")
+        lines.append("Hashes:")
+        for tx_hash in hashes[:DIGEST_MAX_HASHES]:
+            lines.append(f"`{tx_hash[:10]}...{tx_hash[-8:]}`")
+        if len(hashes) > DIGEST_MAX_HASHES:
+            lines.append(f"...and {len(hashes) - DIGEST_MAX_HASHES} more")
+
+    return "\n".join(lines)
+
+async def send_notification(app, user_id: int, text: str):
+    """Deliver a notification message (Markdown, no link previews)"""
+    try:
+        await app.bot.send_message(
+            chat_id=user_id,
+            text=text,
+            parse_mode='Markdown',
+            disable_web_page_preview=True
+        )
+        _delivered.inc()
+    except Exception as e:
+        _failed.inc()
+        if isinstance(e, RetryAfter):
+            _flood_limited.inc()
+        hot_log.error("Error sending notification to user %s: %s", user_id, e)
+
+async def _flush_after(app, user_id: int, window: int):
+    """Wait for the window to close, then send what accumulated"""
+    try:
+        await asyncio.sleep(window)
+    finally:
+        _flush_tasks.pop(user_id, None)
+        activities = _pending.pop(user_id, [])
+
+    if len(activities) == 1:
+        await send_notification(app, user_id, format_activity(activities[0]))
+    elif activities:
+        await send_notification(app, user_id, format_digest(activities, window))
+
+async def notify(app, user_id: int, activity: dict, window: int = DEFAULT_DIGEST_WINDOW):
+    """Notify a chat, coalescing bursts within the window
+
+    The first activity goes out right away and opens the window; what
+    arrives while it is open is sent together when it closes, so a lone
+    transaction is never held back.
+    """
+    if window <= 0:
+        await send_notification(app, user_id, format_activity(activity))
+        return
+
+    if user_id in _pending:
+        _pending[user_id].append(activity)
+        return
+
+    _pending[user_id] = []
+    _flush_tasks[user_id] = asyncio.create_task(_flush_after(app, user_id, window))
+    await send_notification(app, user_id, format_activity(activity))
+
+async def flush_all(app):
+    """Send every pending digest right away (used on shutdown)"""
+    for task in list(_flush_tasks.values()):
+        task.cancel()
+
+    for user_id in list(_pending):
+        activities = _pending.pop(user_id)
+        if len(activities) == 1:
+            await send_notification(app, user_id, format_activity(activities[0]))
+        elif activities:
+            await send_notification(app, user_id, format_digest(activities, DEFAULT_DIGEST_WINDOW))
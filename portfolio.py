@@ -0,0 +1,446 @@
+# portfolio.py
+"""
+Periodic snapshots of connected wallets' native balances, kept as compact
+time series for /history
+
+A JobQueue job reads every connected wallet's balance on each chain once
+per PORTFOLIO_SNAPSHOT_INTERVAL: EVM balances as JSON-RPC batches of
+eth_getBalance, Solana ones through getMultipleAccounts, both paced to
+PORTFOLIO_RPC_BUDGET requests per second per chain. At the default 100
+addresses per request and 10 requests a second, 100k wallets take about
+100 seconds per chain, and the chains run side by side.
+
+A balance holds until it changes, so a series only stores changes: recent
+ones at full resolution (uint32 minute + float32 balance, 8 bytes),
+older ones folded into one (low, high, close) entry per day that saw a
+change (14 bytes), dropped after PORTFOLIO_RETENTION_DAYS. An address
+whose balance has always been zero has no series at all.
+"""
+
+import asyncio
+import bisect
+import logging
+import os
+import struct
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from telegram import Update
+from telegram.ext import CommandHandler, ContextTypes
+
+from address_index import address_key
+from log_pipeline import HotPathLogger
+from profiling import timed_handler
+from rpc import RequestPacer, RpcClient
+from solana_watcher import LAMPORTS_PER_SOL, SOLANA_BATCH_SIZE, fetch_lamports
+from wallet import EVM_CHAINS, SOLANA_RPC
+
+logger = logging.getLogger(__name__)
+# A failing provider fails every request of a round
+hot_log = HotPathLogger(logger)
+
+# Seconds between snapshot rounds; 0 turns snapshots off
+PORTFOLIO_SNAPSHOT_INTERVAL = float(os.getenv('PORTFOLIO_SNAPSHOT_INTERVAL', '3600'))
+PORTFOLIO_FIRST_SNAPSHOT_DELAY = float(os.getenv('PORTFOLIO_FIRST_SNAPSHOT_DELAY', '60'))
+PORTFOLIO_RPC_BUDGET = float(os.getenv('PORTFOLIO_RPC_BUDGET', '10'))  # requests per second per chain
+PORTFOLIO_CONCURRENCY = int(os.getenv('PORTFOLIO_CONCURRENCY', '4'))
+PORTFOLIO_HISTORY_FILE = os.getenv('PORTFOLIO_HISTORY_FILE', 'portfolio_history.bin')
+# Changes kept at full resolution, then as daily entries
+PORTFOLIO_RAW_DAYS = int(os.getenv('PORTFOLIO_RAW_DAYS', '14'))
+PORTFOLIO_RETENTION_DAYS = int(os.getenv('PORTFOLIO_RETENTION_DAYS', '365'))
+
+# eth_getBalance calls per batch request
+EVM_BATCH_SIZE = 100
+WEI_PER_ETH = 10**18
+
+# chain -> wallet store key, label and asset of what's snapshotted
+SNAPSHOT_CHAINS = {
+    'eth': ('ethereum', 'Ethereum Mainnet', 'ETH'),
+    'arbitrum': ('ethereum', 'Arbitrum', 'ETH'),
+    'base': ('ethereum', 'Base', 'ETH'),
+    'solana': ('solana', 'Solana', 'SOL'),
+}
+
+HISTORY_WINDOWS = {'24h': 1, '7d': 7, '30d': 30, '90d': 90, '1y': 365}
+DEFAULT_HISTORY_WINDOWS = ('24h', '7d', '30d')
+
+# Sample times are minutes since 2020-01-01 UTC
+EPOCH = 1577836800
+MINUTES_PER_DAY = 1440
+
+FILE_MAGIC = b'PFH1'
+_SERIES_HEADER = struct.Struct('<BBIH')
+_FLOAT32 = struct.Struct('f')
+
+def now_minute() -> int:
+    return int(time.time() - EPOCH) // 60
+
+def as_float32(value: float) -> float:
+    """value as it reads back from a float32 array"""
+    return _FLOAT32.unpack(_FLOAT32.pack(value))[0]
+
+class BalanceSeries:
+    """Balance changes of one address on one chain
+
+    minutes/values hold recent changes; daily holds (low, high, close)
+    triples for the days in days, created once the first change is folded.
+    """
+
+    __slots__ = ('minutes', 'values', 'days', 'daily')
+
+    def __init__(self):
+        self.minutes = array('I')
+        self.values = array('f')
+        self.days: Optional[array] = None
+        self.daily: Optional[array] = None
+
+    def __len__(self) -> int:
+        return len(self.minutes) + (len(self.days) if self.days else 0)
+
+    def nbytes(self) -> int:
+        size = len(self.minutes) * 8
+        if self.days:
+            size += len(self.days) * 2 + len(self.daily) * 4
+        return size
+
+    def last(self) -> Optional[float]:
+        if self.values:
+            return self.values[-1]
+        if self.daily:
+            return self.daily[-1]
+        return None
+
+    def append(self, minute: int, value: float) -> bool:
+        """Record a reading; False if the balance hasn't changed"""
+        if self.last() == as_float32(value):
+            return False
+        if self.minutes and self.minutes[-1] >= minute:
+            # Two readings in one minute: the later one wins
+            self.values[-1] = value
+            return True
+        self.minutes.append(minute)
+        self.values.append(value)
+        return True
+
+    def compact(self, minute: int):
+        """Fold changes older than PORTFOLIO_RAW_DAYS into daily entries, drop days past retention"""
+        count = bisect.bisect_left(self.minutes, minute - PORTFOLIO_RAW_DAYS * MINUTES_PER_DAY)
+        if count:
+            if self.days is None:
+                self.days, self.daily = array('H'), array('f')
+            days, daily = self.days, self.daily
+            previous = daily[-1] if daily else None
+            for index in range(count):
+                day, value = self.minutes[index] // MINUTES_PER_DAY, self.values[index]
+                if days and days[-1] == day:
+                    daily[-3] = min(daily[-3], value)
+                    daily[-2] = max(daily[-2], value)
+                    daily[-1] = value
+                else:
+                    # The day also held the balance carried in from before
+                    opening = value if previous is None else previous
+                    days.append(day)
+                    daily.extend((min(opening, value), max(opening, value), value))
+                previous = value
+            del self.minutes[:count]
+            del self.values[:count]
+
+        if self.days:
+            # Keep the last day before the cutoff: it is the balance at the cutoff
+            drop = bisect.bisect_left(self.days, minute // MINUTES_PER_DAY - PORTFOLIO_RETENTION_DAYS) - 1
+            if drop > 0:
+                del self.days[:drop]
+                del self.daily[:drop * 3]
+
+    def window(self, start: int) -> Optional[Tuple[float, float, float, float]]:
+        """(balance at start, low, high, current) since the minute start
+
+        Full resolution where the raw changes reach back, daily before that.
+        Without data as old as start, the first reading stands in.
+        """
+        current = self.last()
+        if current is None:
+            return None
+        first = bisect.bisect_right(self.minutes, start)
+        values = self.values[first:]
+        lows = highs = ()
+        opening = self.values[first - 1] if first else None
+        if not first and self.days:
+            day = bisect.bisect_left(self.days, start // MINUTES_PER_DAY)
+            if day:
+                opening = self.daily[day * 3 - 1]
+            lows = self.daily[day * 3::3]
+            highs = self.daily[day * 3 + 1::3]
+        if opening is None:
+            opening = lows[0] if lows else values[0]
+        low = min(opening, min(values, default=opening), min(lows, default=opening))
+        high = max(opening, max(values, default=opening), max(highs, default=opening))
+        return opening, low, high, current
+
+class BalanceHistory:
+    """Every (chain, address) series, saved to one binary file after each round"""
+
+    def __init__(self, path: str = PORTFOLIO_HISTORY_FILE):
+        self.path = path
+        self.series: Dict[Tuple[str, bytes], BalanceSeries] = {}
+
+    def __len__(self) -> int:
+        return len(self.series)
+
+    def get(self, chain: str, address: str) -> Optional[BalanceSeries]:
+        return self.series.get((chain, address_key(address)))
+
+    def record(self, chain: str, key: bytes, minute: int, value: float) -> bool:
+        """Add a reading; True if it changed the balance"""
+        series = self.series.get((chain, key))
+        if series is None:
+            if not value:
+                return False
+            series = self.series[(chain, key)] = BalanceSeries()
+        return series.append(minute, value)
+
+    def compact(self, minute: int):
+        for series in self.series.values():
+            series.compact(minute)
+
+    def nbytes(self) -> int:
+        """Bytes of stored samples, excluding per-series overhead"""
+        return sum(series.nbytes() for series in self.series.values())
+
+    def save(self):
+        """Write every series atomically; arrays are in native byte order"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(FILE_MAGIC)
+            for (chain, key), series in list(self.series.items()):
+                name = chain.encode()
+                days = len(series.days) if series.days else 0
+                f.write(_SERIES_HEADER.pack(len(name), len(key), len(series.minutes), days))
+                f.write(name + key)
+                f.write(series.minutes.tobytes() + series.values.tobytes())
+                if days:
+                    f.write(series.days.tobytes() + series.daily.tobytes())
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> int:
+        """Read the saved series; returns how many"""
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            if raw[:4] != FILE_MAGIC:
+                raise ValueError("not a portfolio history file")
+            series_by_key = {}
+            offset = 4
+            while offset < len(raw):
+                name_length, key_length, count, days = _SERIES_HEADER.unpack_from(raw, offset)
+                offset += _SERIES_HEADER.size
+                chain = raw[offset:offset + name_length].decode()
+                offset += name_length
+                key = raw[offset:offset + key_length]
+                offset += key_length
+                series = BalanceSeries()
+                series.minutes.frombytes(raw[offset:offset + count * 4])
+                offset += count * 4
+                series.values.frombytes(raw[offset:offset + count * 4])
+                offset += count * 4
+                if days:
+                    series.days, series.daily = array('H'), array('f')
+                    series.days.frombytes(raw[offset:offset + days * 2])
+                    offset += days * 2
+                    series.daily.frombytes(raw[offset:offset + days * 12])
+                    offset += days * 12
+                series_by_key[(chain, key)] = series
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Ignoring unreadable portfolio history {self.path}: {e}")
+            return 0
+        self.series = series_by_key
+        logger.info(f"Loaded {len(series_by_key)} balance series")
+        return len(series_by_key)
+
+class PortfolioSnapshotter:
+    """Reads every connected wallet's balance on each chain into a BalanceHistory"""
+
+    def __init__(self, history: BalanceHistory, rpc_budget: float = PORTFOLIO_RPC_BUDGET,
+                 concurrency: int = PORTFOLIO_CONCURRENCY):
+        self.history = history
+        self.rpc_budget = rpc_budget
+        self.concurrency = concurrency
+        self.clients: Dict[str, RpcClient] = {}
+        self.running = False
+        # Compaction walks every series, so it runs on the first round of a day
+        self._compacted_day = -1
+        self.stats = {
+            'rounds': 0,
+            'requests': 0,
+            'failed_requests': 0,
+            'readings': 0,
+            'changes': 0,
+            'series': 0,
+            'sample_bytes': 0,
+            'last_round_s': 0.0,
+        }
+
+    def _client(self, chain: str) -> RpcClient:
+        client = self.clients.get(chain)
+        if client is None:
+            default = SOLANA_RPC if chain == 'solana' else EVM_CHAINS[chain]['rpc']
+            url = os.getenv(f"PORTFOLIO_RPC_{chain.upper()}", default)
+            client = self.clients[chain] = RpcClient(url, chain=chain)
+        return client
+
+    async def _read_evm(self, rpc: RpcClient, addresses: Sequence[str]) -> List[Optional[float]]:
+        try:
+            results = await rpc.batch([('eth_getBalance', [address, 'latest']) for address in addresses])
+        except Exception as e:
+            hot_log.error("eth_getBalance batch failed on %s: %s", rpc.chain, e)
+            return [None] * len(addresses)
+        return [int(result, 16) / WEI_PER_ETH if isinstance(result, str) else None for result in results]
+
+    async def _read_solana(self, rpc: RpcClient, addresses: Sequence[str]) -> List[Optional[float]]:
+        lamports = await fetch_lamports(rpc, addresses, 1)
+        return [None if value is None else value / LAMPORTS_PER_SOL for value in lamports]
+
+    async def snapshot_chain(self, chain: str, addresses: Dict[bytes, str], minute: int):
+        """Read and record every address's balance on one chain, paced to the RPC budget"""
+        rpc = self._client(chain)
+        read, size = (self._read_solana, SOLANA_BATCH_SIZE) if chain == 'solana' else (self._read_evm, EVM_BATCH_SIZE)
+        keys = list(addresses)
+        pacer = RequestPacer(self.rpc_budget)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        history, stats = self.history, self.stats
+
+        async def chunk(start: int):
+            chunk_keys = keys[start:start + size]
+            async with semaphore:
+                await pacer.wait()
+                balances = await read(rpc, [addresses[key] for key in chunk_keys])
+            stats['requests'] += 1
+            for key, balance in zip(chunk_keys, balances):
+                if balance is None:
+                    continue
+                stats['readings'] += 1
+                if history.record(chain, key, minute, balance):
+                    stats['changes'] += 1
+            if any(balance is None for balance in balances):
+                stats['failed_requests'] += 1
+
+        await asyncio.gather(*(chunk(start) for start in range(0, len(keys), size)))
+
+    async def snapshot(self, wallets: Dict[str, Dict], minute: Optional[int] = None) -> int:
+        """One round over {user_id: wallet}; returns how many addresses were read"""
+        if self.running:
+            logger.warning("Portfolio snapshot still running, skipping this round")
+            return 0
+        self.running = True
+        started = time.perf_counter()
+        minute = now_minute() if minute is None else minute
+        try:
+            # Each address once per wallet type, however many users watch it
+            by_type: Dict[str, Dict[bytes, str]] = {'ethereum': {}, 'solana': {}}
+            for wallet in wallets.values():
+                for wallet_type, addresses in by_type.items():
+                    address = wallet.get(wallet_type)
+                    key = address_key(address or '')
+                    if key is not None:
+                        addresses[key] = address
+            await asyncio.gather(*(
+                self.snapshot_chain(chain, by_type[wallet_type], minute)
+                for chain, (wallet_type, _, _) in SNAPSHOT_CHAINS.items() if by_type[wallet_type]
+            ))
+            if minute // MINUTES_PER_DAY != self._compacted_day:
+                self.history.compact(minute)
+                self._compacted_day = minute // MINUTES_PER_DAY
+                self.stats['sample_bytes'] = self.history.nbytes()
+        finally:
+            self.running = False
+        self.stats['rounds'] += 1
+        self.stats['series'] = len(self.history)
+        self.stats['last_round_s'] = round(time.perf_counter() - started, 3)
+        read = sum(len(addresses) for addresses in by_type.values())
+        logger.info(f"Portfolio snapshot of {read} addresses took {self.stats['last_round_s']}s")
+        return read
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.close()
+        self.clients.clear()
+
+history = BalanceHistory()
+snapshotter = PortfolioSnapshotter(history)
+
+# Set by register_portfolio_handlers
+db = None
+
+async def snapshot_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback; job data returns the {user_id: wallet} to snapshot"""
+    try:
+        if await snapshotter.snapshot(context.job.data()):
+            await asyncio.to_thread(history.save)
+    except Exception as e:
+        logger.error(f"Portfolio snapshot failed: {e}")
+
+def start_portfolio_snapshots(application, wallets: Callable[[], Dict[str, Dict]]):
+    """Schedule snapshot rounds on the application's JobQueue"""
+    if PORTFOLIO_SNAPSHOT_INTERVAL <= 0:
+        return
+    if application.job_queue is None:
+        logger.warning("Portfolio snapshots need python-telegram-bot[job-queue]; /history will stay empty")
+        return
+    application.job_queue.run_repeating(snapshot_job, interval=PORTFOLIO_SNAPSHOT_INTERVAL,
+                                        first=PORTFOLIO_FIRST_SNAPSHOT_DELAY, data=wallets,
+                                        name='portfolio_snapshot')
+
+async def stop_portfolio_snapshots():
+    await snapshotter.close()
+
+def format_amount(value: float) -> str:
+    return f"{value:.6f}".rstrip('0').rstrip('.') if value else "0"
+
+def format_history(wallet_info: Dict, windows: Sequence[str], minute: int) -> List[str]:
+    """Current balance, then low, high and change per window, for each chain with a series"""
+    lines = []
+    for chain, (wallet_type, label, asset) in SNAPSHOT_CHAINS.items():
+        address = wallet_info.get(wallet_type)
+        series = history.get(chain, address) if address else None
+        if series is None:
+            continue
+        lines.append(f"{label}: {format_amount(series.last())} {asset}")
+        for name in windows:
+            opening, low, high, current = series.window(minute - HISTORY_WINDOWS[name] * MINUTES_PER_DAY)
+            delta = current - opening
+            sign = '+' if delta >= 0 else '-'
+            lines.append(f"  {name}: low {format_amount(low)} · high {format_amount(high)} · "
+                         f"change {sign}{format_amount(abs(delta))}")
+    return lines
+
+@timed_handler
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/history [24h|7d|30d|90d|1y ...]"""
+    windows = [arg.lower() for arg in context.args or DEFAULT_HISTORY_WINDOWS]
+    unknown = [name for name in windows if name not in HISTORY_WINDOWS]
+    if unknown:
+        await update.message.reply_text(f"Unknown window {unknown[0]}. Usage: /history [{'|'.join(HISTORY_WINDOWS)}]")
+        return
+
+    wallet_info = db.get_user_wallet(update.effective_user.id)
+    if not wallet_info:
+        await update.message.reply_text("❌ No wallet connected. Use /connect_wallet first.")
+        return
+
+    lines = format_history(wallet_info, windows, now_minute())
+    if not lines:
+        await update.message.reply_text(
+            "📈 No balance history yet. Balances are recorded every "
+            f"{PORTFOLIO_SNAPSHOT_INTERVAL / 60:.0f} minutes; zero balances aren't kept."
+        )
+        return
+    await update.message.reply_text("📈 Balance history\n\n" + "\n".join(lines))
+
+def register_portfolio_handlers(app, database):
+    """Add /history, answered from the in-memory series"""
+    global db
+    db = database
+    app.add_handler(CommandHandler('history', history_command))
@@ -0,0 +1,179 @@
+# prices.py
+"""
+USD prices for balance and notification messages
+
+One PriceService fetches every priced asset with a single
+CoinGecko-style /simple/price request every PRICE_REFRESH_INTERVAL
+seconds and keeps the answers in memory. Message formatting only reads
+that table, so showing a USD value never waits on the network. A price
+older than PRICE_MAX_AGE is treated as missing and messages fall back to
+the plain amount rather than show a stale dollar value.
+
+Only native coins are priced by symbol. A token's symbol is whatever its
+contract reports, so anyone can deploy a "USDT"; tokens are priced only
+when their contract is in PRICE_TOKENS for the network the transfer was
+seen on.
+
+PRICE_API_URL can point at any endpoint answering
+GET <url>/simple/price?ids=a,b&vs_currencies=usd with
+{"a": {"usd": 1.0}, ...}, such as stubs.FakePriceServer.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from log_pipeline import HotPathLogger
+
+logger = logging.getLogger(__name__)
+# An unreachable price API fails every refresh
+hot_log = HotPathLogger(logger)
+
+PRICE_API_URL = os.getenv('PRICE_API_URL', 'https://api.coingecko.com/api/v3').rstrip('/')
+PRICE_API_KEY = os.getenv('PRICE_API_KEY')
+PRICE_REFRESH_INTERVAL = float(os.getenv('PRICE_REFRESH_INTERVAL', '60'))
+# Prices older than this are not shown
+PRICE_MAX_AGE = float(os.getenv('PRICE_MAX_AGE', '600'))
+PRICE_TIMEOUT_S = 10
+
+# Native coin symbols -> price API ids
+NATIVE_ASSETS = {
+    'ETH': 'ethereum',
+    'SOL': 'solana',
+}
+
+# (network, lowercase contract address) -> price API id for tokens worth
+# pricing; extend with PRICE_TOKENS=NETWORK:0xcontract:id,...
+PRICE_TOKENS = {
+    ('ETH_MAINNET', '0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2'): 'ethereum',   # WETH
+    ('ETH_MAINNET', '0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48'): 'usd-coin',   # USDC
+    ('ETH_MAINNET', '0xdac17f958d2ee523a2206206994597c13d831ec7'): 'tether',     # USDT
+    ('ETH_MAINNET', '0x6b175474e89094c44da98b954eedeac495271d0f'): 'dai',        # DAI
+    ('ARB_MAINNET', '0xaf88d065e77c8cc2239327c5edb3a432268e5831'): 'usd-coin',   # USDC
+    ('ARB_MAINNET', '0x912ce59144191c1204e64559fe8253a0e49e6548'): 'arbitrum',   # ARB
+    ('BASE_MAINNET', '0x833589fcd6edb6e08f4c7c32d4f71b54bda02913'): 'usd-coin',  # USDC
+}
+for _entry in filter(None, os.getenv('PRICE_TOKENS', '').split(',')):
+    _network, _contract, _asset_id = (part.strip() for part in _entry.split(':', 2))
+    PRICE_TOKENS[(_network.upper(), _contract.lower())] = _asset_id
+
+class PriceService:
+    """Refreshes all asset prices in one request on an interval and answers lookups from memory"""
+
+    def __init__(self, api_url: str = PRICE_API_URL, assets: Optional[Dict[str, str]] = None,
+                 tokens: Optional[Dict[Tuple[str, str], str]] = None,
+                 interval: float = PRICE_REFRESH_INTERVAL, max_age: float = PRICE_MAX_AGE):
+        self.api_url = api_url
+        self.assets = dict(NATIVE_ASSETS if assets is None else assets)
+        self.tokens = dict(PRICE_TOKENS if tokens is None else tokens)
+        self.interval = interval
+        self.max_age = max_age
+        # Price API id -> USD price, and when the table was last filled
+        self.prices: Dict[str, float] = {}
+        self.updated_at = 0.0
+        self._session = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            'refreshes': 0,
+            'errors': 0,
+            'lookups': 0,
+            'stale_lookups': 0,
+        }
+
+    async def refresh(self) -> int:
+        """Fetch every asset's price in one request; returns how many came back"""
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=PRICE_TIMEOUT_S))
+        asset_ids = set(self.assets.values()) | set(self.tokens.values())
+        params = {'ids': ','.join(sorted(asset_ids)), 'vs_currencies': 'usd'}
+        headers = {'x-cg-demo-api-key': PRICE_API_KEY} if PRICE_API_KEY else None
+        async with self._session.get(f"{self.api_url}/simple/price", params=params, headers=headers) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        prices = {asset_id: float(quote['usd']) for asset_id, quote in data.items() if 'usd' in quote}
+        # Keep the previous price of an asset the API left out this time
+        self.prices.update(prices)
+        self.updated_at = time.monotonic()
+        self.stats['refreshes'] += 1
+        return len(prices)
+
+    def age(self) -> float:
+        return time.monotonic() - self.updated_at if self.updated_at else float('inf')
+
+    def price(self, asset: str, contract: Optional[str] = None, network: Optional[str] = None) -> Optional[float]:
+        """USD price of a native coin, or of a token by contract; None if unknown or older than max_age"""
+        self.stats['lookups'] += 1
+        if contract:
+            asset_id = self.tokens.get(((network or '').upper(), contract.lower()))
+        else:
+            asset_id = self.assets.get(asset.upper())
+        if asset_id is None or asset_id not in self.prices:
+            return None
+        if self.age() > self.max_age:
+            self.stats['stale_lookups'] += 1
+            return None
+        return self.prices[asset_id]
+
+    def usd_value(self, asset: str, amount: float, contract: Optional[str] = None,
+                  network: Optional[str] = None) -> Optional[float]:
+        price = self.price(asset, contract, network)
+        return None if price is None else float(amount) * price
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['errors'] += 1
+                hot_log.error("Price refresh failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    def snapshot(self) -> Dict[str, float]:
+        """Counters plus table age, for metrics"""
+        age = self.age()
+        return {**self.stats, 'assets': len(self.prices), 'age_seconds': age if age != float('inf') else -1}
+
+# Shared by every message that shows USD; started in bot.py's warm_up
+prices = PriceService()
+
+def format_usd(value: float) -> str:
+    if value >= 1000:
+        return f"${value:,.0f}"
+    if value >= 0.01:
+        return f"${value:,.2f}"
+    return "<$0.01" if value > 0 else "$0.00"
+
+def usd_suffix(asset: str, amount: float, contract: Optional[str] = None, network: Optional[str] = None) -> str:
+    """' (≈ $1,234.56)' for an amount of asset, or '' without a fresh price
+
+    Pass the contract (and network) of a token transfer; without one the
+    asset is looked up as a native coin.
+    """
+    value = prices.usd_value(asset, amount, contract, network)
+    return f" (≈ {format_usd(value)})" if value is not None else ""
+
+def start_price_service():
+    prices.start()
+
+async def stop_price_service():
+    await prices.stop()
@@ -0,0 +1,247 @@
+# profiling.py
+"""
+On-demand profiling of the running bot
+
+Three parts, all cheap or off until needed:
+
+- timed_handler wraps a handler coroutine. It always records wall time in
+  the handler latency histogram; while tracing is on it also steps the
+  coroutine itself and splits that wall time into time running on the
+  event loop (CPU, plus anything that blocks the loop) and time suspended
+  awaiting I/O.
+- profile_loop samples the event loop thread's stack from another thread
+  for N seconds and returns the counts as collapsed stacks, the input
+  format of flamegraph.pl and speedscope. Tracing is on for the duration.
+- check_slow_update logs updates whose handlers took longer than
+  SLOW_UPDATE_SECONDS with their type and callback data, and keeps the
+  latest ones for /profile.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from log_pipeline import HotPathLogger
+from metrics import HANDLER_ERRORS, HANDLER_LATENCY, counter
+
+logger = logging.getLogger(__name__)
+# A stalled loop makes every update slow at once
+hot_log = HotPathLogger(logger)
+
+# Trace every handler from startup instead of only while /profile runs
+PROFILE_HANDLERS = os.getenv('PROFILE_HANDLERS', '').lower() in ('1', 'true', 'yes')
+SLOW_UPDATE_SECONDS = float(os.getenv('SLOW_UPDATE_SECONDS', '1.0'))
+SLOW_UPDATE_LOG_SIZE = 50
+
+SAMPLE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 120
+MAX_STACK_DEPTH = 64
+
+HANDLER_ON_LOOP = counter('bot_handler_on_loop_seconds_total',
+                          'Traced handler time spent running on the event loop', ['handler'])
+HANDLER_AWAITING = counter('bot_handler_awaiting_seconds_total',
+                           'Traced handler time spent suspended awaiting I/O', ['handler'])
+SLOW_UPDATES = counter('bot_slow_updates_total', 'Updates slower than SLOW_UPDATE_SECONDS')
+
+# Tracing is on while this is non-zero; each /profile run holds it once
+_tracers = int(PROFILE_HANDLERS)
+# handler -> [calls, wall seconds, on-loop seconds] while traced
+handler_traces: Dict[str, List[float]] = {}
+# (time, handler seconds, queued seconds, description), newest last
+slow_updates: Deque[Tuple[str, float, float, str]] = deque(maxlen=SLOW_UPDATE_LOG_SIZE)
+_profile_lock = asyncio.Lock()
+
+class _SteppedCoroutine:
+    """Awaitable that drives a coroutine itself to time each step it runs"""
+
+    __slots__ = ('coroutine', 'on_loop')
+
+    def __init__(self, coroutine):
+        self.coroutine = coroutine
+        self.on_loop = 0.0
+
+    def __await__(self):
+        coroutine = self.coroutine
+        value, error = None, None
+        while True:
+            started = time.perf_counter()
+            try:
+                if error is None:
+                    yielded = coroutine.send(value)
+                else:
+                    yielded = coroutine.throw(error)
+            except StopIteration as stop:
+                self.on_loop += time.perf_counter() - started
+                return stop.value
+            except BaseException:
+                self.on_loop += time.perf_counter() - started
+                raise
+            self.on_loop += time.perf_counter() - started
+            # Whatever the task resumes us with (or throws in) goes to the coroutine
+            try:
+                value, error = (yield yielded), None
+            except GeneratorExit:
+                coroutine.close()
+                raise
+            except BaseException as e:
+                value, error = None, e
+
+def _record_trace(name: str, wall: float, on_loop: float):
+    trace = handler_traces.get(name)
+    if trace is None:
+        trace = handler_traces[name] = [0, 0.0, 0.0]
+    trace[0] += 1
+    trace[1] += wall
+    trace[2] += on_loop
+    HANDLER_ON_LOOP.labels(name).inc(on_loop)
+    HANDLER_AWAITING.labels(name).inc(max(0.0, wall - on_loop))
+
+def timed_handler(handler: Optional[Callable] = None, name: Optional[str] = None) -> Callable:
+    """Record a handler coroutine's latency and failures under its name
+
+    Usable bare (@timed_handler) or with a label (@timed_handler(name=...))
+    for handlers whose function name is ambiguous.
+    """
+    if handler is None:
+        return lambda function: timed_handler(function, name)
+
+    label = name or handler.__name__
+    latency = HANDLER_LATENCY.labels(label)
+    errors = HANDLER_ERRORS.labels(label)
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            if not _tracers:
+                return await handler(*args, **kwargs)
+            stepped = _SteppedCoroutine(handler(*args, **kwargs))
+            try:
+                return await stepped
+            finally:
+                _record_trace(label, time.perf_counter() - started, stepped.on_loop)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - started)
+    return wrapper
+
+# Slow updates
+UPDATE_KINDS = ('message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+                'channel_post', 'my_chat_member', 'chat_member', 'pre_checkout_query', 'poll_answer')
+
+def describe_update(update: object) -> str:
+    """Update type plus what routed it (command or callback data), never message text"""
+    for kind in UPDATE_KINDS:
+        value = getattr(update, kind, None)
+        if value is None:
+            continue
+        user = getattr(update, 'effective_user', None)
+        who = f" user={user.id}" if user else ""
+        if kind == 'callback_query':
+            return f"callback_query{who} data={value.data!r}"
+        if kind in ('message', 'edited_message'):
+            if value.text and value.text.startswith('/'):
+                return f"{kind}{who} command={value.text.split()[0]}"
+            if value.document:
+                return f"{kind}{who} document"
+            return f"{kind}{who} text" if value.text else f"{kind}{who}"
+        return f"{kind}{who}"
+    return type(update).__name__
+
+def check_slow_update(update: object, seconds: float, queued: float = 0.0):
+    """Log an update whose handlers ran longer than SLOW_UPDATE_SECONDS"""
+    if seconds < SLOW_UPDATE_SECONDS:
+        return
+    description = describe_update(update)
+    SLOW_UPDATES.inc()
+    slow_updates.append((datetime.now().strftime('%Y-%m-%d %H:%M:%S'), seconds, queued, description))
+    hot_log.warning("Slow update (%.2fs, queued %.2fs): %s", seconds, queued, description)
+
+# Sampling profiler
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval from another thread"""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+
+    def _stack(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def run(self, seconds: float) -> 'SamplingProfiler':
+        """Sample until seconds have passed or stop() is called"""
+        deadline = time.monotonic() + seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[self._stack(frame)] += 1
+            self.samples += 1
+            del frame
+            self._stop.wait(self.interval)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def collapsed(self) -> str:
+        """'frame;frame;frame count' lines, heaviest first"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def idle_share(self) -> float:
+        """Share of samples where the loop was waiting in select(), i.e. had nothing to run"""
+        if not self.samples:
+            return 0.0
+        idle = sum(count for stack, count in self.stacks.items() if stack.endswith('selectors.py:select'))
+        return idle / self.samples
+
+def profiling_active() -> bool:
+    return _profile_lock.locked()
+
+async def profile_loop(seconds: float) -> Tuple[SamplingProfiler, Dict[str, List[float]]]:
+    """Sample the calling event loop's thread for seconds with handler tracing on
+
+    Returns the profiler and the handler traces collected meanwhile.
+    """
+    global _tracers
+    seconds = max(1.0, min(seconds, MAX_PROFILE_SECONDS))
+    async with _profile_lock:
+        before = {name: list(trace) for name, trace in handler_traces.items()}
+        profiler = SamplingProfiler(threading.get_ident())
+        _tracers += 1
+        try:
+            await asyncio.to_thread(profiler.run, seconds)
+        finally:
+            profiler.stop()
+            _tracers -= 1
+        window = {}
+        for name, trace in handler_traces.items():
+            previous = before.get(name, [0, 0.0, 0.0])
+            if trace[0] > previous[0]:
+                window[name] = [trace[index] - previous[index] for index in range(3)]
+        return profiler, window
+
+def format_handler_traces(traces: Dict[str, List[float]], limit: int = 10) -> List[str]:
+    """'handler: calls, avg wall, on-loop share' lines, slowest total first"""
+    lines = []
+    for name, (calls, wall, on_loop) in sorted(traces.items(), key=lambda item: -item[1][1])[:limit]:
+        share = on_loop / wall * 100 if wall else 0.0
+        lines.append(f"{name}: {int(calls)} calls, avg {wall / calls * 1000:.1f}ms, {share:.0f}% on loop")
+    return lines
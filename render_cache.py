@@ -0,0 +1,44 @@
+# render_cache.py
+from collections import OrderedDict
+from typing import Callable, Hashable, Tuple
+
+class RenderCache:
+    """LRU of rendered (text, reply_markup) pairs
+
+    Keys are tuples whose leading items name the data the page was built
+    from, e.g. (category, subcategory, page), so a change can drop just the
+    pages it affects with invalidate(category, subcategory).
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Tuple, tuple]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: Tuple, render: Callable[[], tuple]) -> tuple:
+        """Cached page for key, rendering it on a miss"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = render()
+        self._entries[key] = entry
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, *prefix: Hashable):
+        """Drop every page whose key starts with prefix (everything if empty)"""
+        if not prefix:
+            self._entries.clear()
+            return
+        size = len(prefix)
+        for key in [k for k in self._entries if k[:size] == prefix]:
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
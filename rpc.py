@@ -0,0 +1,124 @@
+# rpc.py
+import asyncio
+import itertools
+import logging
+import time
+from typing import TYPE_CHECKING, Any, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    import aiohttp
+
+from metrics import RPC_ERRORS, RPC_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# aiohttp is imported on first request to keep it off the startup path
+DEFAULT_TIMEOUT_S = 30
+
+class RpcError(Exception):
+    """JSON-RPC error returned by a node"""
+
+    def __init__(self, method: str, error: dict):
+        self.method = method
+        self.code = error.get('code')
+        super().__init__(f"{method}: {error.get('message', error)}")
+
+class RequestPacer:
+    """Spaces out request starts to stay within a requests-per-second budget"""
+
+    def __init__(self, per_second: float):
+        self.spacing = 1.0 / per_second if per_second > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        at = max(now, self._next)
+        self._next = at + self.spacing
+        if at > now:
+            await asyncio.sleep(at - now)
+
+class RpcClient:
+    """Minimal async JSON-RPC client that keeps one session and supports batches"""
+
+    def __init__(self, url: str, session: Optional['aiohttp.ClientSession'] = None, chain: str = ''):
+        self.url = url
+        # Metrics label; the URL would leak API keys
+        self.chain = chain
+        self._session = session
+        self._owns_session = session is None
+        self._ids = itertools.count(1)
+
+    async def _get_session(self) -> 'aiohttp.ClientSession':
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT_S))
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session and not self._session.closed:
+            await self._session.close()
+
+    async def call(self, method: str, params: Sequence = ()) -> Any:
+        """Single request; raises RpcError on a node error"""
+        session = await self._get_session()
+        payload = {"jsonrpc": "2.0", "method": method, "params": list(params), "id": next(self._ids)}
+        started = time.perf_counter()
+        try:
+            async with session.post(self.url, json=payload) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+        except Exception:
+            RPC_ERRORS.labels(self.chain, method).inc()
+            raise
+        finally:
+            RPC_LATENCY.labels(self.chain, method).observe(time.perf_counter() - started)
+        if 'error' in data:
+            RPC_ERRORS.labels(self.chain, method).inc()
+            raise RpcError(method, data['error'])
+        return data.get('result')
+
+    async def batch(self, calls: Sequence[Tuple[str, Sequence]]) -> List[Any]:
+        """Send several requests in one HTTP round trip, results in call order
+
+        A failed entry comes back as an RpcError instance rather than raising,
+        so one bad call doesn't sink the rest of the batch.
+        """
+        if not calls:
+            return []
+
+        session = await self._get_session()
+        first_id = next(self._ids)
+        payload = []
+        for offset, (method, params) in enumerate(calls):
+            payload.append({"jsonrpc": "2.0", "method": method, "params": list(params), "id": first_id + offset})
+        # Reserve the ids used by this batch
+        self._ids = itertools.count(first_id + len(calls))
+
+        started = time.perf_counter()
+        try:
+            async with session.post(self.url, json=payload) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+        except Exception:
+            RPC_ERRORS.labels(self.chain, 'batch').inc()
+            raise
+        finally:
+            RPC_LATENCY.labels(self.chain, 'batch').observe(time.perf_counter() - started)
+
+        if isinstance(data, dict):
+            # Some nodes answer a whole rejected batch with a single error object
+            RPC_ERRORS.labels(self.chain, 'batch').inc()
+            raise RpcError('batch', data.get('error', data))
+
+        results: List[Any] = [None] * len(calls)
+        for item in data:
+            index = item.get('id', 0) - first_id
+            if not 0 <= index < len(calls):
+                continue
+            if 'error' in item:
+                RPC_ERRORS.labels(self.chain, calls[index][0]).inc()
+                results[index] = RpcError(calls[index][0], item['error'])
+            else:
+                results[index] = item.get('result')
+        return results
@@ -0,0 +1,338 @@
+# search.py
+"""
+In-memory full-text search over airdrops
+
+An inverted index maps each word of an airdrop's name, description and
+category to the airdrops containing it, with a field weight (name words
+count more). The vocabulary is kept sorted so query words also match as
+prefixes ("zk" finds "zksync") with one bisect. Database change events keep
+it current without rebuilding, and recent query results are cached until
+the next change.
+"""
+
+import asyncio
+import bisect
+import heapq
+import logging
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+FIELD_WEIGHTS = (
+    ('name', 3.0),
+    ('category', 1.0),
+    ('subcategory', 1.0),
+    ('description', 1.0),
+)
+# An exact word match beats a prefix match of the same word
+PREFIX_FACTOR = 0.5
+# Shorter query words only match whole words; "a" would expand to half the vocabulary
+MIN_PREFIX_LENGTH = 2
+# Vocabulary words a single prefix may expand to
+MAX_PREFIX_TERMS = 256
+MAX_QUERY_WORDS = 8
+MAX_RESULTS = 50
+RESULT_CACHE_SIZE = 1024
+# Matches of the rarest query word below which scoring them all is cheapest
+SCORE_ALL_BELOW = 500
+# Score level combinations tried before falling back to scoring everything
+MAX_LEVEL_COMBINATIONS = 200
+# Imported airdrops indexed per turn of the event loop
+INDEX_CHUNK_SIZE = 1000
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words of a text; '_' and punctuation split words"""
+    return WORD_RE.findall(text.lower()) if text else []
+
+class SearchIndex:
+    """Inverted index of airdrops, ranked by field weight and word rarity"""
+
+    def __init__(self, result_cache_size: int = RESULT_CACHE_SIZE):
+        # word -> {airdrop id: weight}
+        self._postings: Dict[str, Dict[int, float]] = {}
+        # Every indexed word, sorted for prefix lookups
+        self._terms: List[str] = []
+        # airdrop id -> its words, so an update or delete can unindex it
+        self._doc_terms: Dict[int, Tuple[str, ...]] = {}
+        # word -> weight -> (ascending airdrop ids, the same ids as a set);
+        # built the first time a query needs the word, then kept current
+        self._levels: Dict[str, Dict[float, Tuple[List[int], Set[int]]]] = {}
+        self._cache: 'OrderedDict[Tuple, List[int]]' = OrderedDict()
+        self.result_cache_size = result_cache_size
+        self._db = None
+        self._rebuild_lock = threading.Lock()
+        self._index_tasks: Set[asyncio.Task] = set()
+        self.stats = {
+            'queries': 0,
+            'cache_hits': 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    # Indexing
+    @staticmethod
+    def _weights(airdrop: Dict) -> Dict[str, float]:
+        weights: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS:
+            # A word counts once per field, so repeating it in a description doesn't pay
+            for word in set(tokenize(airdrop.get(field, ''))):
+                weights[word] = weights.get(word, 0.0) + weight
+        return weights
+
+    def add(self, airdrop: Dict, new_terms: Optional[List[str]] = None):
+        """Index an airdrop (replacing an older version of it)
+
+        Words new to the index go into new_terms, if given, for the caller
+        to merge into the sorted vocabulary in one go (see add_many).
+        """
+        airdrop_id = airdrop['id']
+        if airdrop_id in self._doc_terms:
+            self._unindex(airdrop_id)
+        weights = self._weights(airdrop)
+        for word, weight in weights.items():
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = {}
+                if new_terms is None:
+                    bisect.insort(self._terms, word)
+                else:
+                    new_terms.append(word)
+            postings[airdrop_id] = weight
+            levels = self._levels.get(word)
+            if levels is not None:
+                ids, id_set = levels.setdefault(weight, ([], set()))
+                # New airdrops have the highest id, so this is almost always an append
+                if not ids or ids[-1] < airdrop_id:
+                    ids.append(airdrop_id)
+                else:
+                    bisect.insort(ids, airdrop_id)
+                id_set.add(airdrop_id)
+        self._doc_terms[airdrop_id] = tuple(weights)
+        self._cache.clear()
+
+    def add_many(self, airdrops: Iterable[Dict]):
+        """Index a batch of airdrops, sorting the vocabulary once instead of per new word"""
+        new_terms: List[str] = []
+        for airdrop in airdrops:
+            self.add(airdrop, new_terms)
+        if new_terms:
+            self._terms = sorted(self._terms + new_terms)
+
+    def remove(self, airdrop_id: int):
+        if airdrop_id in self._doc_terms:
+            self._unindex(airdrop_id)
+            self._cache.clear()
+
+    def _unindex(self, airdrop_id: int):
+        for word in self._doc_terms.pop(airdrop_id):
+            postings = self._postings[word]
+            weight = postings.pop(airdrop_id)
+            levels = self._levels.get(word)
+            if levels is not None:
+                ids, id_set = levels[weight]
+                del ids[bisect.bisect_left(ids, airdrop_id)]
+                id_set.discard(airdrop_id)
+                if not ids:
+                    del levels[weight]
+            if not postings:
+                del self._postings[word]
+                self._levels.pop(word, None)
+                del self._terms[bisect.bisect_left(self._terms, word)]
+
+    def rebuild(self, airdrops: Iterable[Dict]):
+        """Replace the whole index; built aside and swapped in, so queries never see it half done"""
+        fresh = SearchIndex(self.result_cache_size)
+        for airdrop in airdrops:
+            weights = fresh._weights(airdrop)
+            for word, weight in weights.items():
+                fresh._postings.setdefault(word, {})[airdrop['id']] = weight
+            fresh._doc_terms[airdrop['id']] = tuple(weights)
+        fresh._terms = sorted(fresh._postings)
+        self._postings, self._terms, self._doc_terms = fresh._postings, fresh._terms, fresh._doc_terms
+        self._levels = {}
+        self._cache = OrderedDict()
+
+    # Keeping up with the Database
+    def attach(self, db):
+        """Follow a Database's airdrop changes"""
+        self._db = db
+        db.subscribe(self.on_change)
+
+    def on_change(self, event: str, airdrop, previous=None):
+        if event == 'reloaded':
+            with self._rebuild_lock:
+                self.rebuild(self._db.get_all_airdrops())
+            logger.info(f"Search index built: {len(self)} airdrops, {len(self._terms)} words")
+        elif event == 'airdrops_imported':
+            self._add_imported(airdrop)
+        elif event in ('airdrop_added', 'airdrop_updated'):
+            self.add(airdrop)
+        elif event == 'airdrop_deleted':
+            self.remove(airdrop['id'])
+
+    def _add_imported(self, airdrops: List[Dict]):
+        """Index an import; a large one a chunk at a time between other updates when a loop runs"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or len(airdrops) <= INDEX_CHUNK_SIZE:
+            self.add_many(airdrops)
+            return
+        task = loop.create_task(self._add_in_chunks(airdrops))
+        self._index_tasks.add(task)
+        task.add_done_callback(self._index_tasks.discard)
+
+    async def _add_in_chunks(self, airdrops: List[Dict]):
+        for start in range(0, len(airdrops), INDEX_CHUNK_SIZE):
+            if start:
+                await asyncio.sleep(0)
+            # Deleted while waiting its turn
+            chunk = [airdrop for airdrop in airdrops[start:start + INDEX_CHUNK_SIZE]
+                     if self._db is None or self._db.get_airdrop(airdrop['id']) is not None]
+            self.add_many(chunk)
+
+    # Querying
+    def _expand(self, word: str, total: int) -> Dict[str, float]:
+        """Vocabulary words a query word matches -> score per unit of field weight"""
+        if len(word) < MIN_PREFIX_LENGTH:
+            terms = [word] if word in self._postings else []
+        else:
+            start = bisect.bisect_left(self._terms, word)
+            end = bisect.bisect_left(self._terms, word + '\x7f', start,
+                                     min(len(self._terms), start + MAX_PREFIX_TERMS))
+            terms = self._terms[start:end]
+        # Rare words say more about a match than common ones
+        return {
+            term: math.log(1 + total / len(self._postings[term])) * (1.0 if term == word else PREFIX_FACTOR)
+            for term in terms
+        }
+
+    def _word_score(self, airdrop_id: int, expansion: Dict[str, float]) -> float:
+        """How well one airdrop matches one query word (0 if it doesn't)"""
+        best = 0.0
+        for term in self._doc_terms[airdrop_id]:
+            unit = expansion.get(term)
+            if unit is not None:
+                score = self._postings[term][airdrop_id] * unit
+                if score > best:
+                    best = score
+        return best
+
+    def _word_levels(self, expansion: Dict[str, float]) -> List[Tuple[float, List[int], Set[int]]]:
+        """(score, ascending ids, id set) groups of the airdrops matching one query word, best first"""
+        levels = []
+        for term, unit in expansion.items():
+            term_levels = self._levels.get(term)
+            if term_levels is None:
+                grouped: Dict[float, List[int]] = {}
+                for airdrop_id, weight in self._postings[term].items():
+                    grouped.setdefault(weight, []).append(airdrop_id)
+                term_levels = self._levels[term] = {
+                    weight: (sorted(ids), set(ids)) for weight, ids in grouped.items()
+                }
+            levels.extend((weight * unit, ids, id_set) for weight, (ids, id_set) in term_levels.items())
+        levels.sort(key=lambda level: level[0], reverse=True)
+        return levels
+
+    def _score_all(self, expansions: List[Dict[str, float]], limit: int) -> List[int]:
+        """Score every airdrop matching the rarest word and keep the best"""
+        candidates: Dict[int, float] = {}
+        for term, unit in expansions[0].items():
+            for airdrop_id, weight in self._postings[term].items():
+                score = weight * unit
+                if score > candidates.get(airdrop_id, 0.0):
+                    candidates[airdrop_id] = score
+        scored = []
+        for airdrop_id, score in candidates.items():
+            for expansion in expansions[1:]:
+                word_score = self._word_score(airdrop_id, expansion)
+                if not word_score:
+                    break
+                score += word_score
+            else:
+                scored.append((score, airdrop_id))
+        # Ties go to the newer airdrop
+        return [airdrop_id for _, airdrop_id in heapq.nlargest(limit, scored)]
+
+    def _best_levels_first(self, expansions: List[Dict[str, float]], limit: int) -> Optional[List[int]]:
+        """Top matches found by visiting score levels in descending total score
+
+        Field weights take few distinct values, so each word's matches fall
+        into a handful of score levels. Combinations of one level per word
+        are visited best total first. An airdrop in every level of a
+        combination scores exactly that total the first time it shows up,
+        so the first `limit` found are the answer, and a common word doesn't
+        mean scoring everything that contains it. None if the matches are
+        too sparse to find that way.
+        """
+        levels = [self._word_levels(expansion) for expansion in expansions]
+        start = (0,) * len(levels)
+        heap = [(-sum(word_levels[0][0] for word_levels in levels), start)]
+        queued = {start}
+        seen = set()
+        results: List[int] = []
+        for _ in range(MAX_LEVEL_COMBINATIONS):
+            if not heap:
+                return results
+            negative_total, position = heapq.heappop(heap)
+            combination = sorted((levels[word][index] for word, index in enumerate(position)),
+                                 key=lambda level: len(level[1]))
+            shortest = combination[0][1]
+            common = combination[0][2].intersection(*(level[2] for level in combination[1:]))
+            if common:
+                # Newest first within a level
+                for airdrop_id in reversed(shortest):
+                    if airdrop_id in common and airdrop_id not in seen:
+                        seen.add(airdrop_id)
+                        results.append(airdrop_id)
+                        if len(results) == limit:
+                            return results
+            for word, index in enumerate(position):
+                if index + 1 < len(levels[word]):
+                    following = position[:word] + (index + 1,) + position[word + 1:]
+                    if following not in queued:
+                        queued.add(following)
+                        step = levels[word][index][0] - levels[word][index + 1][0]
+                        heapq.heappush(heap, (negative_total + step, following))
+        return None
+
+    def search(self, query: str, limit: int = 10) -> List[int]:
+        """Ids of the best matches for every word of the query, best first"""
+        words = tuple(dict.fromkeys(tokenize(query)))[:MAX_QUERY_WORDS]
+        if not words:
+            return []
+        limit = min(limit, MAX_RESULTS)
+        self.stats['queries'] += 1
+        key = (words, limit)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.stats['cache_hits'] += 1
+            return cached
+
+        total = len(self._doc_terms)
+        expansions = [self._expand(word, total) for word in words]
+        results: Optional[List[int]] = []
+        if all(expansions):
+            # Rarest word first: it bounds the candidates
+            matches = [(sum(len(self._postings[term]) for term in expansion), expansion) for expansion in expansions]
+            matches.sort(key=lambda item: item[0])
+            expansions = [expansion for _, expansion in matches]
+            results = None
+            if matches[0][0] >= SCORE_ALL_BELOW:
+                results = self._best_levels_first(expansions, limit)
+            if results is None:
+                results = self._score_all(expansions, limit)
+
+        self._cache[key] = results
+        if len(self._cache) > self.result_cache_size:
+            self._cache.popitem(last=False)
+        return results
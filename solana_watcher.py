@@ -0,0 +1,200 @@
+# solana_watcher.py
+import asyncio
+import logging
+import math
+import os
+import time
+from array import array
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from address_index import AddressIndex, base58_encode
+from log_pipeline import HotPathLogger
+from rpc import RequestPacer, RpcClient
+
+logger = logging.getLogger(__name__)
+# Per-activity errors come in bursts when Telegram or a node has trouble
+hot_log = HotPathLogger(logger)
+
+# getMultipleAccounts accepts at most 100 keys per call
+SOLANA_BATCH_SIZE = 100
+
+# Watcher settings
+SOLANA_WATCHER_ENABLED = os.getenv('SOLANA_WATCHER_ENABLED', '').lower() in ('1', 'true', 'yes')
+SOLANA_RPC_BUDGET = float(os.getenv('SOLANA_RPC_BUDGET', '5'))  # requests per second
+SOLANA_CONCURRENCY = int(os.getenv('SOLANA_CONCURRENCY', '4'))
+SOLANA_MIN_INTERVAL = float(os.getenv('SOLANA_MIN_INTERVAL', '10'))
+
+LAMPORTS_PER_SOL = 10**9
+
+# Marks a slot whose balance hasn't been read yet
+UNSEEN = -1
+
+OnActivity = Callable[[int, dict], Awaitable[None]]
+
+async def fetch_lamports(rpc: RpcClient, addresses: Sequence[str],
+                         concurrency: int = SOLANA_CONCURRENCY,
+                         pacer: Optional[RequestPacer] = None) -> List[Optional[int]]:
+    """Lamport balances for many addresses via batched getMultipleAccounts
+
+    Batches of 100 are pipelined with at most `concurrency` in flight, and
+    with a `pacer` their starts are spaced to its budget. A missing account
+    reads as 0; a failed batch yields None for its entries.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results: List[Optional[int]] = [None] * len(addresses)
+
+    async def fetch(start: int):
+        chunk = list(addresses[start:start + SOLANA_BATCH_SIZE])
+        async with semaphore:
+            if pacer:
+                await pacer.wait()
+            try:
+                response = await rpc.call('getMultipleAccounts', [chunk, {
+                    'encoding': 'base64',
+                    'commitment': 'confirmed',
+                    # Only lamports are needed, skip the account data
+                    'dataSlice': {'offset': 0, 'length': 0},
+                }])
+            except Exception as e:
+                logger.error(f"getMultipleAccounts failed for batch at {start}: {e}")
+                return
+        for offset, account in enumerate((response or {}).get('value') or []):
+            results[start + offset] = account['lamports'] if account else 0
+
+    await asyncio.gather(*(fetch(start) for start in range(0, len(addresses), SOLANA_BATCH_SIZE)))
+    return results
+
+class SolanaWatcher:
+    """Polls every watched Solana address and reports lamport balance changes
+
+    Last-seen balances live in one int64 array addressed through a key->slot
+    dict, so the table costs a dict entry plus 8 bytes per address.
+    """
+
+    def __init__(self, rpc_url: str, index: AddressIndex, on_activity: OnActivity,
+                 rpc_budget: float = SOLANA_RPC_BUDGET,
+                 concurrency: int = SOLANA_CONCURRENCY,
+                 min_interval: float = SOLANA_MIN_INTERVAL):
+        self.index = index
+        self.on_activity = on_activity
+        self.rpc_budget = rpc_budget
+        self.concurrency = concurrency
+        self.min_interval = min_interval
+        self.rpc = RpcClient(rpc_url, chain='solana')
+        # Spaces batches within a round; `interval` spaces the rounds
+        self.pacer = RequestPacer(rpc_budget)
+
+        self._version = -1
+        self._slots: Dict[bytes, int] = {}
+        self._addresses: List[str] = []
+        self._keys: List[bytes] = []
+        self._lamports = array('q')
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats = {
+            'rounds': 0,
+            'requests': 0,
+            'changes': 0,
+            'last_round_s': 0.0,
+        }
+
+    def _refresh_table(self):
+        """Rebuild the last-seen table after the index changed, keeping known balances"""
+        if self._version == self.index.version:
+            return
+
+        keys = [key for key in self.index.keys() if len(key) == 32]
+        lamports = array('q', [UNSEEN]) * len(keys)
+        slots = {}
+        for slot, key in enumerate(keys):
+            slots[key] = slot
+            previous = self._slots.get(key)
+            if previous is not None:
+                lamports[slot] = self._lamports[previous]
+
+        self._keys = keys
+        self._slots = slots
+        self._lamports = lamports
+        self._addresses = [base58_encode(key) for key in keys]
+        self._version = self.index.version
+
+    @property
+    def interval(self) -> float:
+        """Seconds between rounds so a full sweep stays within the RPC budget"""
+        requests = math.ceil(len(self._keys) / SOLANA_BATCH_SIZE)
+        return max(self.min_interval, requests / self.rpc_budget)
+
+    async def poll_once(self) -> int:
+        """Read every watched balance once; returns how many changed"""
+        self._refresh_table()
+        if not self._keys:
+            return 0
+
+        started = time.perf_counter()
+        addresses = self._addresses
+        balances = await fetch_lamports(self.rpc, addresses, self.concurrency, self.pacer)
+        self.stats['requests'] += math.ceil(len(addresses) / SOLANA_BATCH_SIZE)
+
+        changes = []
+        lamports = self._lamports
+        for slot, current in enumerate(balances):
+            if current is None:
+                continue
+            previous = lamports[slot]
+            lamports[slot] = current
+            if previous != UNSEEN and previous != current:
+                changes.append((slot, previous, current))
+
+        for slot, previous, current in changes:
+            delta = current - previous
+            activity = {
+                'direction': 'received' if delta > 0 else 'sent',
+                'value': abs(delta) / LAMPORTS_PER_SOL,
+                'asset': 'SOL',
+                'hash': '',
+                'counterparty': '',
+                'account': addresses[slot],
+                'balance': current / LAMPORTS_PER_SOL,
+                'network': 'SOLANA_MAINNET',
+            }
+            for user_id in self.index.owners_by_key(self._keys[slot]):
+                try:
+                    await self.on_activity(user_id, activity)
+                except Exception as e:
+                    hot_log.error("Error delivering Solana activity to %s: %s", user_id, e)
+
+        self.stats['rounds'] += 1
+        self.stats['changes'] += len(changes)
+        self.stats['last_round_s'] = round(time.perf_counter() - started, 3)
+        return len(changes)
+
+    async def run(self):
+        """Poll until stopped, pacing rounds to the RPC budget"""
+        self._running = True
+        logger.info("Solana watcher started")
+        while self._running:
+            started = time.monotonic()
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Solana watcher error: {e}")
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def start(self) -> asyncio.Task:
+        """Run the watcher as a background task"""
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.rpc.close()
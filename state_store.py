@@ -0,0 +1,416 @@
+# state_store.py
+"""
+Conversation state kept outside the process
+
+Handlers keep using context.user_data; StateContext swaps PTB's in-memory
+dict for a UserState loaded from a StateStore on the user's first update.
+Only states changed by a handler are written back, idle ones are evicted
+from memory and purged from the store after a TTL.
+
+The store is never touched on the event loop: load_user_state reads a
+user's state in a worker thread before their update's handlers run, and
+changed states are queued and written in batches, one transaction each,
+on the same single thread, so a load always sees the writes queued
+before it.
+"""
+
+import abc
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+from telegram.ext import CallbackContext, ExtBot
+
+logger = logging.getLogger(__name__)
+
+# Store settings: 'sqlite' (STATE_DB_PATH, survives restarts and is shared
+# by cluster workers) or 'memory' (this process only, lost on restart)
+STATE_STORE = os.getenv('STATE_STORE', 'sqlite').lower()
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'conversation_state.db')
+STATE_TTL = int(os.getenv('CONVERSATION_STATE_TTL', '3600'))  # seconds idle before a flow is dropped
+STATE_CACHE_SIZE = int(os.getenv('CONVERSATION_STATE_CACHE_SIZE', '10000'))
+STATE_EVICT_INTERVAL = 60
+# How long changed states are collected before one batched write
+STATE_WRITE_DELAY = float(os.getenv('CONVERSATION_STATE_WRITE_DELAY', '0.05'))
+# Wait before writing a batch again after the store failed it
+STATE_RETRY_DELAY = 1.0
+
+class UserState(dict):
+    """user_data dict that remembers whether it was changed since the last flush"""
+
+    __slots__ = ('dirty',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dirty = False
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.dirty = True
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.dirty = True
+
+    def clear(self):
+        if self:
+            self.dirty = True
+        super().clear()
+
+    def pop(self, key, *default):
+        if key in self:
+            self.dirty = True
+        return super().pop(key, *default)
+
+    def popitem(self):
+        self.dirty = True
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.dirty = True
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.dirty = True
+
+class StateStore(abc.ABC):
+    """Where conversation state lives between updates and restarts"""
+
+    @abc.abstractmethod
+    def load(self, user_id: int) -> Optional[Dict]:
+        ...
+
+    @abc.abstractmethod
+    def save(self, user_id: int, state: Dict):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, user_id: int):
+        ...
+
+    @abc.abstractmethod
+    def purge(self, older_than: float) -> int:
+        """Drop states last written before the given timestamp; returns how many"""
+
+    def write_batch(self, changes: Dict[int, Optional[Dict]]):
+        """Save several users' states at once; None deletes the user's state"""
+        for user_id, state in changes.items():
+            if state:
+                self.save(user_id, state)
+            else:
+                self.delete(user_id)
+
+    def close(self):
+        pass
+
+class MemoryStateStore(StateStore):
+    """Process-local store, for tests and single-instance setups that don't need restarts"""
+
+    def __init__(self):
+        self._rows: Dict[int, tuple] = {}
+
+    def load(self, user_id: int) -> Optional[Dict]:
+        row = self._rows.get(user_id)
+        return json.loads(row[0]) if row else None
+
+    def save(self, user_id: int, state: Dict):
+        self._rows[user_id] = (json.dumps(state), time.time())
+
+    def delete(self, user_id: int):
+        self._rows.pop(user_id, None)
+
+    def purge(self, older_than: float) -> int:
+        stale = [user_id for user_id, (_, updated) in self._rows.items() if updated < older_than]
+        for user_id in stale:
+            del self._rows[user_id]
+        return len(stale)
+
+class SqliteStateStore(StateStore):
+    """SQLite table of JSON states; WAL mode lets several bot processes share the file"""
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS conversation_state ('
+            ' user_id INTEGER PRIMARY KEY,'
+            ' data TEXT NOT NULL,'
+            ' updated_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS conversation_state_updated ON conversation_state (updated_at)'
+        )
+
+    def load(self, user_id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data FROM conversation_state WHERE user_id = ?', (user_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, user_id: int, state: Dict):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO conversation_state (user_id, data, updated_at) VALUES (?, ?, ?)'
+                ' ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at',
+                (user_id, json.dumps(state), time.time())
+            )
+
+    def delete(self, user_id: int):
+        with self._lock:
+            self._conn.execute('DELETE FROM conversation_state WHERE user_id = ?', (user_id,))
+
+    def write_batch(self, changes: Dict[int, Optional[Dict]]):
+        now = time.time()
+        saved = [(user_id, json.dumps(state), now) for user_id, state in changes.items() if state]
+        deleted = [(user_id,) for user_id, state in changes.items() if not state]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(
+                    'INSERT INTO conversation_state (user_id, data, updated_at) VALUES (?, ?, ?)'
+                    ' ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at',
+                    saved
+                )
+                self._conn.executemany('DELETE FROM conversation_state WHERE user_id = ?', deleted)
+                # A failed COMMIT (SQLITE_BUSY past the timeout) leaves the
+                # transaction open; roll it back too
+                self._conn.execute('COMMIT')
+            except BaseException:
+                if self._conn.in_transaction:
+                    self._conn.execute('ROLLBACK')
+                raise
+
+    def purge(self, older_than: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM conversation_state WHERE updated_at < ?', (older_than,))
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ConversationStates:
+    """Bounded LRU of loaded UserStates in front of a StateStore"""
+
+    def __init__(self, store: StateStore, ttl: float = STATE_TTL, max_entries: int = STATE_CACHE_SIZE,
+                 write_delay: float = STATE_WRITE_DELAY):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.write_delay = write_delay
+        # user_id -> (state, last access)
+        self._cache: 'OrderedDict[int, tuple]' = OrderedDict()
+        # Changed states not handed to the store yet, copied at flush time
+        # (None for a cleared state)
+        self._pending: Dict[int, Optional[Dict]] = {}
+        self._write_handle: Optional[asyncio.TimerHandle] = None
+        # Every store call runs here, in order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state-store')
+
+        self.stats = {
+            'loads': 0,
+            'blocking_loads': 0,
+            'writes': 0,
+            'batches': 0,
+            'write_errors': 0,
+            'evicted': 0,
+            'purged': 0,
+        }
+
+    def _cache_state(self, user_id: int, stored: Optional[Dict]) -> UserState:
+        state = UserState(stored or {})
+        self.stats['loads'] += 1
+        self._cache[user_id] = (state, time.monotonic())
+        if len(self._cache) > self.max_entries:
+            self._evict(next(iter(self._cache)))
+        return state
+
+    def _stored(self, user_id: int):
+        """(found, state) for a user whose state is still waiting to be written"""
+        if user_id in self._pending:
+            pending = self._pending[user_id]
+            return True, json.loads(json.dumps(pending)) if pending else None
+        return False, None
+
+    async def load(self, user_id: int):
+        """Bring a user's state into memory without blocking the loop"""
+        if user_id in self._cache:
+            return
+        found, stored = self._stored(user_id)
+        if not found:
+            loop = asyncio.get_running_loop()
+            stored = await loop.run_in_executor(self._executor, self.store.load, user_id)
+            # Loaded meanwhile by a handler that couldn't wait
+            if user_id in self._cache:
+                return
+        self._cache_state(user_id, stored)
+
+    def get(self, user_id: int) -> UserState:
+        """The user's state; load_user_state has normally brought it in already"""
+        entry = self._cache.get(user_id)
+        if entry is not None:
+            self._cache.move_to_end(user_id)
+            self._cache[user_id] = (entry[0], time.monotonic())
+            return entry[0]
+        found, stored = self._stored(user_id)
+        if not found:
+            # Outside an update (a job, a script); still ordered after queued writes
+            self.stats['blocking_loads'] += 1
+            stored = self._executor.submit(self.store.load, user_id).result()
+        return self._cache_state(user_id, stored)
+
+    def flush_user(self, user_id: int):
+        """Queue one user's state for writing if a handler changed it"""
+        entry = self._cache.get(user_id)
+        if entry is None or not entry[0].dirty:
+            return
+        state = entry[0]
+        # A finished flow clears user_data; nothing worth keeping
+        self._pending[user_id] = json.loads(json.dumps(state)) if state else None
+        state.dirty = False
+        self.stats['writes'] += 1
+        self._schedule_write()
+
+    def flush(self, user_ids: Optional[Iterable[int]] = None):
+        """Queue every dirty state (or just the given users')"""
+        for user_id in list(self._cache if user_ids is None else user_ids):
+            try:
+                self.flush_user(user_id)
+            except Exception as e:
+                logger.error(f"Error saving conversation state for {user_id}: {e}")
+
+    def _schedule_write(self, delay: Optional[float] = None):
+        if self._write_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop to defer to
+            self._write(self._take_pending())
+            return
+        self._write_handle = loop.call_later(self.write_delay if delay is None else delay, self._submit_write)
+
+    def _take_pending(self) -> Dict[int, Optional[Dict]]:
+        if self._write_handle is not None:
+            self._write_handle.cancel()
+            self._write_handle = None
+        batch, self._pending = self._pending, {}
+        return batch
+
+    def _write(self, batch: Dict[int, Optional[Dict]]):
+        if not batch:
+            return
+        self.stats['batches'] += 1
+        self.store.write_batch(batch)
+
+    def _submit_write(self) -> 'asyncio.Future':
+        """Hand the queued states to the store thread as one batch"""
+        batch = self._take_pending()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._write, batch)
+
+        def done(future):
+            if future.cancelled() or not future.exception():
+                return
+            self.stats['write_errors'] += 1
+            logger.error(f"Error saving {len(batch)} conversation states: {future.exception()}")
+            # Retried unless the user has changed since, with the next batch
+            # if one is already due
+            for user_id, state in batch.items():
+                self._pending.setdefault(user_id, state)
+            self._schedule_write(STATE_RETRY_DELAY)
+
+        future.add_done_callback(done)
+        return future
+
+    async def drain(self):
+        """Write everything queued so far and wait for it"""
+        await self._submit_write()
+
+    def _evict(self, user_id: int):
+        self.flush_user(user_id)
+        del self._cache[user_id]
+        self.stats['evicted'] += 1
+
+    def evict_idle(self) -> int:
+        """Drop states idle longer than the TTL from memory, and unchanged that long from the store"""
+        cutoff = time.monotonic() - self.ttl
+        idle = [user_id for user_id, (_, last_access) in self._cache.items() if last_access < cutoff]
+        for user_id in idle:
+            # Dropped without writing back: an abandoned flow is exactly what expires
+            del self._cache[user_id]
+        self.stats['evicted'] += len(idle)
+        return len(idle)
+
+    async def purge(self) -> int:
+        """Delete states unchanged for the TTL from the store"""
+        loop = asyncio.get_running_loop()
+        purged = await loop.run_in_executor(self._executor, self.store.purge, time.time() - self.ttl)
+        self.stats['purged'] += purged
+        return purged
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+def create_state_store(kind: str = STATE_STORE, path: str = STATE_DB_PATH) -> StateStore:
+    """The StateStore named by kind, 'sqlite' (at path) or 'memory'"""
+    if kind == 'sqlite':
+        return SqliteStateStore(path)
+    if kind == 'memory':
+        return MemoryStateStore()
+    raise ValueError(f"Unknown STATE_STORE '{kind}', expected 'sqlite' or 'memory'")
+
+conversation_states: Optional[ConversationStates] = None
+
+def get_conversation_states() -> ConversationStates:
+    """Shared ConversationStates over the configured store, created on first use"""
+    global conversation_states
+    if conversation_states is None:
+        conversation_states = ConversationStates(create_state_store())
+    return conversation_states
+
+class StateContext(CallbackContext[ExtBot, UserState, dict, dict]):
+    """CallbackContext whose user_data comes from the conversation state store"""
+
+    @property
+    def user_data(self) -> Optional[UserState]:
+        if self._user_id is None:
+            return None
+        return get_conversation_states().get(self._user_id)
+
+async def load_user_state(update, context: StateContext):
+    """First handler group: read the user's state off the loop before anything uses it"""
+    if update.effective_user:
+        await get_conversation_states().load(update.effective_user.id)
+
+async def flush_user_state(update, context: StateContext):
+    """Last handler group: queue what this update's handlers changed for writing"""
+    if update.effective_user:
+        get_conversation_states().flush_user(update.effective_user.id)
+
+async def run_state_evictor(interval: float = STATE_EVICT_INTERVAL):
+    """Expire abandoned flows and write back stragglers until cancelled"""
+    states = get_conversation_states()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # Handlers that raised skip flush_user_state; catch their changes here
+            states.flush()
+            evicted = states.evict_idle()
+            await states.purge()
+            if evicted:
+                logger.info(f"Evicted {evicted} idle conversation states ({len(states)} cached)")
+        except Exception as e:
+            logger.error(f"Conversation state eviction error: {e}")
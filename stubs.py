@@ -0,0 +1,475 @@
+# stubs.py
+"""
+Local stand-ins for the external services the bot talks to
+
+They run on 127.0.0.1 inside the current event loop so watchers and bench
+scripts can be exercised without network access:
+
+    node = FakeEvmNode()
+    await node.start()
+    watcher = ChainWatcher('eth', node.url, ...)
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from chain_watcher import TRANSFER_TOPIC, bloom_bits
+
+logger = logging.getLogger(__name__)
+
+class StubServer:
+    """aiohttp server on an ephemeral localhost port"""
+
+    def __init__(self):
+        self.app = web.Application()
+        self.requests = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ''
+
+    async def start(self, port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', port)
+        await site.start()
+        bound = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{bound}"
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+class JsonRpcServer(StubServer):
+    """Dispatches JSON-RPC (single or batch) to rpc_<method> handlers"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls: Dict[str, int] = {}
+        self.app.router.add_post('/', self._handle)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        payload = await request.json()
+        if isinstance(payload, list):
+            return web.json_response([self._dispatch(item) for item in payload])
+        return web.json_response(self._dispatch(payload))
+
+    def _dispatch(self, item: dict) -> dict:
+        method = item.get('method', '')
+        self.calls[method] = self.calls.get(method, 0) + 1
+        handler = getattr(self, f"rpc_{method}", None)
+        if handler is None:
+            return {'jsonrpc': '2.0', 'id': item.get('id'),
+                    'error': {'code': -32601, 'message': f'Method {method} not found'}}
+        try:
+            return {'jsonrpc': '2.0', 'id': item.get('id'), 'result': handler(*item.get('params', []))}
+        except Exception as e:
+            return {'jsonrpc': '2.0', 'id': item.get('id'), 'error': {'code': -32000, 'message': str(e)}}
+
+def _bloom_hex(values: List[bytes]) -> str:
+    bloom = 0
+    for value in values:
+        for bit in bloom_bits(value):
+            bloom |= 1 << bit
+    return '0x' + bloom.to_bytes(256, 'big').hex()
+
+def _topic(address: str) -> str:
+    return '0x' + '0' * 24 + address[2:].lower()
+
+class FakeEvmNode(JsonRpcServer):
+    """In-memory EVM chain: queue transfers, mine blocks, serve the usual read methods"""
+
+    def __init__(self, start_block: int = 1_000_000, block_receipts: bool = True):
+        super().__init__()
+        self.blocks: List[dict] = []
+        self.receipts: Dict[str, dict] = {}
+        self.balances: Dict[str, int] = {}
+        self.tokens: Dict[str, tuple] = {}
+        self.base_fee = 20 * 10**9
+        self.start_block = start_block
+        self._pending_txs: List[dict] = []
+        self._pending_logs: Dict[str, List[dict]] = {}
+        self._tx_counter = 0
+        if not block_receipts:
+            self.rpc_eth_getBlockReceipts = None
+
+    # Building chain state
+    def add_token(self, address: str, symbol: str, decimals: int = 18):
+        self.tokens[address.lower()] = (symbol, decimals)
+
+    def _new_tx(self, sender: str, to: str, value: int) -> dict:
+        self._tx_counter += 1
+        tx = {
+            'hash': '0x%064x' % self._tx_counter,
+            'from': sender.lower(),
+            'to': to.lower(),
+            'value': hex(value),
+            'input': '0x',
+        }
+        self._pending_txs.append(tx)
+        return tx
+
+    def add_transfer(self, sender: str, recipient: str, value_wei: int) -> str:
+        """Queue a native transfer for the next block"""
+        return self._new_tx(sender, recipient, value_wei)['hash']
+
+    def add_token_transfer(self, token: str, sender: str, recipient: str, raw_amount: int) -> str:
+        """Queue an ERC-20 transfer (a call to the token emitting Transfer)"""
+        tx = self._new_tx(sender, token, 0)
+        self._pending_logs.setdefault(tx['hash'], []).append({
+            'address': token.lower(),
+            'topics': [TRANSFER_TOPIC, _topic(sender), _topic(recipient)],
+            'data': '0x%064x' % raw_amount,
+            'transactionHash': tx['hash'],
+        })
+        return tx['hash']
+
+    def mine(self, count: int = 1):
+        """Seal pending transactions into a block (extra blocks are empty)"""
+        for _ in range(count):
+            number = self.start_block + len(self.blocks)
+            bloom_values = []
+            for tx in self._pending_txs:
+                logs = self._pending_logs.pop(tx['hash'], [])
+                for log in logs:
+                    log['blockNumber'] = hex(number)
+                    bloom_values.append(bytes.fromhex(log['address'][2:]))
+                    bloom_values.extend(bytes.fromhex(topic[2:]) for topic in log['topics'])
+                tx['blockNumber'] = hex(number)
+                self.receipts[tx['hash']] = {
+                    'transactionHash': tx['hash'],
+                    'blockNumber': hex(number),
+                    'status': '0x1',
+                    'logs': logs,
+                }
+            self.blocks.append({
+                'number': hex(number),
+                'hash': '0x%064x' % (number + 2**200),
+                'timestamp': hex(1_700_000_000 + number * 12),
+                'baseFeePerGas': hex(self.base_fee),
+                'gasUsed': hex(15_000_000),
+                'gasLimit': hex(30_000_000),
+                'logsBloom': _bloom_hex(bloom_values),
+                'transactions': self._pending_txs,
+            })
+            self._pending_txs = []
+
+    @property
+    def head(self) -> int:
+        return self.start_block + len(self.blocks) - 1
+
+    def _block(self, tag: str) -> Optional[dict]:
+        number = self.head if tag == 'latest' else int(tag, 16)
+        index = number - self.start_block
+        return self.blocks[index] if 0 <= index < len(self.blocks) else None
+
+    # JSON-RPC methods
+    def rpc_eth_blockNumber(self):
+        return hex(self.head)
+
+    def rpc_eth_chainId(self):
+        return '0x1'
+
+    def rpc_eth_getBlockByNumber(self, tag: str, full: bool = False):
+        block = self._block(tag)
+        if block is None or full:
+            return block
+        return dict(block, transactions=[tx['hash'] for tx in block['transactions']])
+
+    def rpc_eth_getBlockReceipts(self, tag: str):
+        block = self._block(tag)
+        if block is None:
+            return None
+        return [self.receipts[tx['hash']] for tx in block['transactions']]
+
+    def rpc_eth_getTransactionReceipt(self, tx_hash: str):
+        return self.receipts.get(tx_hash)
+
+    def rpc_eth_getBalance(self, address: str, tag: str = 'latest'):
+        return hex(self.balances.get(address.lower(), 0))
+
+    def rpc_eth_gasPrice(self):
+        return hex(self.base_fee + 10**9)
+
+    def rpc_eth_feeHistory(self, block_count: str, newest: str, percentiles: Optional[List[float]] = None):
+        newest_number = self.head if newest == 'latest' else int(newest, 16)
+        oldest = max(self.start_block, newest_number - int(block_count, 16) + 1)
+        blocks = [self._block(hex(number)) for number in range(oldest, newest_number + 1)]
+        history = {
+            'oldestBlock': hex(oldest),
+            # One more than the blocks: the base fee of the block after newest
+            'baseFeePerGas': [block['baseFeePerGas'] for block in blocks] + [hex(self.base_fee)],
+            'gasUsedRatio': [0.5 for _ in blocks],
+        }
+        if percentiles:
+            history['reward'] = [[hex(int(10**8 * (1 + p / 10))) for p in percentiles] for _ in blocks]
+        return history
+
+    def rpc_eth_call(self, call: dict, tag: str = 'latest'):
+        token = self.tokens.get(call.get('to', '').lower())
+        if token is None:
+            raise ValueError('execution reverted')
+        symbol, decimals = token
+        if call.get('data') == '0x313ce567':
+            return '0x%064x' % decimals
+        encoded = symbol.encode()
+        return '0x' + '%064x' % 32 + '%064x' % len(encoded) + encoded.ljust(32, b'\x00').hex()
+
+class FakeSolanaNode(JsonRpcServer):
+    """Solana RPC stand-in serving getBalance and getMultipleAccounts from a lamports table"""
+
+    def __init__(self, slot: int = 250_000_000):
+        super().__init__()
+        self.lamports: Dict[str, int] = {}
+        self.slot = slot
+
+    def set_balance(self, address: str, lamports: int):
+        self.lamports[address] = lamports
+
+    def _context(self) -> dict:
+        self.slot += 1
+        return {'slot': self.slot}
+
+    def rpc_getBalance(self, address: str, config: Optional[dict] = None):
+        return {'context': self._context(), 'value': self.lamports.get(address, 0)}
+
+    def rpc_getMultipleAccounts(self, addresses: List[str], config: Optional[dict] = None):
+        if len(addresses) > 100:
+            raise ValueError('Too many inputs provided; max 100')
+        value = []
+        for address in addresses:
+            if address not in self.lamports:
+                value.append(None)
+                continue
+            value.append({
+                'lamports': self.lamports[address],
+                'owner': '11111111111111111111111111111111',
+                'data': ['', 'base64'],
+                'executable': False,
+                'rentEpoch': 0,
+            })
+        return {'context': self._context(), 'value': value}
+
+class FakePriceServer(StubServer):
+    """CoinGecko-style /simple/price stand-in answering from a USD price table"""
+
+    def __init__(self, prices: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.prices: Dict[str, float] = dict(prices or {'ethereum': 3000.0, 'solana': 150.0, 'usd-coin': 1.0})
+        # ids asked for by each request, to check refreshes are batched
+        self.queries: List[List[str]] = []
+        self.app.router.add_get('/simple/price', self._handle)
+
+    def set_price(self, asset_id: str, usd: float):
+        self.prices[asset_id] = usd
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        ids = [asset_id for asset_id in request.query.get('ids', '').split(',') if asset_id]
+        self.queries.append(ids)
+        currency = request.query.get('vs_currencies', 'usd')
+        return web.json_response({
+            asset_id: {currency: self.prices[asset_id]} for asset_id in ids if asset_id in self.prices
+        })
+
+class FakeBotApi(StubServer):
+    """Telegram Bot API stand-in for one token
+
+    Point the bot at it with base_url f"{api.url}/bot". Updates queued with
+    push_update are handed out by getUpdates; everything the bot sends is
+    kept in `sent` as (monotonic time, method, params).
+
+    sendMessage to a chat in `blocked` fails like a user who blocked the
+    bot; with flood_limit set, sends beyond that many per second get a 429
+    with retry_after, the way Telegram's flood control answers.
+    """
+
+    def __init__(self, token: str, bot_id: int = 1, poll_wait: float = 0.5,
+                 flood_limit: Optional[float] = None):
+        super().__init__()
+        self.token = token
+        self.bot_id = bot_id
+        self.poll_wait = poll_wait
+        self.flood_limit = flood_limit
+        self.blocked: set = set()
+        self.flood_errors = 0
+        self._window_start = 0.0
+        self._window_sends = 0
+        # file_id -> (file_path, content) for push_document uploads
+        self.files: Dict[str, tuple] = {}
+        self.updates: List[dict] = []
+        self.sent: List[tuple] = []
+        self.calls: Dict[str, int] = {}
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._new_update: Optional[asyncio.Event] = None
+        self.app.router.add_post('/bot{token}/{method}', self._handle)
+        self.app.router.add_get('/file/bot{token}/{file_path:.+}', self._download)
+
+    def _event(self) -> asyncio.Event:
+        if self._new_update is None:
+            self._new_update = asyncio.Event()
+        return self._new_update
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+    def push_update(self, update: dict) -> int:
+        """Queue a raw update; returns its update_id"""
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        self.updates.append(dict(update, update_id=update_id))
+        self._event().set()
+        return update_id
+
+    def push_message(self, user_id: int, text: str) -> int:
+        """Queue a private text message (commands get their entity)"""
+        message = {
+            'message_id': self._next_message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        self._next_message_id += 1
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return self.push_update({'message': message})
+
+    def push_document(self, user_id: int, file_name: str, content: bytes,
+                      mime_type: Optional[str] = None) -> int:
+        """Queue a private message carrying a file; getFile serves its content"""
+        file_id = f"file{len(self.files) + 1}"
+        self.files[file_id] = (f"documents/{file_id}_{file_name}", content)
+        message = {
+            'message_id': self._next_message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'document': {'file_id': file_id, 'file_unique_id': file_id, 'file_name': file_name,
+                         'mime_type': mime_type, 'file_size': len(content)},
+        }
+        self._next_message_id += 1
+        return self.push_update({'message': message})
+
+    def push_inline_query(self, user_id: int, query: str) -> int:
+        """Queue an inline query typed after the bot's username"""
+        return self.push_update({'inline_query': {
+            'id': str(self._next_update_id),
+            'from': self._user(user_id),
+            'query': query,
+            'offset': '',
+        }})
+
+    def push_callback(self, user_id: int, data: str, message_id: int = 1) -> int:
+        """Queue a button press on one of the bot's messages"""
+        return self.push_update({'callback_query': {
+            'id': str(self._next_update_id),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': self.bot_id, 'is_bot': True, 'first_name': 'Bot'},
+                'text': '...',
+            },
+        }})
+
+    def _message(self, params: dict) -> dict:
+        message_id = params.get('message_id') or self._next_message_id
+        self._next_message_id += 1
+        return {
+            'message_id': int(message_id),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+            'from': {'id': self.bot_id, 'is_bot': True, 'first_name': 'Bot'},
+            'text': params.get('text', ''),
+        }
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if request.match_info['token'] != self.token:
+            return web.json_response({'ok': False, 'error_code': 401, 'description': 'Unauthorized'}, status=401)
+
+        params = {}
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            for key, value in (await request.post()).items():
+                # PTB sends strings raw and everything else JSON encoded
+                try:
+                    params[key] = json.loads(value)
+                except (TypeError, ValueError):
+                    params[key] = value
+
+        if method == 'getMe':
+            result = {'id': self.bot_id, 'is_bot': True, 'first_name': 'Bot', 'username': 'stub_bot',
+                      'can_join_groups': False, 'can_read_all_group_messages': False,
+                      'supports_inline_queries': True}
+        elif method == 'getUpdates':
+            result = await self._get_updates(params)
+        elif method == 'getFile':
+            file_id = params.get('file_id')
+            if file_id not in self.files:
+                return web.json_response({'ok': False, 'error_code': 400,
+                                          'description': 'Bad Request: invalid file_id'}, status=400)
+            file_path, content = self.files[file_id]
+            result = {'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(content),
+                      'file_path': file_path}
+        elif method == 'sendMessage' and int(params.get('chat_id', 0)) in self.blocked:
+            return web.json_response({'ok': False, 'error_code': 403,
+                                      'description': 'Forbidden: bot was blocked by the user'}, status=403)
+        elif method == 'sendMessage' and self._flooded():
+            self.flood_errors += 1
+            return web.json_response({'ok': False, 'error_code': 429,
+                                      'description': 'Too Many Requests: retry after 1',
+                                      'parameters': {'retry_after': 1}}, status=429)
+        elif method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            self.sent.append((time.monotonic(), method, params))
+            result = self._message(params)
+        else:
+            # answerCallbackQuery, deleteWebhook, setWebhook, ...
+            self.sent.append((time.monotonic(), method, params))
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _download(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        for file_path, content in self.files.values():
+            if file_path == request.match_info['file_path'] and request.match_info['token'] == self.token:
+                return web.Response(body=content)
+        return web.Response(status=404)
+
+    def _flooded(self) -> bool:
+        """Count a send against the current one-second window"""
+        if not self.flood_limit:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_sends = 0
+        self._window_sends += 1
+        return self._window_sends > self.flood_limit
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get('offset') or 0)
+        if offset:
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates:
+            event = self._event()
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), min(self.poll_wait, float(params.get('timeout') or 0) or self.poll_wait))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(params.get('limit') or 100)]
@@ -0,0 +1,137 @@
+# update_processor.py
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from profiling import check_slow_update
+
+logger = logging.getLogger(__name__)
+
+# Updates handled at the same time across all users
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))
+
+# Recent lane waits kept for percentiles
+LANE_WAIT_SAMPLES = 1024
+
+class _Lane:
+    __slots__ = ('lock', 'depth')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+def lane_key(update: object) -> Optional[Hashable]:
+    """Serialization key for an update: the user, else the chat, else none"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+class LaneUpdateProcessor(BaseUpdateProcessor):
+    """Runs different users' updates in parallel and each user's updates in order
+
+    PTB hands updates over in arrival order. Each one first takes its user's
+    lane (a FIFO asyncio.Lock, dropped once nobody is queued on it), then one
+    of `workers` slots, so a user with a backlog waits in their own lane
+    without holding a slot other users could run on.
+
+    PTB's fetcher starts a task for every update without waiting on the
+    processor, so nothing here holds updates back from being fetched; the
+    base class semaphore is skipped, as sized to `workers` it would let one
+    user's queued backlog keep other users out.
+    """
+
+    def __init__(self, workers: int = CONCURRENT_UPDATES):
+        super().__init__(workers)
+        self.workers = workers
+        self._slots = asyncio.BoundedSemaphore(workers)
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self._waiting = 0
+        self._running = 0
+        self.lane_waits = deque(maxlen=LANE_WAIT_SAMPLES)
+
+        self.stats = {
+            'processed': 0,
+            'queued_behind_user': 0,
+            'max_lane_depth': 0,
+            'max_lane_wait_s': 0.0,
+            'max_slot_wait_s': 0.0,
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters plus the current lane and slot occupancy"""
+        return dict(
+            self.stats,
+            active_lanes=len(self._lanes),
+            waiting=self._waiting,
+            running=self._running,
+        )
+
+    async def _run(self, update: object, coroutine: Awaitable[Any], queued_at: float):
+        slot_start = time.monotonic()
+        async with self._slots:
+            slot_wait = time.monotonic() - slot_start
+            if slot_wait > self.stats['max_slot_wait_s']:
+                self.stats['max_slot_wait_s'] = round(slot_wait, 4)
+            self._waiting -= 1
+            self._running += 1
+            started = time.monotonic()
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+                self.stats['processed'] += 1
+                finished = time.monotonic()
+                check_slow_update(update, finished - started, started - queued_at)
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await self.do_process_update(update, coroutine)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        queued_at = time.monotonic()
+        self._waiting += 1
+        key = lane_key(update)
+        if key is None:
+            await self._run(update, coroutine, queued_at)
+            return
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane()
+        lane.depth += 1
+        if lane.depth > 1:
+            self.stats['queued_behind_user'] += 1
+        if lane.depth > self.stats['max_lane_depth']:
+            self.stats['max_lane_depth'] = lane.depth
+
+        try:
+            async with lane.lock:
+                lane_wait = time.monotonic() - queued_at
+                self.lane_waits.append(lane_wait)
+                if lane_wait > self.stats['max_lane_wait_s']:
+                    self.stats['max_lane_wait_s'] = round(lane_wait, 4)
+                await self._run(update, coroutine, queued_at)
+        except asyncio.CancelledError:
+            # Cancelled while waiting: don't leave the handler coroutine unawaited
+            coroutine.close()
+            raise
+        finally:
+            lane.depth -= 1
+            if lane.depth == 0 and self._lanes.get(key) is lane:
+                del self._lanes[key]
+
+    async def initialize(self) -> None:
+        logger.info(f"Update processor: {self.workers} workers, per-user ordering")
+
+    async def shutdown(self) -> None:
+        if self._lanes:
+            logger.warning(f"Update processor shut down with {len(self._lanes)} busy lanes")
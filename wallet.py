@@ -4,16 +4,36 @@ import re
 import os
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes, ConversationHandler
-import aiohttp
+from notifications import notify, DEFAULT_DIGEST_WINDOW, MAX_DIGEST_WINDOW
+from address_index import AddressIndex
+from chain_watcher import ChainWatcher, WATCHER_CHAINS, WATCHER_CHECKPOINT_FILE
+from checkpoint import CheckpointStore
+from solana_watcher import SolanaWatcher, SOLANA_WATCHER_ENABLED
+from prices import usd_suffix
+from profiling import timed_handler
+from log_pipeline import HotPathLogger
 
 logger = logging.getLogger(__name__)
+# Per-registration and per-notification logs, sampled under load
+hot_log = HotPathLogger(logger, per_second=5)
 
 # Conversation states
 CHOOSING_CHAIN, ENTERING_ADDRESS = range(2)
 
-# Store user wallets (in production, use a database)
-user_wallets = {}
-wallet_to_user = {}
+# Wallet registry: the bot's Database, set by set_wallet_registry. Wallets
+# live in its wallet store ({user_id: {'ethereum': address, 'solana': address,
+# 'notifications': bool, 'digest_window': seconds}}), so they survive restarts
+# and are shared with the menu flow in bot.py
+registry = None
+
+# Watched addresses -> owning users, used for webhook matching; rebuilt from
+# the registry at startup by load_watched_addresses
+watched_addresses = AddressIndex()
+
+# Chain names shown to users -> wallet store keys
+CHAIN_WALLET_TYPES = {'Ethereum': 'ethereum', 'Solana': 'solana'}
+# Wallets connected from the bot.py menu were promised notifications
+DEFAULT_NOTIFICATIONS = True
 
 # Alchemy API keys from environment
 ALCHEMY_API_URL = os.getenv("ALCHEMY_API_URL")
@@ -26,6 +46,16 @@ ARBITRUM_RPC = f"https://arb-mainnet.g.alchemy.com/v2/{ALCHEMY_API_URL}" if ALCH
 BASE_RPC = f"https://base-mainnet.g.alchemy.com/v2/{ALCHEMY_API_URL}" if ALCHEMY_API_URL else "https://mainnet.base.org"
 SOLANA_RPC = "https://api.mainnet-beta.solana.com"
 
+# EVM chains an Ethereum wallet is followed on
+EVM_CHAINS = {
+    'eth': {'rpc': ETH_RPC, 'network': 'ETH_MAINNET', 'asset': 'ETH'},
+    'arbitrum': {'rpc': ARBITRUM_RPC, 'network': 'ARB_MAINNET', 'asset': 'ETH'},
+    'base': {'rpc': BASE_RPC, 'network': 'BASE_MAINNET', 'asset': 'ETH'},
+}
+
+# Running block watchers, by chain
+chain_watchers = {}
+
 def is_valid_eth_address(address: str) -> bool:
     """Validate Ethereum address"""
     return bool(re.match(r'^0x[a-fA-F0-9]{40}$', address))
@@ -36,6 +66,7 @@ def is_valid_solana_address(address: str) -> bool:
 
 async def get_eth_balance(address: str, rpc_url: str) -> float:
     """Fetch ETH balance from any EVM chain"""
+    import aiohttp
     try:
         async with aiohttp.ClientSession() as session:
             payload = {
@@ -52,11 +83,12 @@ async def get_eth_balance(address: str, rpc_url: str) -> float:
                     return balance_eth
                 return 0.0
     except Exception as e:
-        logger.error(f"Error fetching ETH balance: {e}")
+        hot_log.error("Error fetching ETH balance: %s", e)
         return 0.0
 
 async def get_solana_balance(address: str) -> float:
     """Fetch SOL balance"""
+    import aiohttp
     try:
         async with aiohttp.ClientSession() as session:
             payload = {
@@ -73,13 +105,13 @@ async def get_solana_balance(address: str) -> float:
                     return balance_sol
                 return 0.0
     except Exception as e:
-        logger.error(f"Error fetching SOL balance: {e}")
+        hot_log.error("Error fetching SOL balance: %s", e)
         return 0.0
 
 async def add_address_to_webhook(address: str, webhook_id: str, auth_token: str):
     """Add address to Alchemy webhook for notifications"""
     if not webhook_id or not auth_token:
-        logger.warning("Alchemy webhook credentials not configured")
+        hot_log.warning("Alchemy webhook credentials not configured")
         return False
     
     try:
@@ -94,34 +126,57 @@ async def add_address_to_webhook(address: str, webhook_id: str, auth_token: str)
             "addresses_to_remove": []
         }
         
+        import aiohttp
         async with aiohttp.ClientSession() as session:
             async with session.patch(url, json=payload, headers=headers) as response:
                 if response.status == 200:
-                    logger.info(f"Added {address} to webhook {webhook_id}")
+                    hot_log.info("Added address to webhook: address=%s webhook=%s", address, webhook_id)
                     return True
                 else:
-                    logger.error(f"Failed to add address to webhook: {response.status}")
+                    hot_log.error("Failed to add address to webhook: status=%s", response.status)
                     return False
     except Exception as e:
-        logger.error(f"Error adding address to webhook: {e}")
+        hot_log.error("Error adding address to webhook: %s", e)
         return False
 
+def set_wallet_registry(database):
+    """Keep wallets in database's wallet store"""
+    global registry
+    registry = database
+
+def connected_wallets(wallet_info: dict) -> list:
+    """(chain, address) of each wallet in a registry record"""
+    return [(chain, wallet_info[wallet_type]) for chain, wallet_type in CHAIN_WALLET_TYPES.items()
+            if wallet_info.get(wallet_type)]
+
+def get_wallet(user_id: int) -> dict:
+    """A user's registry record if they have a wallet connected, else None"""
+    wallet_info = registry.get_user_wallet(user_id)
+    return wallet_info if wallet_info and connected_wallets(wallet_info) else None
+
+@timed_handler
 async def wallet_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show wallet menu"""
     user_id = update.effective_user.id
-    
-    if user_id in user_wallets:
-        wallet_info = user_wallets[user_id]
-        notifications_status = "🔔 ON" if wallet_info.get('notifications', False) else "🔕 OFF"
+    wallet_info = get_wallet(user_id)
+    
+    if wallet_info:
+        notifications_status = "🔔 ON" if wallet_info.get('notifications', DEFAULT_NOTIFICATIONS) else "🔕 OFF"
+        digest_window = wallet_info.get('digest_window', DEFAULT_DIGEST_WINDOW)
+        digest_status = f"{digest_window}s" if digest_window > 0 else "OFF"
+        addresses = ''.join(
+            f"{chain}: `{address[:8]}...{address[-6:]}`\n" for chain, address in connected_wallets(wallet_info)
+        )
         
         wallet_text = (
             f"💰 *Your Wallet*\n\n"
-            f"Chain: {wallet_info['chain']}\n"
-            f"Address: `{wallet_info['address'][:8]}...{wallet_info['address'][-6:]}`\n"
-            f"Notifications: {notifications_status}\n\n"
+            f"{addresses}"
+            f"Notifications: {notifications_status}\n"
+            f"Digest window: {digest_status}\n\n"
             f"Commands:\n"
             f"/balance - Check balance\n"
             f"/notifications - Toggle notifications\n"
+            f"/digest - Set digest window\n"
             f"/change\\_wallet - Change wallet"
         )
         
@@ -134,6 +189,7 @@ async def wallet_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         await update.message.reply_text(wallet_text, parse_mode='MarkdownV2')
 
+@timed_handler
 async def connect_wallet_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start wallet connection process"""
     keyboard = [
@@ -142,17 +198,19 @@ async def connect_wallet_start(update: Update, context: ContextTypes.DEFAULT_TYP
         [InlineKeyboardButton("❌ Cancel", callback_data='cancel_wallet')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
+    context.user_data.pop('selected_chain', None)
     
     await update.message.reply_text(
         "🔗 *Connect Your Wallet*\n\n"
         "Please select your blockchain:\n\n"
-        "💡 *Note:* Ethereum option includes ETH Mainnet, Arbitrum, and Base!",
+        "💡 *Note:* Ethereum option includes ETH Mainnet, Arbitrum, and Base\\!",
         parse_mode='MarkdownV2',
         reply_markup=reply_markup
     )
     
     return CHOOSING_CHAIN
 
+@timed_handler
 async def chain_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle chain selection"""
     query = update.callback_query
@@ -195,11 +253,15 @@ async def chain_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     return ENTERING_ADDRESS
 
+@timed_handler
 async def address_entered(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle address input"""
     address = update.message.text.strip()
     chain = context.user_data.get('selected_chain')
     user_id = update.effective_user.id
+    # The flow ends here whatever the outcome; selected_chain in user_data
+    # is what bot.py's message router resumes it by after a restart
+    context.user_data.pop('selected_chain', None)
     
     if not chain:
         await update.message.reply_text(
@@ -211,7 +273,7 @@ async def address_entered(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if chain == 'Solana':
         if not is_valid_solana_address(address):
             await update.message.reply_text(
-                "❌ *Invalid Solana address!*\n\n"
+                "❌ *Invalid Solana address\\!*\n\n"
                 "Please try again with /connect\\_wallet\n\n"
                 "A valid Solana address looks like:\n"
                 "`DYw8jCTfwHNRJhhmFcbXvVDTqWMEVFBX6ZKUmG5CNSKK`",
@@ -221,37 +283,53 @@ async def address_entered(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         if not is_valid_eth_address(address):
             await update.message.reply_text(
-                "❌ *Invalid Ethereum address!*\n\n"
+                "❌ *Invalid Ethereum address\\!*\n\n"
                 "Please try again with /connect\\_wallet\n\n"
                 "A valid Ethereum address looks like:\n"
                 "`0x742d35Cc6634C0532925a3b844Bc9e7595f0bEb`",
                 parse_mode='MarkdownV2'
             )
             return ConversationHandler.END
+        # Stored checksummed, as the wallet menu in bot.py does; web3 rejects anything else
+        from web3 import Web3
+        address = Web3.to_checksum_address(address)
     
     # Show processing message
     loading_msg = await update.message.reply_text("⏳ Setting up your wallet...")
     
-    # Add to webhook for notifications (only for Ethereum)
+    wallet_type = CHAIN_WALLET_TYPES[chain]
+    previous_info = registry.get_user_wallet(user_id) or {}
+    previous = previous_info.get(wallet_type)
+    
+    # Add to webhook for notifications (only for Ethereum); Alchemy already
+    # has an address the user connected before
     webhook_added = False
     if chain == 'Ethereum' and ALCHEMY_WEBHOOK_ID_ETH:
-        webhook_added = await add_address_to_webhook(address, ALCHEMY_WEBHOOK_ID_ETH, ALCHEMY_WEBHOOK_SECRET_ETH)
-        logger.info(f"Webhook registration result: {webhook_added}")
-    
-    # Save wallet
-    user_wallets[user_id] = {
-        'chain': chain,
-        'address': address,
-        'notifications': webhook_added
-    }
+        if previous and previous.lower() == address.lower():
+            webhook_added = previous_info.get('notifications', DEFAULT_NOTIFICATIONS)
+        else:
+            webhook_added = await add_address_to_webhook(address, ALCHEMY_WEBHOOK_ID_ETH, ALCHEMY_WEBHOOK_SECRET_ETH)
+            hot_log.info("Webhook registration: user=%s added=%s", user_id, webhook_added)
+    
+    # Watchers pick up any indexed address without registration
+    if (chain == 'Ethereum' and WATCHER_CHAINS) or (chain == 'Solana' and SOLANA_WATCHER_ENABLED):
+        webhook_added = True
+    
+    # Save wallet, replacing the one of the same chain
+    registry.save_user_wallet(user_id, wallet_type, address, {
+        'notifications': webhook_added,
+        'digest_window': previous_info.get('digest_window', DEFAULT_DIGEST_WINDOW)
+    })
     
     # Map wallet to user for notifications
-    wallet_to_user[address.lower()] = user_id
+    if previous:
+        watched_addresses.remove(previous, user_id)
+    watched_addresses.add(address, user_id)
     
     notification_status = "🔔 Enabled" if webhook_added else "⚠️ Not configured"
     
     success_text = (
-        f"✅ *Wallet Connected Successfully!*\n\n"
+        f"✅ *Wallet Connected Successfully\\!*\n\n"
         f"Chain: {chain}\n"
         f"Address: `{address}`\n"
         f"Notifications: {notification_status}\n\n"
@@ -263,94 +341,94 @@ async def address_entered(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await loading_msg.edit_text(success_text, parse_mode='MarkdownV2')
     
-    # Clear user data
-    context.user_data.clear()
-    
     return ConversationHandler.END
 
+@timed_handler
 async def cancel_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel wallet connection"""
+    context.user_data.pop('selected_chain', None)
     await update.message.reply_text("❌ Wallet connection cancelled.")
     return ConversationHandler.END
 
+@timed_handler
 async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Fetch and display wallet balance"""
     user_id = update.effective_user.id
+    wallet_info = get_wallet(user_id)
     
-    if user_id not in user_wallets:
+    if not wallet_info:
         await update.message.reply_text(
             "❌ No wallet connected\\. Use /connect\\_wallet first\\.",
             parse_mode='MarkdownV2'
         )
         return
     
-    wallet_info = user_wallets[user_id]
-    chain = wallet_info['chain']
-    address = wallet_info['address']
-    
     # Send loading message
     loading_msg = await update.message.reply_text("⏳ Fetching balance from blockchain...")
     
     try:
-        if chain == 'Ethereum':
-            # Fetch from all EVM chains
-            eth_balance = await get_eth_balance(address, ETH_RPC)
-            arb_balance = await get_eth_balance(address, ARBITRUM_RPC)
-            base_balance = await get_eth_balance(address, BASE_RPC)
-            total = eth_balance + arb_balance + base_balance
-            
-            balance_text = (
-                f"💰 *Balance for {chain}*\n\n"
-                f"Address: `{address[:8]}...{address[-6:]}`\n\n"
-                f"🔷 Ethereum Mainnet: *{eth_balance:.6f}* ETH\n"
-                f"🔵 Arbitrum: *{arb_balance:.6f}* ETH\n"
-                f"🔵 Base: *{base_balance:.6f}* ETH\n"
-                f"━━━━━━━━━━━━━━━\n"
-                f"📊 Total: *{total:.6f}* ETH"
-            )
-        
-        elif chain == 'Solana':
-            balance = await get_solana_balance(address)
-            balance_text = (
-                f"💰 *Balance for {chain}*\n\n"
-                f"Address: `{address[:8]}...{address[-6:]}`\n\n"
-                f"🟣 Solana: *{balance:.6f}* SOL"
-            )
-        else:
-            balance_text = "❌ Unsupported chain"
-        
-        await loading_msg.edit_text(balance_text, parse_mode='Markdown')
+        balance_texts = [await get_balance_text(chain, address) for chain, address in connected_wallets(wallet_info)]
+        await loading_msg.edit_text("\n\n".join(balance_texts), parse_mode='Markdown')
     
     except Exception as e:
-        logger.error(f"Error fetching balance: {e}")
+        hot_log.error("Error fetching balance: %s", e)
         await loading_msg.edit_text(
             "❌ Error fetching balance\\. Please try again later\\.",
             parse_mode='MarkdownV2'
         )
 
+async def get_balance_text(chain: str, address: str) -> str:
+    """Balance summary of one wallet"""
+    if chain == 'Ethereum':
+        # Fetch from all EVM chains
+        eth_balance = await get_eth_balance(address, ETH_RPC)
+        arb_balance = await get_eth_balance(address, ARBITRUM_RPC)
+        base_balance = await get_eth_balance(address, BASE_RPC)
+        total = eth_balance + arb_balance + base_balance
+        
+        return (
+            f"💰 *Balance for {chain}*\n\n"
+            f"Address: `{address[:8]}...{address[-6:]}`\n\n"
+            f"🔷 Ethereum Mainnet: *{eth_balance:.6f}* ETH{usd_suffix('ETH', eth_balance)}\n"
+            f"🔵 Arbitrum: *{arb_balance:.6f}* ETH{usd_suffix('ETH', arb_balance)}\n"
+            f"🔵 Base: *{base_balance:.6f}* ETH{usd_suffix('ETH', base_balance)}\n"
+            f"━━━━━━━━━━━━━━━\n"
+            f"📊 Total: *{total:.6f}* ETH{usd_suffix('ETH', total)}"
+        )
+    
+    if chain == 'Solana':
+        balance = await get_solana_balance(address)
+        return (
+            f"💰 *Balance for {chain}*\n\n"
+            f"Address: `{address[:8]}...{address[-6:]}`\n\n"
+            f"🟣 Solana: *{balance:.6f}* SOL{usd_suffix('SOL', balance)}"
+        )
+    return "❌ Unsupported chain"
+
+@timed_handler
 async def notifications_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Toggle transaction notifications"""
     user_id = update.effective_user.id
+    wallet_info = get_wallet(user_id)
     
-    if user_id not in user_wallets:
+    if not wallet_info:
         await update.message.reply_text(
             "❌ No wallet connected. Use /connect_wallet first."
         )
         return
     
-    wallet_info = user_wallets[user_id]
-    current_status = wallet_info.get('notifications', False)
+    current_status = wallet_info.get('notifications', DEFAULT_NOTIFICATIONS)
     
-    if not ALCHEMY_WEBHOOK_ID_ETH:
+    if not ALCHEMY_WEBHOOK_ID_ETH and not WATCHER_CHAINS and not SOLANA_WATCHER_ENABLED:
         await update.message.reply_text(
             "⚠️ Alchemy webhooks are not configured. "
-            "Please set up webhook IDs in environment variables."
+            "Please set up webhook IDs or BLOCK_WATCHER_CHAINS in environment variables."
         )
         return
     
     # Toggle notifications
     new_status = not current_status
-    wallet_info['notifications'] = new_status
+    registry.set_wallet_preferences(user_id, notifications=new_status)
     
     status_text = "🔔 enabled" if new_status else "🔕 disabled"
     
@@ -358,87 +436,145 @@ async def notifications_command(update: Update, context: ContextTypes.DEFAULT_TY
         f"✅ Transaction notifications {status_text}!"
     )
 
+@timed_handler
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show or set the notification digest window"""
+    user_id = update.effective_user.id
+    wallet_info = get_wallet(user_id)
+    
+    if not wallet_info:
+        await update.message.reply_text(
+            "❌ No wallet connected. Use /connect_wallet first."
+        )
+        return
+    
+    if not context.args:
+        window = wallet_info.get('digest_window', DEFAULT_DIGEST_WINDOW)
+        status = f"{window} seconds" if window > 0 else "off (one message per transaction)"
+        await update.message.reply_text(
+            f"📦 Digest window: {status}\n\n"
+            f"The first transaction is sent right away; the ones following it within the window are combined into one message.\n"
+            f"Usage: /digest <seconds> (0 to turn off, max {MAX_DIGEST_WINDOW})"
+        )
+        return
+    
+    try:
+        window = int(context.args[0])
+        if window < 0 or window > MAX_DIGEST_WINDOW:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(
+            f"❌ Please send a number of seconds between 0 and {MAX_DIGEST_WINDOW}."
+        )
+        return
+    
+    registry.set_wallet_preferences(user_id, digest_window=window)
+    
+    if window > 0:
+        await update.message.reply_text(f"✅ Notifications will be grouped every {window} seconds.")
+    else:
+        await update.message.reply_text("✅ Digest turned off. Each transaction will be sent separately.")
+
+@timed_handler
 async def change_wallet_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Change connected wallet"""
     user_id = update.effective_user.id
     
-    if user_id in user_wallets:
-        wallet_info = user_wallets[user_id]
-        address = wallet_info['address']
-        
-        # Remove from mappings
-        del user_wallets[user_id]
-        if address.lower() in wallet_to_user:
-            del wallet_to_user[address.lower()]
+    # Remove from the registry and the webhook index
+    for address in registry.remove_user_wallet(user_id).values():
+        watched_addresses.remove(address, user_id)
     
     await update.message.reply_text(
         "🔄 Wallet disconnected. Use /connect_wallet to connect a new wallet."
     )
 
+async def notify_user(app, user_id: int, activity: dict):
+    """Queue an activity for a user if they have notifications on"""
+    wallet_info = registry.get_user_wallet(user_id)
+    if not wallet_info or not wallet_info.get('notifications', DEFAULT_NOTIFICATIONS):
+        return
+    
+    # Coalesced per user, see notifications.py
+    await notify(app, user_id, activity, wallet_info.get('digest_window', DEFAULT_DIGEST_WINDOW))
+
+@timed_handler
 async def handle_webhook_notification(app, webhook_data: dict):
     """Handle incoming webhook notifications from Alchemy"""
     try:
         event = webhook_data.get('event', {})
         activity = event.get('activity', [])
+        network = event.get('network', 'ETH_MAINNET')
         
         if not activity:
             return
         
-        for tx in activity:
+        # Resolve every from/to address in one pass
+        for user_id, tx_type, tx in watched_addresses.match_activity(activity):
             from_address = tx.get('fromAddress', '').lower()
             to_address = tx.get('toAddress', '').lower()
-            value = float(tx.get('value', 0))
-            hash_tx = tx.get('hash', '')
-            asset = tx.get('asset', 'ETH')
-            
-            # Find affected users
-            affected_users = []
-            if from_address in wallet_to_user:
-                affected_users.append((wallet_to_user[from_address], 'sent'))
-            if to_address in wallet_to_user:
-                affected_users.append((wallet_to_user[to_address], 'received'))
             
-            # Send notifications
-            for user_id, tx_type in affected_users:
-                if user_id not in user_wallets:
-                    continue
-                
-                wallet_info = user_wallets[user_id]
-                if not wallet_info.get('notifications', False):
-                    continue
-                
-                if tx_type == 'sent':
-                    emoji = "📤"
-                    action = "Sent"
-                    address_label = f"To: `{to_address[:8]}...{to_address[-6:]}`"
-                else:
-                    emoji = "📥"
-                    action = "Received"
-                    address_label = f"From: `{from_address[:8]}...{from_address[-6:]}`"
-                
-                notification_text = (
-                    f"{emoji} *Transaction {action}*\n\n"
-                    f"Amount: {value:.6f} {asset}\n"
-                    f"{address_label}\n"
-                    f"Hash: `{hash_tx[:10]}...{hash_tx[-8:]}`\n\n"
-                    f"[View on Explorer](https://etherscan.io/tx/{hash_tx})"
-                )
-                
-                try:
-                    await app.bot.send_message(
-                        chat_id=user_id,
-                        text=notification_text,
-                        parse_mode='Markdown',
-                        disable_web_page_preview=True
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending notification to user {user_id}: {e}")
+            await notify_user(app, user_id, {
+                'direction': tx_type,
+                'value': float(tx.get('value', 0)),
+                'asset': tx.get('asset', 'ETH'),
+                # Alchemy leaves the contract address empty for native transfers
+                'contract': (tx.get('rawContract') or {}).get('address'),
+                'hash': tx.get('hash', ''),
+                'counterparty': to_address if tx_type == 'sent' else from_address,
+                'network': network
+            })
     
     except Exception as e:
-        logger.error(f"Error handling webhook notification: {e}")
+        hot_log.error("Error handling webhook notification: %s", e)
+
+def load_watched_addresses(wallets: dict) -> int:
+    """Rebuild the watched-address index from the registry's wallet store in one pass
+
+    Addresses are only indexed locally; Alchemy kept its own list across the
+    restart, so nothing is registered again.
+    """
+    watched_addresses.clear()
+    return watched_addresses.load_wallets(wallets)
+
+def start_chain_watchers(app, checkpoint_file: str = WATCHER_CHECKPOINT_FILE):
+    """Start a block watcher for every chain in BLOCK_WATCHER_CHAINS, plus the Solana watcher"""
+    async def on_activity(user_id: int, activity: dict):
+        await notify_user(app, user_id, activity)
+    
+    if SOLANA_WATCHER_ENABLED:
+        watcher = SolanaWatcher(os.getenv('SOLANA_WATCHER_RPC', SOLANA_RPC), watched_addresses, on_activity)
+        chain_watchers['solana'] = watcher
+        watcher.start()
+    
+    if not WATCHER_CHAINS:
+        return
+    
+    checkpoints = CheckpointStore(checkpoint_file)
+    
+    for chain in WATCHER_CHAINS:
+        config = EVM_CHAINS.get(chain)
+        if not config:
+            logger.warning(f"Unknown chain in BLOCK_WATCHER_CHAINS: {chain}")
+            continue
+        
+        # Allow pointing a watcher at a different node (or a local stand-in)
+        rpc_url = os.getenv(f"BLOCK_WATCHER_RPC_{chain.upper()}", config['rpc'])
+        watcher = ChainWatcher(chain, rpc_url, config['network'], config['asset'],
+                               watched_addresses, on_activity, checkpoints)
+        chain_watchers[chain] = watcher
+        watcher.start()
+    
+    logger.info(f"Block watchers running for: {', '.join(chain_watchers)}")
+
+async def stop_chain_watchers():
+    """Stop watchers and persist their checkpoints"""
+    for watcher in chain_watchers.values():
+        await watcher.stop()
+    chain_watchers.clear()
 
-def register_wallet_handlers(app):
-    """Register all wallet-related handlers"""
+def register_wallet_handlers(app, database):
+    """Register all wallet-related handlers; register before any catch-all callback handler"""
+    set_wallet_registry(database)
     
     # Conversation handler for wallet connection
     conv_handler = ConversationHandler(
@@ -456,6 +592,7 @@ def register_wallet_handlers(app):
     app.add_handler(CommandHandler('wallet', wallet_command))
     app.add_handler(CommandHandler('balance', balance_command))
     app.add_handler(CommandHandler('notifications', notifications_command))
+    app.add_handler(CommandHandler('digest', digest_command))
     app.add_handler(CommandHandler('change_wallet', change_wallet_command))
     
     logger.info("✅ Wallet handlers registered")
\ No newline at end of file
@@ -1,23 +1,54 @@
 # webhook_handler.py
-from flask import Flask, request, jsonify
+from aiohttp import web
 import logging
 import os
 import hmac
 import hashlib
+import secrets
 import asyncio
+import json
+
+import metrics
+from log_pipeline import HotPathLogger
 
 logger = logging.getLogger(__name__)
+# Per-request logs; a burst of webhooks mustn't turn into a burst of log writes
+request_log = HotPathLogger(logger, per_second=5)
+
+# Alchemy signing secret per webhook route
+ALCHEMY_SECRETS = {
+    'eth': 'ALCHEMY_WEBHOOK_SECRET_ETH',
+    'arbitrum': 'ALCHEMY_WEBHOOK_SECRET_ARB',
+    'base': 'ALCHEMY_WEBHOOK_SECRET_BASE',
+}
 
-app = Flask(__name__)
+# Telegram webhook settings
+TELEGRAM_WEBHOOK_PATH = os.getenv('TELEGRAM_WEBHOOK_PATH', '/webhook/telegram')
+# Without a configured secret one is made up per process and handed to
+# setWebhook, so only Telegram can post updates (with any user id in them)
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET') or secrets.token_urlsafe(32)
 
 # Store reference to the bot application
 bot_app = None
+# In a cluster the ingress process forwards to workers instead (see cluster.py)
+ingress = None
+
+# Metrics-only server of a cluster worker (see cluster.py)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# Notification tasks still running, kept so they aren't garbage collected
+_pending_tasks = set()
+_runner = None
+_metrics_runner = None
+
+metrics.gauge('webhook_pending_notifications', 'Alchemy payloads still being processed').set_function(
+    lambda: len(_pending_tasks))
 
 def verify_alchemy_signature(signature: str, body: bytes, secret: str) -> bool:
     """Verify Alchemy webhook signature"""
     if not secret:
         return True  # Skip verification if no secret is set
-    
+
     try:
         expected_signature = hmac.new(
             secret.encode(),
@@ -26,94 +57,170 @@ def verify_alchemy_signature(signature: str, body: bytes, secret: str) -> bool:
         ).hexdigest()
         return hmac.compare_digest(signature, expected_signature)
     except Exception as e:
-        logger.error(f"Error verifying signature: {e}")
+        request_log.error("Error verifying signature: %s", e)
         return False
 
-@app.route('/webhook/alchemy/eth', methods=['POST'])
-def alchemy_webhook_eth():
-    """Handle Alchemy webhook for Ethereum"""
-    try:
-        signature = request.headers.get('X-Alchemy-Signature', '')
-        secret = os.getenv('ALCHEMY_WEBHOOK_SECRET_ETH', '')
-        
-        if secret and not verify_alchemy_signature(signature, request.data, secret):
-            logger.warning("Invalid webhook signature for ETH")
-            return jsonify({'error': 'Invalid signature'}), 401
-        
-        data = request.json
-        logger.info(f"Received ETH webhook: {data}")
-        
-        # Process webhook in the background
-        if bot_app:
-            from wallet import handle_webhook_notification
-            asyncio.create_task(handle_webhook_notification(bot_app, data))
-        
-        return jsonify({'status': 'success'}), 200
-    
-    except Exception as e:
-        logger.error(f"Error processing ETH webhook: {e}")
-        return jsonify({'error': str(e)}), 500
+def verify_telegram_secret(header: str) -> bool:
+    """Check the X-Telegram-Bot-Api-Secret-Token header"""
+    return hmac.compare_digest(header or '', TELEGRAM_WEBHOOK_SECRET)
+
+def payload_fields(data) -> tuple:
+    """(webhook id, type, activity count) of an Alchemy payload, for one log line"""
+    if not isinstance(data, dict):
+        return None, None, 0
+    event = data.get('event')
+    activity = event.get('activity') if isinstance(event, dict) else None
+    return data.get('webhookId'), data.get('type'), len(activity) if isinstance(activity, list) else 0
+
+def dispatch_notification(data: dict):
+    """Process a webhook payload in the background so the request can be acked"""
+    if ingress:
+        # Every worker matches it against the wallets of the users it owns
+        dropped = ingress.broadcast('alchemy', data)
+        if dropped:
+            # Not retried: the workers that did get it would notify twice
+            request_log.warning("Alchemy payload dropped by %d full worker inboxes", dropped)
+        return None
+    if not bot_app:
+        return None
+
+    from wallet import handle_webhook_notification
+    task = asyncio.create_task(handle_webhook_notification(bot_app, data))
+    _pending_tasks.add(task)
+    task.add_done_callback(_pending_tasks.discard)
+    return task
+
+async def alchemy_webhook(request: web.Request) -> web.Response:
+    """Handle Alchemy webhook for any configured chain"""
+    chain = request.match_info['chain']
+    if chain not in ALCHEMY_SECRETS:
+        return web.json_response({'error': 'Unknown chain'}, status=404)
 
-@app.route('/webhook/alchemy/arbitrum', methods=['POST'])
-def alchemy_webhook_arbitrum():
-    """Handle Alchemy webhook for Arbitrum"""
     try:
+        body = await request.read()
         signature = request.headers.get('X-Alchemy-Signature', '')
-        secret = os.getenv('ALCHEMY_WEBHOOK_SECRET_ARB', '')
-        
-        if secret and not verify_alchemy_signature(signature, request.data, secret):
-            logger.warning("Invalid webhook signature for Arbitrum")
-            return jsonify({'error': 'Invalid signature'}), 401
-        
-        data = request.json
-        logger.info(f"Received Arbitrum webhook: {data}")
-        
+        secret = os.getenv(ALCHEMY_SECRETS[chain], '')
+
+        if secret and not verify_alchemy_signature(signature, body, secret):
+            request_log.warning("Invalid webhook signature for %s", chain)
+            return web.json_response({'error': 'Invalid signature'}, status=401)
+
+        data = json.loads(body)
+        request_log.info("Received %s webhook: id=%s type=%s activities=%d", chain, *payload_fields(data))
+        # The whole payload only when debugging; formatted off the loop, if at all
+        logger.debug("%s webhook payload: %s", chain, data)
+
         # Process webhook in the background
-        if bot_app:
-            from wallet import handle_webhook_notification
-            asyncio.create_task(handle_webhook_notification(bot_app, data))
-        
-        return jsonify({'status': 'success'}), 200
-    
+        dispatch_notification(data)
+
+        return web.json_response({'status': 'success'})
+
     except Exception as e:
-        logger.error(f"Error processing Arbitrum webhook: {e}")
-        return jsonify({'error': str(e)}), 500
+        request_log.error("Error processing %s webhook: %s", chain, e)
+        return web.json_response({'error': str(e)}, status=500)
+
+async def telegram_webhook(request: web.Request) -> web.Response:
+    """Queue a Telegram update for the application and ack right away"""
+    if not verify_telegram_secret(request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')):
+        request_log.warning("Invalid Telegram webhook secret token")
+        return web.Response(status=403)
+    if ingress:
+        try:
+            data = await request.json()
+        except Exception as e:
+            request_log.error("Invalid Telegram update: %s", e)
+            return web.Response(status=400)
+        if not ingress.route_update(data):
+            # The owning worker is behind; Telegram retries a non-2xx later
+            return web.Response(status=503)
+        return web.Response()
+    if not bot_app:
+        # Not ready yet; a non-2xx makes Telegram retry the update later
+        return web.Response(status=503)
 
-@app.route('/webhook/alchemy/base', methods=['POST'])
-def alchemy_webhook_base():
-    """Handle Alchemy webhook for Base"""
     try:
-        signature = request.headers.get('X-Alchemy-Signature', '')
-        secret = os.getenv('ALCHEMY_WEBHOOK_SECRET_BASE', '')
-        
-        if secret and not verify_alchemy_signature(signature, request.data, secret):
-            logger.warning("Invalid webhook signature for Base")
-            return jsonify({'error': 'Invalid signature'}), 401
-        
-        data = request.json
-        logger.info(f"Received Base webhook: {data}")
-        
-        # Process webhook in the background
-        if bot_app:
-            from wallet import handle_webhook_notification
-            asyncio.create_task(handle_webhook_notification(bot_app, data))
-        
-        return jsonify({'status': 'success'}), 200
-    
+        from telegram import Update
+        data = await request.json()
+        update = Update.de_json(data, bot_app.bot)
     except Exception as e:
-        logger.error(f"Error processing Base webhook: {e}")
-        return jsonify({'error': str(e)}), 500
+        request_log.error("Invalid Telegram update: %s", e)
+        return web.Response(status=400)
+
+    await bot_app.update_queue.put(update)
+    return web.Response()
+
+async def home(request: web.Request) -> web.Response:
+    return web.Response(text="Bot is alive! 🤖")
 
-@app.route('/')
-def home():
-    return "Bot is alive! 🤖"
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({'status': 'healthy'})
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    if not metrics.scrape_allowed(request.remote, request.headers.get('Authorization')):
+        return web.Response(status=403)
+    return web.Response(body=metrics.render().encode(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+def create_app() -> web.Application:
+    """aiohttp app serving the Alchemy and Telegram webhooks"""
+    app = web.Application()
+    app.router.add_post('/webhook/alchemy/{chain}', alchemy_webhook)
+    app.router.add_post(TELEGRAM_WEBHOOK_PATH, telegram_webhook)
+    app.router.add_get('/', home)
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics_endpoint)
+    return app
 
 def set_bot_app(application):
     """Store reference to the bot application"""
     global bot_app
     bot_app = application
 
-def run_server():
-    """Run the webhook server"""
-    port = int(os.getenv('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+def set_ingress(cluster_ingress):
+    """Forward updates and Alchemy payloads to cluster workers"""
+    global ingress
+    ingress = cluster_ingress
+    metrics.register_stats('cluster_ingress_stats', lambda: cluster_ingress.stats, 'Cluster ingress counters')
+
+async def start_server(application, host: str = '0.0.0.0', port: int = None) -> int:
+    """Start the webhook server on the running loop; returns the bound port"""
+    global _runner
+    if application is not None:
+        set_bot_app(application)
+    if port is None:
+        port = int(os.getenv('PORT', 5000))
+
+    _runner = web.AppRunner(create_app(), access_log=None)
+    await _runner.setup()
+    site = web.TCPSite(_runner, host, port)
+    await site.start()
+    bound = site._server.sockets[0].getsockname()[1]
+    logger.info(f"Webhook server listening on {host}:{bound}")
+    return bound
+
+async def start_metrics_server(port: int, host: str = METRICS_HOST) -> int:
+    """Serve only /metrics, for processes without the webhook server; returns the bound port"""
+    global _metrics_runner
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_endpoint)
+    _metrics_runner = web.AppRunner(app, access_log=None)
+    await _metrics_runner.setup()
+    site = web.TCPSite(_metrics_runner, host, port)
+    await site.start()
+    bound = site._server.sockets[0].getsockname()[1]
+    logger.info(f"Metrics server listening on {host}:{bound}")
+    return bound
+
+async def stop_metrics_server():
+    global _metrics_runner
+    if _metrics_runner:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+
+async def stop_server():
+    """Stop accepting requests and let queued notifications finish"""
+    global _runner
+    if _runner:
+        await _runner.cleanup()
+        _runner = None
+    if _pending_tasks:
+        await asyncio.gather(*list(_pending_tasks), return_exceptions=True)